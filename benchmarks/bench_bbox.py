@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Times bounding boxes: pathdata.bbox of a long path (as tuples and packed)
+# and SVG.bbox of a group of many circles.
+#
+# usage: bench_bbox.py [number of points]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, pathdata
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    points = 200000
+    if len(sys.argv) > 1:
+        points = int(sys.argv[1])
+
+    random.seed(12345)
+    xys = [(random.random(), random.random()) for i in xrange(points)]
+    d = pathdata.poly(xys)
+    packed = pathdata.poly(xys, packed=True)
+    group = svg.SVG("g", *[svg.SVG("circle", x, y, 0.01) for x, y in xys[:points // 4]])
+
+    output, tpath = timeit(pathdata.bbox, d)
+    output, tpacked = timeit(pathdata.bbox, packed)
+    output, tgroup = timeit(group.bbox)
+    print "%d points: pathdata.bbox %.3fs, packed %.3fs; SVG.bbox of %d circles %.3fs" % (points, tpath, tpacked, points // 4, tgroup)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Times _curve.curve on string expressions, calling the Python function for
+# every sample versus running the compiled program natively (without the GIL),
+# and returning a tuple of points versus contiguous arrays.  Then compares
+# Curve.d for each of many curves with one Curve.sample_many.  First checks
+# that expressions too deeply nested for the native stack are still sampled
+# (by calling Python).
+#
+# usage: bench_curve.py [number of repetitions]
+
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, trans, curve, _curve
+
+expressions = ["sin(t), cos(t)", "x**2", "sqrt(t)*cos(30*t), sqrt(t)*sin(30*t)", "tan(x)"]
+
+if __name__ == "__main__":
+    repetitions = 100
+    if len(sys.argv) > 1:
+        repetitions = int(sys.argv[1])
+
+    for depth in 20, 40, 80:
+        deep = curve.Curve("t, 0.001*" + "(1+t*"*depth + "1" + ")"*depth, 0., 1.)
+        assert deep.f.program is None and len(deep.d()) > 1
+
+    window = trans.window(-5., 5., -5., 5., 0., 0., 1000., 1000.)
+
+    print "%-40s %8s %10s %10s %8s %10s" % ("expression", "samples", "python", "native", "speedup", "arrays")
+    for expr in expressions:
+        f = svg.canonical_parametric(expr)
+        times = []
+        for program, arrays in (None, False), (f.program, False), (f.program, True):
+            start = time.time()
+            for i in xrange(repetitions):
+                data = _curve.curve(f, [window], 0.01, 5., True, 12345, 15, 0.05, 5., program, arrays)
+            times.append(time.time() - start)
+        samples = len(data[0]) / 2
+        print "%-40s %8d %9.3fs %9.3fs %7.1fx %9.3fs" % (expr, samples, times[0], times[1], times[0] / times[1], times[2])
+
+    curves = []
+    for i in xrange(repetitions * 10):
+        c = curve.Curve(expressions[i % len(expressions)], 0.01, 5.)
+        c.transform(window)
+        curves.append(c)
+
+    start = time.time()
+    paths = [c.d() for c in curves]
+    each = time.time() - start
+    del paths
+    start = time.time()
+    curve.Curve.sample_many(curves)
+    many = time.time() - start
+    print
+    print "%d curves: d() each %.3fs, sample_many %.3fs" % (len(curves), each, many)
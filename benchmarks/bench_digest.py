@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# Times SVG.digest on a loaded drawing (all of it, then again after one
+# change), == on equal and unequal copies with and without digests, and
+# SVG.dedupe on a drawing made of repeated symbols.
+#
+# usage: bench_digest.py [number of groups]
+
+import os, sys, time, copy, StringIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg
+from bench_load import document
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    groups = 20000
+    if len(sys.argv) > 1:
+        groups = int(sys.argv[1])
+
+    one = svg.load_stream(StringIO.StringIO(document(groups)))
+    two = svg.loads(svg.dumps(one))
+    equal, tequal = timeit(lambda: one == two)
+    two[groups // 2, 0].attrib["d"] = "M 0 0 L 1 1"
+    two[groups // 2, 0].touch()
+    equal, tunequal = timeit(lambda: one == two)
+    print "== without digests: equal trees %.3fs, unequal %.3fs" % (tequal, tunequal)
+
+    digest, tfirst = timeit(one.digest)
+    digest, tagain = timeit(one.digest)
+    one[groups // 2, 0].attrib["d"] = "M 0 0 L 1 1"
+    one[groups // 2, 0].touch()
+    digest, tchanged = timeit(one.digest)
+    print "digest of %d elements: first %.3fs, unchanged %.3fs, after one change %.3fs" % (4*groups + 1, tfirst, tagain, tchanged)
+
+    two.digest()
+    equal, tequal = timeit(lambda: one == two)
+    two[groups // 2 + 1, 0].attrib["d"] = "M 0 0 L 1 1"
+    two[groups // 2 + 1, 0].touch()
+    equal, tunequal = timeit(lambda: one == two)
+    print "== with digests: equal trees %.3fs, unequal %.3fs" % (tequal, tunequal)
+
+    symbol = svg.SVG("g", svg.SVG("circle", 0, 0, 5, fill="red"), svg.SVG("path", "M -5 -5 L 5 5 M -5 5 L 5 -5"), stroke="black")
+    drawing = svg.SVG("svg")(*[svg.SVG("g", copy.deepcopy(symbol), transform="translate(%d, %d)" % (i % 100, i // 100)) for i in xrange(groups)])
+    before = len(drawing.xml())
+    moved, tdedupe = timeit(drawing.dedupe)
+    print "dedupe of %d repeated symbols %.3fs: %d moved to <defs>, XML from %.1f to %.1f MB" % (
+        groups, tdedupe, moved, before / 1048576., len(drawing.xml()) / 1048576.)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+# Times svg.dumps and svg.loads next to cPickle (protocol 2) on a loaded
+# drawing (all strings) and on a rendered figure (numbers and pathdata),
+# and compares the sizes of what they make.
+#
+# usage: bench_dumps.py [number of groups] [number of curves]
+
+import os, sys, time, gc, math, StringIO, cPickle
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, curve, plot
+from bench_load import document
+
+def timeit(func, *args):
+    # the best of a few runs, since some of these take only milliseconds
+    best = None
+    for i in xrange(5):
+        gc.collect()
+        start = time.time()
+        output = func(*args)
+        if best is None or time.time() - start < best:
+            best = time.time() - start
+    return output, best
+
+def compare(name, tree):
+    pickled, tpickle = timeit(cPickle.dumps, tree, cPickle.HIGHEST_PROTOCOL)
+    unpickled, tunpickle = timeit(cPickle.loads, pickled)
+    dumped, tdumps = timeit(svg.dumps, tree)
+    loaded, tloads = timeit(svg.loads, dumped)
+    assert loaded.xml() == tree.xml()
+    print "%s:" % name
+    print "    cPickle    %8.1f kB  dumps %.3fs  loads %.3fs" % (len(pickled) / 1024., tpickle, tunpickle)
+    print "    svg.dumps  %8.1f kB  dumps %.3fs  loads %.3fs" % (len(dumped) / 1024., tdumps, tloads)
+
+if __name__ == "__main__":
+    groups, curves = 20000, 200
+    if len(sys.argv) > 1:
+        groups = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        curves = int(sys.argv[2])
+
+    compare("loaded drawing of %d groups" % groups, svg.load_stream(StringIO.StringIO(document(groups))))
+
+    fig = plot.Fig(*[curve.Curve("t, sin(t + %g)" % (i * 0.1), 0, 2*math.pi, stroke="blue") for i in xrange(curves)])
+    fig.svg()
+    rendered = svg.SVG("g", *[child.svg() or child._svg for child in fig._svg.children])
+    compare("rendered figure of %d curves" % curves, rendered)
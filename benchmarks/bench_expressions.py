@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Times building many Curves and Delay transformations from the same few
+# expression strings, with svg.expression_cache on and off.
+#
+# usage: bench_expressions.py [number of objects]
+
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, trans, curve
+
+expressions = ["x**2", "sin(x)", "t, t**2", "z**3"]
+transformations = ["x + 1, y", "z * 1j", "x*2, y*2"]
+
+def build(number):
+    for i in xrange(number):
+        curve.Curve(expressions[i % len(expressions)], 0., 1.)
+        trans.Delay().transform(transformations[i % len(transformations)])
+
+if __name__ == "__main__":
+    number = 10000
+    if len(sys.argv) > 1:
+        number = int(sys.argv[1])
+
+    maxsize = svg.expression_cache.maxsize
+    for name, size in ("no cache", 0), ("cache", maxsize):
+        svg.expression_cache.clear()
+        svg.expression_cache.maxsize = size
+        start = time.time()
+        build(number)
+        print "%-10s %8.3fs  %r" % (name, time.time() - start, svg.expression_cache)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+# Times Fig.fit on a Fig of Delay groups (whose bounding boxes need a render
+# and a transformed copy), the first time and again after changing one group.
+#
+# usage: bench_fit.py [number of groups] [circles per group]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, trans, plot
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    groups, circles = 1000, 20
+    if len(sys.argv) > 1:
+        groups = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        circles = int(sys.argv[2])
+
+    random.seed(12345)
+    fig = plot.Fig()
+    for i in xrange(groups):
+        group = trans.Delay(*[svg.SVG("circle", random.random(), random.random(), 0.01) for j in xrange(circles)])
+        group.transform(svg.Affine(1., 0., 0., 1., i, 0.))
+        fig.append(group)
+
+    output, tfirst = timeit(fig.fit)
+    fig.children[groups // 2].children[0]["r"] = 0.5
+    output, tsecond = timeit(fig.fit)
+    output, tthird = timeit(fig.fit)
+    print "%d groups of %d circles: fit %.3fs, after changing one circle %.3fs, unchanged %.3fs" % (groups, circles, tfirst, tsecond, tthird)
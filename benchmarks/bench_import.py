@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# Measures how long it takes to start a process and import svgfig, with and
+# without an X display.  The viewer (cairo, rsvg, gtk) should never be loaded
+# by an import; it is only created by the first call to SVG.view().
+
+import os, sys, subprocess, time
+
+repeat = 20
+statement = "import svgfig.interactive, sys; sys.exit(int('gtk' in sys.modules or 'cairo' in sys.modules))"
+directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+def startup(env):
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        status = subprocess.call([sys.executable, "-c", statement], cwd=directory, env=env)
+        times.append(time.time() - start)
+        if status != 0:
+            raise RuntimeError, "import svgfig failed or loaded the viewer (exit status %d)" % status
+    times.sort()
+    return times[0], times[len(times)//2]
+
+def baseline():
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.call([sys.executable, "-c", "pass"])
+        times.append(time.time() - start)
+    times.sort()
+    return times[0], times[len(times)//2]
+
+if __name__ == "__main__":
+    nodisplay = dict(os.environ)
+    nodisplay.pop("DISPLAY", None)
+
+    print "%-24s %10s %10s" % ("", "best (ms)", "median (ms)")
+    print "%-24s %10.1f %10.1f" % (("python -c pass",) + tuple(1000.*t for t in baseline()))
+    print "%-24s %10.1f %10.1f" % (("import (no display)",) + tuple(1000.*t for t in startup(nodisplay)))
+    if "DISPLAY" in os.environ:
+        print "%-24s %10.1f %10.1f" % (("import (DISPLAY=%s)" % os.environ["DISPLAY"],) + tuple(1000.*t for t in startup(dict(os.environ))))
+    else:
+        print "(DISPLAY is not set; skipping the with-display measurement)"
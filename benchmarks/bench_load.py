@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# Times svg.load_stream on a generated drawing, next to expat parsing the
+# same bytes with no callbacks (the most that a loader could hope for).
+# Streaming (iter_load_stream for just the paths, iter_template) runs first,
+# so that its peak memory is not hidden by the full load's.
+#
+# usage: bench_load.py [number of groups]
+
+import os, sys, time, random, StringIO, tempfile, resource
+import xml.parsers.expat
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+def document(groups):
+    random.seed(12345)
+    parts = ['<?xml version="1.0" standalone="no"?>\n<svg xmlns="http://www.w3.org/2000/svg" width="400" height="400">\n']
+    for i in xrange(groups):
+        x, y = random.random()*400., random.random()*400.
+        parts.append('  <g id="g%d" style="stroke:black; fill:none">\n' % i)
+        parts.append('    <path d="M %g %g L %g %g L %g %g Z"/>\n' % (x, y, x + 5., y, x, y + 5.))
+        parts.append('    <ellipse cx="%g" cy="%g" rx="2" ry="1"/>\n' % (x, y))
+        parts.append('    <title>point %d &amp; label</title>\n' % i)
+        parts.append('  </g>\n')
+    parts.append('</svg>\n')
+    return "".join(parts)
+
+def bare_expat(data):
+    parser = xml.parsers.expat.ParserCreate()
+    parser.Parse(data, True)
+
+if __name__ == "__main__":
+    groups = 100000
+    if len(sys.argv) > 1:
+        groups = int(sys.argv[1])
+
+    data = document(groups)
+    megabytes = len(data) / 1048576.
+
+    def maxrss():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+    before = maxrss()
+    paths, tpaths = timeit(lambda: sum([1 for treeindex, path in svg.iter_load_stream(StringIO.StringIO(data), "path")]))
+    print "iter_load_stream of %d paths %.3fs, peak memory +%.0f MB" % (paths, tpaths, maxrss() - before)
+
+    fd, fileName = tempfile.mkstemp(suffix=".svg")
+    os.write(fd, data.replace('<title>point 0 &amp; label</title>', '<REPLACEME/>'))
+    os.close(fd)
+    try:
+        before = maxrss()
+        output, ttemplate = timeit(lambda: sum([len(line) for line in svg.iter_template(fileName, svg.SVG("circle", 1, 1, 1))]))
+        print "iter_template %.3fs, peak memory +%.0f MB" % (ttemplate, maxrss() - before)
+    finally:
+        os.unlink(fileName)
+
+    before = maxrss()
+    output, tload = timeit(svg.load_stream, StringIO.StringIO(data))
+    output, texpat = timeit(bare_expat, data)
+    print "%.1f MB (%d elements): load_stream %.3fs (%.1f MB/s), peak memory +%.0f MB; bare expat %.3fs" % (megabytes, 4*groups + 1, tload, megabytes/tload, maxrss() - before, texpat)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Times svg.load_many on a directory of generated drawings (half .svgz, half
+# .svg), next to calling svg.load on each file in turn.
+#
+# usage: bench_load_many.py [number of files] [groups per file] [workers]
+
+import os, sys, time, gzip, shutil, tempfile, gc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg
+from bench_load import document
+
+def timeit(func, *args):
+    gc.collect()  # don't charge this run for collecting the last one's output
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    files, groups, workers = 200, 500, None
+    if len(sys.argv) > 1:
+        files = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        groups = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+
+    directory = tempfile.mkdtemp()
+    try:
+        data = document(groups)
+        fileNames = []
+        for i in xrange(files):
+            if i % 2 == 0:
+                fileName = os.path.join(directory, "drawing%d.svgz" % i)
+                f = gzip.GzipFile(fileName, "wb")
+            else:
+                fileName = os.path.join(directory, "drawing%d.svg" % i)
+                f = file(fileName, "wb")
+            f.write(data)
+            f.close()
+            fileNames.append(fileName)
+
+        output, tload = timeit(lambda: [svg.load(fileName) for fileName in fileNames])
+        print "%d files of %d elements: load one by one %.3fs" % (files, 4*groups + 1, tload)
+        del output
+
+        for w in 1, workers:
+            output, tmany = timeit(svg.load_many, fileNames, w)
+            seconds = [item[1] for item in output]
+            print "load_many(workers=%s) %.3fs: per file %.4fs to %.4fs, peak memory %.0f MB" % (
+                w, tmany, min(seconds), max(seconds), max([item[2] for item in output]) / 1048576.)
+            del output
+
+        output, tserialized = timeit(svg.load_many, fileNames, workers, True)
+        print "load_many(workers=%s, serialized=True) %.3fs" % (workers, tserialized)
+    finally:
+        shutil.rmtree(directory)
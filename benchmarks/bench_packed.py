@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+# Compares list-of-tuples pathdata with pathdata.Packed on a long polyline:
+# memory per vertex (sys.getsizeof of everything it holds) and the time to
+# transform, bbox, and serialize it.
+#
+# usage: bench_packed.py [number of vertices]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import pathdata, svg
+
+def sizeof(d):
+    if isinstance(d, pathdata.Packed):
+        return sys.getsizeof(d.commands) + sys.getsizeof(d.coordinates)
+    else:
+        # command strings are interned, so they're shared
+        return sys.getsizeof(d) + sum([sys.getsizeof(datum) + sum([sys.getsizeof(x) for x in datum[1:]]) for datum in d])
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    vertices = 1000000
+    if len(sys.argv) > 1:
+        vertices = int(sys.argv[1])
+
+    random.seed(12345)
+    points = [(random.uniform(-1000, 1000), random.uniform(-1000, 1000)) for i in xrange(vertices)]
+    func = lambda x, y: (2.*x + 1., 3.*y - 1.)
+
+    print "%-8s %12s %10s %10s %10s" % ("form", "bytes/vertex", "transform", "bbox", "xml")
+    for name, packed in ("list", False), ("packed", True):
+        d = pathdata.poly(points, packed=packed)
+        memory = float(sizeof(d)) / vertices
+
+        transformed, ttransform = timeit(pathdata.transform, func, d)
+        bbox, tbbox = timeit(pathdata.bbox, d)
+        xml, txml = timeit(svg.attrib_to_xml, "path", "d", d)
+        print "%-8s %12.1f %9.3fs %9.3fs %9.3fs" % (name, memory, ttransform, tbbox, txml)
+        del d, transformed, xml
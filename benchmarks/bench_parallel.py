@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# Times Curve.d on an expensive Python function (a numerical integral per
+# point) with Curve.parallel = 0 (serial) and with several workers, and
+# checks that the path is the same as the serial one, with and without
+# random_sampling.
+#
+# usage: bench_parallel.py [max number of workers]
+
+import os, sys, time, math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import trans, curve
+
+if __name__ == "__main__":
+    workers = 4
+    if len(sys.argv) > 1:
+        workers = int(sys.argv[1])
+
+    curve.sampling_cache.maxsize = 0
+
+    for random_sampling in False, True:
+        # only math in the function, so that worker processes can rebuild it
+        c = curve.Curve(lambda t: (t, sum([math.exp(-(i*t/2000.)**2) for i in xrange(2000)]) * t/2000.), -3., 3., random_sampling=random_sampling)
+        c.transform(trans.window(-3., 3., -1., 1., 0., 0., 1000., 1000.))
+
+        serial = None
+        for parallel in [0] + range(1, workers + 1):
+            c.parallel = parallel
+            start = time.time()
+            d = c.d()
+            if serial is None:
+                serial = d
+            print "random_sampling=%-5s parallel=%d %8.3fs  %d commands, same as serial: %s" % (random_sampling, parallel, time.time() - start, len(d), d == serial)
+            assert d == serial
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Measures the throughput of pathdata.parse in MB/s of path data, for a few
+# styles of "d" attribute (long polylines, compact numbers without
+# separators, curves, and arcs).
+#
+# usage: bench_pathdata.py [size in MB]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import pathdata
+
+def polyline(size):
+    output = ["M 0 0"]
+    length = 5
+    while length < size:
+        word = "L %.3f %.3f" % (random.uniform(-1000, 1000), random.uniform(-1000, 1000))
+        output.append(word)
+        length += len(word) + 1
+    return " ".join(output)
+
+def compact(size):
+    output = ["M0,0l"]
+    length = 5
+    while length < size:
+        word = "%.2f%.2f" % (random.uniform(-10, 10), random.uniform(-10, 10))
+        output.append(word)
+        length += len(word)
+    return "".join(output).replace("0.", ".")
+
+def curves(size):
+    output = ["M 0,0 C"]
+    length = 7
+    while length < size:
+        word = ",".join(["%.4g" % random.uniform(-100, 100) for i in xrange(6)])
+        output.append(word)
+        length += len(word) + 1
+    return " ".join(output)
+
+def arcs(size):
+    output = ["M 0,0 A"]
+    length = 7
+    while length < size:
+        word = "%.3g %.3g %.3g %d %d %.3g %.3g" % (random.uniform(1, 10), random.uniform(1, 10), random.uniform(0, 360),
+                                                  random.randint(0, 1), random.randint(0, 1), random.uniform(-100, 100), random.uniform(-100, 100))
+        output.append(word)
+        length += len(word) + 1
+    return " ".join(output)
+
+if __name__ == "__main__":
+    megabytes = 4.
+    if len(sys.argv) > 1:
+        megabytes = float(sys.argv[1])
+    size = int(megabytes * 1024 * 1024)
+
+    random.seed(12345)
+    print "%-10s %10s %10s %10s" % ("style", "MB", "commands", "MB/s")
+    for name, generator in ("polyline", polyline), ("compact", compact), ("curves", curves), ("arcs", arcs):
+        d = generator(size)
+        start = time.time()
+        output = pathdata.parse(d)
+        seconds = time.time() - start
+        print "%-10s %10.2f %10d %10.2f" % (name, len(d)/1024./1024., len(output), len(d)/1024./1024./seconds)
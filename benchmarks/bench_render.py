@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+# Times rendering a Fig that holds a large scatter plot: Fig.svg (which
+# transforms every child) and the XML serialization of the result, then
+# rendering it again after changing one point (which only redoes that point).
+#
+# usage: bench_render.py [number of points]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, trans, plot
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+if __name__ == "__main__":
+    points = 50000
+    if len(sys.argv) > 1:
+        points = int(sys.argv[1])
+
+    random.seed(12345)
+    fig = plot.Fig(*[svg.SVG("circle", random.random(), random.random(), 0.01) for i in xrange(points)])
+    fig.xmin, fig.xmax, fig.ymin, fig.ymax = 0., 1., 0., 1.
+
+    output, tsvg = timeit(fig.svg)
+    xml, txml = timeit(lambda: trans.evaluate(fig).xml())
+    print "%d points: Fig.svg %.3fs, evaluate + xml %.3fs" % (points, tsvg, txml)
+
+    canvas = plot.Canvas(400., 400., *fig.children)
+    canvas.xmin, canvas.xmax, canvas.ymin, canvas.ymax = 0., 1., 0., 1.
+    first, tfirst = timeit(canvas.xml)
+    canvas.children[points // 2]["r"] = 0.02
+    second, tsecond = timeit(canvas.xml)
+    print "Canvas.xml %.3fs, again after changing one point %.3fs" % (tfirst, tsecond)
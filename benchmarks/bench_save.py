@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+# Measures how much the peak memory of a process grows while SVG.save()
+# writes a scatter plot, for documents of increasing size.  With the
+# streaming serializer, the growth should not depend on the document size.
+
+import os, sys, subprocess, tempfile
+
+directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+child = """
+import sys, resource, time
+from svgfig.svg import SVG
+points = int(sys.argv[1])
+fileName = sys.argv[2]
+doc = SVG("g", *[SVG("circle", i*0.001, (i*7919 % 1000)*0.1, 0.5) for i in xrange(points)])
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+doc.save(fileName)
+print time.time() - start, before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+if __name__ == "__main__":
+    fd, fileName = tempfile.mkstemp(".svg", "svgfig-bench-")
+    os.close(fd)
+
+    print "%10s %12s %12s %14s" % ("points", "output (MB)", "time (s)", "growth (MB)")
+    try:
+        for points in 10000, 100000, 300000:
+            output = subprocess.Popen([sys.executable, "-c", child, str(points), fileName], cwd=directory, stdout=subprocess.PIPE).communicate()[0]
+            seconds, before, after = output.split()
+            print "%10d %12.1f %12.2f %14.1f" % (points, os.path.getsize(fileName)/1024./1024., float(seconds), (int(after) - int(before))/1024.)
+    finally:
+        os.remove(fileName)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# Compares calling a transformation once per point with its batch apply(xs, ys),
+# for the standard transformations and for a 10^6-point polyline's path data
+# (list and packed forms) pushed through pathdata.transform.
+#
+# usage: bench_transform.py [number of points]
+
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import svg, trans, pathdata
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+if __name__ == "__main__":
+    points = 1000000
+    if len(sys.argv) > 1:
+        points = int(sys.argv[1])
+
+    random.seed(12345)
+    xs = [random.uniform(1., 1000.) for i in xrange(points)]
+    ys = [random.uniform(1., 1000.) for i in xrange(points)]
+    polyline = pathdata.poly(zip(xs, ys))
+    packed = pathdata.poly(zip(xs, ys), packed=True)
+
+    transformations = [("window", trans.window(0., 1000., 0., 1000.)),
+                       ("window (log)", trans.window(1., 1000., 1., 1000., xlogbase=10, ylogbase=10)),
+                       ("rotation", trans.rotation(0.5, 10., 10.)),
+                       ("x, y string", svg.canonical_transformation("x + 0.1*y, y - 0.1*x")),
+                       ("z string", svg.canonical_transformation("z**2")),
+                       ]
+
+    print "%-14s %10s %10s %10s %10s" % ("", "per point", "apply", "list d", "packed d")
+    for name, func in transformations:
+        perpoint = timeit(map, func, xs, ys)
+        apply = timeit(func.apply, xs, ys)
+        listd = timeit(pathdata.transform, func, polyline)
+        packedd = timeit(pathdata.transform, func, packed)
+        print "%-14s %9.3fs %9.3fs %9.3fs %9.3fs" % (name, perpoint, apply, listd, packedd)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Compares the explicit-stack traversals in svgfig (walk, tonumber, bbox,
+# svg_to_xml) with the recursive versions they replaced, on a wide tree of
+# about 10^6 nodes and on a deeply nested chain of groups.
+#
+# usage: bench_traversal.py [number of nodes] [depth of the nested chain]
+
+import os, sys, time, copy, itertools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from svgfig import defaults
+from svgfig.svg import SVG, svg_to_xml, attrib_to_xml
+
+############################### the recursive implementations, as they were
+
+class _SVGDepthIterator:
+    def __init__(self, svg, treeindex, depth_limit, attrib, attrib_first):
+        self.current = svg
+        self.treeindex = treeindex
+        self.shown = False
+        self.depth_limit = depth_limit
+        self.attrib = attrib
+        self.attrib_first = attrib_first
+
+    def __iter__(self):
+        return self
+
+    def make_children_iterators(self):
+        if getattr(self.current, "children", None) is not None:
+            for i, s in enumerate(self.current.children):
+                self.iterators.append(self.__class__(s, self.treeindex + (i,), self.depth_limit, self.attrib, self.attrib_first))
+
+    def make_attrib_iterators(self):
+        if getattr(self.current, "attrib", None) is not None:
+            items = self.current.attrib.items()
+            items.sort()
+            for k, s in items:
+                self.iterators.append(self.__class__(s, self.treeindex + (k,), self.depth_limit, self.attrib, self.attrib_first))
+
+    def next(self):
+        if not self.shown:
+            self.shown = True
+            if self.treeindex != ():
+                return self.treeindex, self.current
+
+        if self.depth_limit is not None and len(self.treeindex) >= self.depth_limit:
+            raise StopIteration
+
+        if "iterators" not in self.__dict__:
+            self.iterators = []
+
+            if self.attrib and self.attrib_first:
+                self.make_attrib_iterators()
+            self.make_children_iterators()
+            if self.attrib and not self.attrib_first:
+                self.make_attrib_iterators()
+
+            self.iterators = itertools.chain(*self.iterators)
+
+        return self.iterators.next()
+
+def recursive_walk(svg):
+    return _SVGDepthIterator(svg, (), None, False, False)
+
+def recursive_tonumber(svg):
+    if svg.tag is not None:
+        tonumber_tag = getattr(defaults, "tonumber_%s" % svg.tag, None)
+        if tonumber_tag is not None:
+            tonumber_tag(svg)
+
+    for child in svg.children:
+        if isinstance(child, SVG):
+            recursive_tonumber(child)
+
+def recursive_bbox(svg):
+    if svg.tag is not None:
+        tonumber_tag = getattr(defaults, "tonumber_%s" % svg.tag, None)
+        if tonumber_tag is not None:
+            tonumber_tag(svg)
+
+        bbox_tag = getattr(defaults, "bbox_%s" % svg.tag, None)
+        if bbox_tag is not None:
+            output = bbox_tag(svg)
+        else:
+            output = defaults.BBox(None, None, None, None)
+
+    for child in svg.children:
+        if isinstance(child, SVG):
+            output += recursive_bbox(child)
+    return output
+
+def recursive_svg_to_xml(svg, indent, depth=0):
+    if isinstance(svg, SVG) and svg.tag is None:
+        svg.svg()
+        svg = svg._svg
+
+    if isinstance(svg, basestring):
+        return [svg]
+
+    elif isinstance(svg, SVG):
+        line = [indent * depth, u"<", svg.tag, u" "]
+        remaining = copy.copy(svg.attrib)
+
+        try:
+            line.append(u"id=\"%s\" " % remaining.pop("id"))
+        except KeyError:
+            pass
+
+        signature = getattr(defaults, "signature_%s" % svg.tag, None)
+        if signature is not None:
+            for name in signature:
+                try:
+                    line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining.pop(name))))
+                except KeyError: pass
+
+        remainingkeys = remaining.keys()
+        remainingkeys.sort()
+        for name in remainingkeys:
+            line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining[name])))
+
+        if len(svg.children) == 0:
+            line.append(u"/>")
+            return [u"".join(line)]
+
+        else:
+            line.append(u">")
+
+            if svg.tag in ("text", "tspan"):
+                for i in svg.children:
+                    line.extend(recursive_svg_to_xml(i, indent, 0))
+                line.append(u"</%s>" % (svg.tag))
+                return [u"".join(line)]
+
+            else:
+                lines = [u"".join(line)]
+                for i in svg.children:
+                    lines.extend(recursive_svg_to_xml(i, indent, depth+1))
+                lines.append(u"%s</%s>" % (indent * depth, svg.tag))
+                return lines
+
+    else:
+        raise TypeError, "SVG contains an unrecognized object: %s" % type(svg)
+
+############################### test trees
+
+def wide_tree(nodes):
+    groups = int(nodes**0.5)
+    return SVG("g", *[SVG("g", *[SVG("circle", i, j, 1) for j in xrange(groups - 1)]) for i in xrange(groups)])
+
+def deep_tree(depth):
+    top = g = SVG("g")
+    for i in xrange(depth):
+        h = SVG("g", SVG("circle", i, i, 1))
+        g.append(h)
+        g = h
+    return top
+
+def timed(func, *args):
+    start = time.time()
+    try:
+        func(*args)
+    except RuntimeError, err:
+        return "%-10s" % "fails"
+    return "%10.2f" % (time.time() - start)
+
+def consume(iterator):
+    for x in iterator:
+        pass
+
+if __name__ == "__main__":
+    nodes = 1000000
+    depth = 5000
+    if len(sys.argv) > 1:
+        nodes = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        depth = int(sys.argv[2])
+
+    trees = [("wide (%d nodes)" % nodes, wide_tree(nodes)), ("deep (%d levels)" % depth, deep_tree(depth))]
+
+    operations = [("walk", lambda svg: consume(recursive_walk(svg)), lambda svg: consume(svg.walk())),
+                  ("tonumber", recursive_tonumber, lambda svg: svg.tonumber()),
+                  ("bbox", recursive_bbox, lambda svg: svg.bbox()),
+                  ("svg_to_xml", lambda svg: recursive_svg_to_xml(svg, u""), lambda svg: svg_to_xml(svg, u"")),
+                  ]
+
+    print "%-20s %-12s %14s %14s" % ("tree", "operation", "recursive (s)", "stack (s)")
+    for treename, tree in trees:
+        for opname, recursive, stack in operations:
+            print "%-20s %-12s %14s %14s" % (treename, opname, timed(recursive, tree), timed(stack, tree))
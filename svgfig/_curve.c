@@ -11,18 +11,98 @@ struct sample {
   struct sample *right;
 };
 
+/* sample nodes are allocated from slabs that are all released at once when a call is done */
+#define POOL_SLAB 1024
+
+struct slab {
+  struct slab *next;
+  struct sample nodes[POOL_SLAB];
+};
+
+struct pool {
+  struct slab *slabs;    /* all slabs, kept for reuse until _curve_freepool */
+  struct slab *current;  /* the one being filled */
+  int used;              /* nodes taken from current */
+  long allocated;        /* slabs malloc'ed since _curve_initpool */
+};
+
+/* counts for the last call to curve() or curve_many(), returned by node_counts() */
+/* each call counts in its own common_block and pool and sets these with the GIL held */
+static long _curve_created = 0;
+static long _curve_kept = 0;
+static long _curve_slabs = 0;
+
+/* a postfix program for an expression of t, compiled by svg._compile_program */
+enum _curve_opcode {
+  OP_T, OP_CONST, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_POW, OP_NEG,
+  OP_SIN, OP_COS, OP_TAN, OP_ASIN, OP_ACOS, OP_ATAN, OP_SINH, OP_COSH, OP_TANH,
+  OP_EXP, OP_LOG, OP_LOG10, OP_SQRT, OP_FABS, OP_FLOOR, OP_CEIL,
+  OP_ATAN2, OP_HYPOT, OP_LOGBASE
+};
+
+static const struct {
+  const char *name;
+  int opcode;
+  int pops;
+} _curve_opnames[] = {
+  {"t", OP_T, 0}, {"+", OP_ADD, 2}, {"-", OP_SUB, 2}, {"*", OP_MUL, 2}, {"/", OP_DIV, 2}, {"**", OP_POW, 2}, {"neg", OP_NEG, 1},
+  {"sin", OP_SIN, 1}, {"cos", OP_COS, 1}, {"tan", OP_TAN, 1}, {"asin", OP_ASIN, 1}, {"acos", OP_ACOS, 1}, {"atan", OP_ATAN, 1},
+  {"sinh", OP_SINH, 1}, {"cosh", OP_COSH, 1}, {"tanh", OP_TANH, 1}, {"exp", OP_EXP, 1}, {"log", OP_LOG, 1}, {"log10", OP_LOG10, 1},
+  {"sqrt", OP_SQRT, 1}, {"fabs", OP_FABS, 1}, {"floor", OP_FLOOR, 1}, {"ceil", OP_CEIL, 1},
+  {"atan2", OP_ATAN2, 2}, {"hypot", OP_HYPOT, 2}, {"logbase", OP_LOGBASE, 2},
+  {NULL, 0, 0}
+};
+
+#define PROGRAM_STACK 32
+
+struct instruction {
+  int opcode;
+  double constant;
+};
+
+/* an Affine transformation: x, y -> a*x + c*y + e, b*x + d*y + f */
+struct affine {
+  double a, b, c, d, e, f;
+};
+
 struct common_block {
   PyObject *parametric;
   PyObject *listoftrans;
   int counter;
-  PyObject *random_sampling;
+  int random_sampling;
   int recursion_limit;
+  int depth;  /* of the first node, when sampling part of a larger curve */
+  int prune;
   double linearity_limit;
   double discontinuity_limit;
   unsigned int MT[624];
   int count624;
+
+  /* with random sampling, each of the eight intervals at depth 3 draws from its own stream, seeded */
+  /* with random_seed + 1 + piece, so that sampling them separately gives the same points */
+  int random_seed;
+  int piece;
+  unsigned int topMT[624];  /* the stream for depths 0-2, set aside while an interval is sampled */
+  int topcount624;
+
+  /* native evaluation: used when the parametric function has a program and every transformation is an Affine */
+  struct instruction *program;
+  int programlength;
+  struct affine *affines;
+  int ntrans;
+  int allaffine;
+  int native;
+  PyThreadState *threadstate;  /* not NULL while the sampler runs without the GIL */
+
+  struct pool pool;
+  long created;  /* nodes, for node_counts() */
+  long kept;
 };
 
+/* take and give back the GIL around the (rare) calls into Python while sampling natively */
+#define CURVE_ACQUIRE(block) PyThreadState *_saved = (block)->threadstate; if (_saved != NULL) { (block)->threadstate = NULL; PyEval_RestoreThread(_saved); }
+#define CURVE_RELEASE(block) if (_saved != NULL) { (block)->threadstate = PyEval_SaveThread(); }
+
 /* An implementation of the Mersenne Twistor random algorithm */
 /* Copyright (C) 1997 Makoto Matsumoto and Takuji Nishimura. */
 /* Copied from ROOT's TRandom3 */
@@ -75,32 +155,201 @@ static double _curve_random(struct common_block *block) {
    return _curve_random(block);
 }
 
-/* evaluate parametric function at a point, passing it through a list of coordinate transformations */
-static int _curve_eval(PyObject *parametric, PyObject *listoftrans, double t, double *fx, double *fy) {
-  PyObject *args = Py_BuildValue("(d)", t);
-  PyObject *result = PyObject_CallObject(parametric, args);
-  if (result == NULL) {
-    Py_DECREF(args);
+/* translate a program tuple (strings for operations, floats for constants) into instructions */
+static int _curve_program(PyObject *tuple, struct instruction **output, int *length) {
+  *output = NULL;
+  *length = 0;
+  if (tuple == Py_None) return 1;
+
+  if (!PyTuple_Check(tuple)) {
+    PyErr_SetString(PyExc_TypeError, "program must be a tuple or None");
     return 0;
   }
-  Py_DECREF(args);
 
-  if (!PySequence_Check(result)  ||  PySequence_Size(result) != 2) {
-    PyErr_SetString(PyExc_TypeError, "The parametric function must return two real values.");
-    Py_DECREF(result);
+  int n = PyTuple_Size(tuple);
+  struct instruction *code = (struct instruction*)malloc(sizeof(struct instruction) * (n > 0 ? n : 1));
+  if (code == NULL) {
+    PyErr_NoMemory();
     return 0;
   }
-  
-  PyObject *x = PySequence_GetItem(result, 0);
-  PyObject *y = PySequence_GetItem(result, 1);
-  Py_DECREF(result);
 
-  if (!PyNumber_Check(x)  ||  !PyNumber_Check(y)) {
-    PyErr_SetString(PyExc_TypeError, "The parametric function must return two real values.");
-    Py_DECREF(x);
-    Py_DECREF(y);
+  int i, j, depth = 0;
+  for (i = 0;  i < n;  i++) {
+    PyObject *item = PyTuple_GET_ITEM(tuple, i);
+    int pops = 0;
+
+    if (PyFloat_Check(item)) {
+      code[i].opcode = OP_CONST;
+      code[i].constant = PyFloat_AS_DOUBLE(item);
+    }
+    else if (PyString_Check(item)) {
+      for (j = 0;  _curve_opnames[j].name != NULL;  j++) {
+        if (strcmp(_curve_opnames[j].name, PyString_AS_STRING(item)) == 0) break;
+      }
+      if (_curve_opnames[j].name == NULL) {
+        PyErr_Format(PyExc_ValueError, "program has an unrecognized operation \"%s\"", PyString_AS_STRING(item));
+        free(code);
+        return 0;
+      }
+      code[i].opcode = _curve_opnames[j].opcode;
+      code[i].constant = 0.;
+      pops = _curve_opnames[j].pops;
+    }
+    else {
+      PyErr_SetString(PyExc_TypeError, "program items must be operation names or floats");
+      free(code);
+      return 0;
+    }
+
+    /* every operation pops its arguments and pushes one value */
+    if (depth < pops  ||  depth + 1 - pops > PROGRAM_STACK) {
+      PyErr_SetString(PyExc_ValueError, "program underflows or overflows its stack");
+      free(code);
+      return 0;
+    }
+    depth += 1 - pops;
+  }
+
+  if (depth != 2) {
+    PyErr_SetString(PyExc_ValueError, "program must leave x and y on the stack");
+    free(code);
+    return 0;
+  }
+
+  *output = code;
+  *length = n;
+  return 1;
+}
+
+/* run a program; returns 0 if any value is infinite or NaN, so that Python can decide what that means (or raise the error) */
+static int _curve_run(const struct instruction *code, int length, double t, double *fx, double *fy) {
+  double stack[PROGRAM_STACK];
+  int sp = 0;
+  int i;
+  for (i = 0;  i < length;  i++) {
+    switch (code[i].opcode) {
+      case OP_T:       stack[sp++] = t;  break;
+      case OP_CONST:   stack[sp++] = code[i].constant;  break;
+      case OP_ADD:     sp--;  stack[sp-1] = stack[sp-1] + stack[sp];  break;
+      case OP_SUB:     sp--;  stack[sp-1] = stack[sp-1] - stack[sp];  break;
+      case OP_MUL:     sp--;  stack[sp-1] = stack[sp-1] * stack[sp];  break;
+      case OP_DIV:     sp--;  stack[sp-1] = stack[sp-1] / stack[sp];  break;
+      case OP_POW:     sp--;  stack[sp-1] = pow(stack[sp-1], stack[sp]);  break;
+      case OP_NEG:     stack[sp-1] = -stack[sp-1];  break;
+      case OP_SIN:     stack[sp-1] = sin(stack[sp-1]);  break;
+      case OP_COS:     stack[sp-1] = cos(stack[sp-1]);  break;
+      case OP_TAN:     stack[sp-1] = tan(stack[sp-1]);  break;
+      case OP_ASIN:    stack[sp-1] = asin(stack[sp-1]);  break;
+      case OP_ACOS:    stack[sp-1] = acos(stack[sp-1]);  break;
+      case OP_ATAN:    stack[sp-1] = atan(stack[sp-1]);  break;
+      case OP_SINH:    stack[sp-1] = sinh(stack[sp-1]);  break;
+      case OP_COSH:    stack[sp-1] = cosh(stack[sp-1]);  break;
+      case OP_TANH:    stack[sp-1] = tanh(stack[sp-1]);  break;
+      case OP_EXP:     stack[sp-1] = exp(stack[sp-1]);  break;
+      case OP_LOG:     stack[sp-1] = log(stack[sp-1]);  break;
+      case OP_LOG10:   stack[sp-1] = log10(stack[sp-1]);  break;
+      case OP_SQRT:    stack[sp-1] = sqrt(stack[sp-1]);  break;
+      case OP_FABS:    stack[sp-1] = fabs(stack[sp-1]);  break;
+      case OP_FLOOR:   stack[sp-1] = floor(stack[sp-1]);  break;
+      case OP_CEIL:    stack[sp-1] = ceil(stack[sp-1]);  break;
+      case OP_ATAN2:   sp--;  stack[sp-1] = atan2(stack[sp-1], stack[sp]);  break;
+      case OP_HYPOT:   sp--;  stack[sp-1] = hypot(stack[sp-1], stack[sp]);  break;
+      case OP_LOGBASE: sp--;  stack[sp-1] = log(stack[sp-1]) / log(stack[sp]);  break;  /* how Python's math.log(x, base) does it */
+    }
+    if (!Py_IS_FINITE(stack[sp-1])) return 0;
+  }
+  *fx = stack[0];
+  *fy = stack[1];
+  return 1;
+}
+
+/* the same arithmetic as svg.Affine.__call__ */
+static int _curve_affine(const struct affine *m, double *x, double *y) {
+  double X, Y;
+  if (m->b == 0.  &&  m->c == 0.) {
+    X = m->a * *x + m->e;
+    Y = m->d * *y + m->f;
+  }
+  else {
+    X = m->a * *x + m->c * *y + m->e;
+    Y = m->b * *x + m->d * *y + m->f;
+  }
+  *x = X;
+  *y = Y;
+  return Py_IS_FINITE(X)  &&  Py_IS_FINITE(Y);
+}
+
+/* if trans is an Affine (has a 6-tuple of floats called "matrix"), fill m and return 1 */
+static int _curve_getaffine(PyObject *trans, struct affine *m) {
+  if (!PyObject_HasAttrString(trans, "matrix")) return 0;
+  PyObject *matrix = PyObject_GetAttrString(trans, "matrix");
+  if (matrix == NULL) {
+    PyErr_Clear();
     return 0;
   }
+  double values[6];
+  int i;
+  if (!PyTuple_Check(matrix)  ||  PyTuple_Size(matrix) != 6) {
+    Py_DECREF(matrix);
+    return 0;
+  }
+  for (i = 0;  i < 6;  i++) {
+    PyObject *item = PyTuple_GET_ITEM(matrix, i);
+    if (!PyFloat_Check(item)  &&  !PyInt_Check(item)  &&  !PyLong_Check(item)) {
+      Py_DECREF(matrix);
+      return 0;
+    }
+    values[i] = PyFloat_AsDouble(item);
+  }
+  Py_DECREF(matrix);
+  m->a = values[0];  m->b = values[1];  m->c = values[2];
+  m->d = values[3];  m->e = values[4];  m->f = values[5];
+  return 1;
+}
+
+/* evaluate parametric function at a point, passing it through a list of coordinate transformations (all in Python) */
+static int _curve_eval_python(struct common_block *block, double t, double *fx, double *fy) {
+  PyObject *parametric = block->parametric;
+  PyObject *listoftrans = block->listoftrans;
+  PyObject *x, *y;
+  PyObject *args, *result;
+  double px, py;
+
+  if (block->program != NULL  &&  _curve_run(block->program, block->programlength, t, &px, &py)) {
+    x = PyFloat_FromDouble(px);
+    y = PyFloat_FromDouble(py);
+    if (x == NULL  ||  y == NULL) {
+      Py_XDECREF(x);
+      Py_XDECREF(y);
+      return 0;
+    }
+  }
+  else {
+    args = Py_BuildValue("(d)", t);
+    result = PyObject_CallObject(parametric, args);
+    if (result == NULL) {
+      Py_DECREF(args);
+      return 0;
+    }
+    Py_DECREF(args);
+
+    if (!PySequence_Check(result)  ||  PySequence_Size(result) != 2) {
+      PyErr_SetString(PyExc_TypeError, "The parametric function must return two real values.");
+      Py_DECREF(result);
+      return 0;
+    }
+
+    x = PySequence_GetItem(result, 0);
+    y = PySequence_GetItem(result, 1);
+    Py_DECREF(result);
+
+    if (!PyNumber_Check(x)  ||  !PyNumber_Check(y)) {
+      PyErr_SetString(PyExc_TypeError, "The parametric function must return two real values.");
+      Py_DECREF(x);
+      Py_DECREF(y);
+      return 0;
+    }
+  }
 
   int i;
   int lenlistoftrans = PySequence_Size(listoftrans);
@@ -145,29 +394,93 @@ static int _curve_eval(PyObject *parametric, PyObject *listoftrans, double t, do
   return 1;
 }
 
+/* evaluate natively if possible, otherwise (or if the native result isn't finite) ask Python */
+static int _curve_eval(struct common_block *block, double t, double *fx, double *fy) {
+  if (block->native) {
+    int i, ok = _curve_run(block->program, block->programlength, t, fx, fy);
+    for (i = 0;  ok  &&  i < block->ntrans;  i++) {
+      ok = _curve_affine(&(block->affines[i]), fx, fy);
+    }
+    if (ok) return 1;
+  }
+
+  CURVE_ACQUIRE(block);
+  int output = _curve_eval_python(block, t, fx, fy);
+  CURVE_RELEASE(block);
+  return output;
+}
+
+static void _curve_initpool(struct pool *pool) {
+  pool->slabs = NULL;
+  pool->current = NULL;
+  pool->used = POOL_SLAB;
+  pool->allocated = 0;
+}
+
+/* make all nodes available again, keeping the slabs */
+static void _curve_resetpool(struct pool *pool) {
+  pool->current = pool->slabs;
+  pool->used = (pool->slabs == NULL ? POOL_SLAB : 0);
+}
+
+static void _curve_freepool(struct pool *pool) {
+  while (pool->slabs != NULL) {
+    struct slab *next = pool->slabs->next;
+    free(pool->slabs);
+    pool->slabs = next;
+  }
+  _curve_initpool(pool);
+}
+
+/* returns NULL if out of memory */
+static struct sample *_curve_alloc(struct pool *pool) {
+  if (pool->used == POOL_SLAB) {
+    if (pool->current != NULL  &&  pool->current->next != NULL) {
+      pool->current = pool->current->next;
+    }
+    else {
+      struct slab *slab = (struct slab*)malloc(sizeof(struct slab));
+      if (slab == NULL) return NULL;
+      slab->next = NULL;
+      if (pool->current == NULL) pool->slabs = slab;
+      else pool->current->next = slab;
+      pool->current = slab;
+      pool->allocated++;
+    }
+    pool->used = 0;
+  }
+  return &(pool->current->nodes[pool->used++]);
+}
+
 /* recursively called to fill a (doubly-linked) list of sample points where it needs it most */
 /* with the default parameters, it computes a few more points than are typically needed */
 /* after pruning the extras, that guarantees a nice smooth curve */
 int _curve_subsample(struct sample *left, struct sample *right, int depth, struct common_block *block) {
   /* make new mid node and link it up */
-  struct sample *mid = (struct sample*)malloc(sizeof(struct sample));
+  struct sample *mid = _curve_alloc(&(block->pool));
   if (mid == NULL) {
+    CURVE_ACQUIRE(block);
     PyErr_Format(PyExc_MemoryError, "Ran out of memory while sampling function (%d nodes created)", block->counter);
+    CURVE_RELEASE(block);
     return 0;
   }
   block->counter++;
 
-  if (block->random_sampling == Py_True) {
+  int reseeded = (block->random_sampling  &&  depth == 3  &&  block->depth < 3);
+  if (reseeded) {
+    memcpy(block->topMT, block->MT, sizeof(block->MT));
+    block->topcount624 = block->count624;
+    _curve_setseed(block->random_seed + 1 + block->piece++, block);
+  }
+
+  if (block->random_sampling) {
     mid->t = left->t + (0.3 + 0.4*_curve_random(block))*(right->t - left->t);
   }
   else {
     mid->t = left->t + 0.5*(right->t - left->t);
   }
   
-  if (!_curve_eval(block->parametric, block->listoftrans, mid->t, &(mid->x), &(mid->y))) {
-    free(mid);
-    return 0;
-  }
+  if (!_curve_eval(block, mid->t, &(mid->x), &(mid->y))) return 0;
   mid->discontinuity = 0;
 
   left->right = mid;
@@ -196,80 +509,155 @@ int _curve_subsample(struct sample *left, struct sample *right, int depth, struc
     }
   }
 
+  if (reseeded) {
+    memcpy(block->MT, block->topMT, sizeof(block->MT));
+    block->count624 = block->topcount624;
+  }
   return 1;
 }
 
-/* the only function which is called from the outside: the interface to Python */
-static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
-  const char *errstring = "arguments are: parametric function to plot, list of transformations to apply to each point, low endpoint, high endpoint.  \nkeyword arguments are: random_sampling (True), random_seed (12345), recursion_limit (15), linearity_limit (0.05), discontinuity_limit (5.)";
+/* fill ts[left+1 .. right-1] with midpoints, drawn in the same (depth-first) order as _curve_subsample */
+static void _curve_split(double *ts, int left, int right, int random_sampling, struct common_block *block) {
+  if (right - left < 2) return;
+  int mid = (left + right) / 2;
+  if (random_sampling) {
+    ts[mid] = ts[left] + (0.3 + 0.4*_curve_random(block))*(ts[right] - ts[left]);
+  }
+  else {
+    ts[mid] = ts[left] + 0.5*(ts[right] - ts[left]);
+  }
+  _curve_split(ts, left, mid, random_sampling, block);
+  _curve_split(ts, mid, right, random_sampling, block);
+}
 
-  PyObject *parametric;
-  PyObject *listoftrans;
-  double low, high;
-  PyObject *random_sampling = Py_True;
-  int random_seed = 12345;
-  int recursion_limit = 15;
-  double linearity_limit = 0.05;
-  double discontinuity_limit = 5.;
+/* the interface to Python: the nine endpoints of the eight intervals at depth 3, as curve() chooses them */
+static PyObject *_curve_splits(PyObject *self, PyObject *args) {
+  const char *errstring = "arguments are: low endpoint, high endpoint, random_sampling, random_seed";
 
-  static char *kwlist[] = {"parametric", "listoftrans", "low", "high", "random_sampling", "random_seed", "recursion_limit", "linearity_limit", "discontinuity_limit", NULL};
-  if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOdd|Oiidd", kwlist, &parametric, &listoftrans, &low, &high, &random_sampling, &random_seed, &recursion_limit, &linearity_limit, &discontinuity_limit)) {
+  double low, high;
+  PyObject *random_sampling;
+  int random_seed;
+  if (!PyArg_ParseTuple(args, "ddOi", &low, &high, &random_sampling, &random_seed)  ||
+      (random_sampling != Py_True  &&  random_sampling != Py_False)) {
     PyErr_SetString(PyExc_TypeError, errstring);
     return NULL;
   }
 
-  if (!PyCallable_Check(parametric)) {
-    PyErr_SetString(PyExc_TypeError, errstring);
-    return NULL;
-  }
+  struct common_block block;
+  _curve_setseed(random_seed, &block);
 
-  if (!PySequence_Check(listoftrans)) {
-    PyErr_SetString(PyExc_TypeError, errstring);
-    return NULL;
-  }
+  double ts[9];
+  ts[0] = low;
+  ts[8] = high;
+  _curve_split(ts, 0, 8, (random_sampling == Py_True), &block);
+  return Py_BuildValue("[ddddddddd]", ts[0], ts[1], ts[2], ts[3], ts[4], ts[5], ts[6], ts[7], ts[8]);
+}
 
-  int i;
-  int lenlistoftrans = PySequence_Size(listoftrans);
-  for (i = 0;  i < lenlistoftrans;  i++) {
-    PyObject *trans = PySequence_GetItem(listoftrans, i);
-    if (!PyCallable_Check(trans)) {
-      PyErr_SetString(PyExc_TypeError, errstring);
-      Py_DECREF(trans);
-      return NULL;
+/* array.array, for returning contiguous buffers (imported by init_curve) */
+static PyObject *_curve_arraytype = NULL;
+
+static PyObject *_curve_array(char typecode, void *data, Py_ssize_t bytes) {
+  PyObject *string = PyString_FromStringAndSize((char*)data, bytes);
+  if (string == NULL) return NULL;
+  PyObject *output = PyObject_CallFunction(_curve_arraytype, "cO", typecode, string);
+  Py_DECREF(string);
+  return output;
+}
+
+/* return array('d', [x0, y0, x1, y1, ...]) of all points that aren't discontinuities and */
+/* array('l', offsets) such that segment i is points offsets[i] to offsets[i+1] */
+static PyObject *_curve_arrays(struct sample *samplelow, int length) {
+  double *coordinates = (double*)malloc(sizeof(double) * 2 * (length > 0 ? length : 1));
+  long *offsets = (long*)malloc(sizeof(long) * (length + 1));
+
+  long points = 0;
+  int segments = 0;
+  int newsegment = 1;
+  struct sample *p = samplelow;
+  while (p != NULL) {
+    if (coordinates != NULL  &&  offsets != NULL) {
+      if (p->discontinuity) {
+	newsegment = 1;
+      }
+      else {
+	if (newsegment) offsets[segments++] = points;
+	newsegment = 0;
+	coordinates[2*points] = p->x;
+	coordinates[2*points + 1] = p->y;
+	points++;
+      }
     }
-    Py_DECREF(trans);
+    p = p->right;
   }
 
-  if (random_sampling != Py_True  &&  random_sampling != Py_False) {
-    PyErr_SetString(PyExc_TypeError, errstring);
+  if (coordinates == NULL  ||  offsets == NULL) {
+    free(coordinates);
+    free(offsets);
+    PyErr_SetString(PyExc_MemoryError, "Ran out of memory while returning sampled function");
     return NULL;
   }
+  offsets[segments] = points;
 
-  /* build doubly-linked list of samples */
-  struct sample *samplelow = (struct sample*)malloc(sizeof(struct sample));
-  if (samplelow == NULL) {
-    PyErr_SetString(PyExc_MemoryError, "Ran out of memory while sampling function (1 node created)");
+  PyObject *xy = _curve_array('d', coordinates, sizeof(double) * 2 * points);
+  PyObject *off = _curve_array('l', offsets, sizeof(long) * (segments + 1));
+  free(coordinates);
+  free(offsets);
+  if (xy == NULL  ||  off == NULL) {
+    Py_XDECREF(xy);
+    Py_XDECREF(off);
     return NULL;
   }
-  samplelow->t = low;
-  if (!_curve_eval(parametric, listoftrans, samplelow->t, &(samplelow->x), &(samplelow->y))) {
-    free(samplelow);
-    return NULL;
+
+  PyObject *output = Py_BuildValue("(OO)", xy, off);
+  Py_DECREF(xy);
+  Py_DECREF(off);
+  return output;
+}
+
+/* return (xmin, xmax, ymin, ymax) of all points that aren't discontinuities, or four Nones if there are none */
+static PyObject *_curve_bbox(struct sample *samplelow) {
+  double xmin = 0., xmax = 0., ymin = 0., ymax = 0.;
+  int empty = 1;
+  struct sample *p;
+  for (p = samplelow;  p != NULL;  p = p->right) {
+    if (p->discontinuity) continue;
+    if (empty  ||  p->x < xmin) xmin = p->x;
+    if (empty  ||  p->x > xmax) xmax = p->x;
+    if (empty  ||  p->y < ymin) ymin = p->y;
+    if (empty  ||  p->y > ymax) ymax = p->y;
+    empty = 0;
   }
-  samplelow->discontinuity = 0;
+  if (empty) return Py_BuildValue("(OOOO)", Py_None, Py_None, Py_None, Py_None);
+  return Py_BuildValue("(dddd)", xmin, xmax, ymin, ymax);
+}
+
+/* what _curve_sample returns */
+enum _curve_output {
+  OUTPUT_TUPLE, OUTPUT_ARRAYS, OUTPUT_BBOX
+};
+
+/* sample one parametric function from low to high, returning a tuple of points (or arrays, or the bounding box) */
+/* the caller sets up the block: function, program, transformations, and random state */
+static PyObject *_curve_sample(struct common_block *block, double low, double high, int output_type) {
+  block->counter = 2;
+  block->piece = 0;
+  block->native = (block->program != NULL  &&  block->allaffine);
+  _curve_resetpool(&(block->pool));
 
-  struct sample *samplehigh = (struct sample*)malloc(sizeof(struct sample));
-  if (samplelow == NULL) {
+  /* build doubly-linked list of samples */
+  struct sample *samplelow = _curve_alloc(&(block->pool));
+  struct sample *samplehigh = _curve_alloc(&(block->pool));
+  if (samplelow == NULL  ||  samplehigh == NULL) {
     PyErr_SetString(PyExc_MemoryError, "Ran out of memory while sampling function (2 nodes created)");
-    free(samplelow);
     return NULL;
   }
+  samplelow->t = low;
   samplehigh->t = high;
-  if (!_curve_eval(parametric, listoftrans, samplehigh->t, &(samplehigh->x), &(samplehigh->y))) {
-    free(samplelow);
-    free(samplehigh);
+  if (!_curve_eval(block, samplelow->t, &(samplelow->x), &(samplelow->y))  ||
+      !_curve_eval(block, samplehigh->t, &(samplehigh->x), &(samplehigh->y))) {
     return NULL;
   }
+  samplelow->discontinuity = 0;
   samplehigh->discontinuity = 0;
 
   samplelow->left = NULL;
@@ -277,41 +665,25 @@ static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
   samplehigh->left = samplelow;
   samplehigh->right = NULL;
 
-  struct common_block block;
-  block.parametric = parametric;
-  block.listoftrans = listoftrans;
-  block.counter = 2;
-  block.random_sampling = random_sampling;
-  block.recursion_limit = recursion_limit;
-  block.linearity_limit = linearity_limit;
-  block.discontinuity_limit = discontinuity_limit;
-  _curve_setseed(random_seed, &block);
+  /* with nothing to call back, the sampling doesn't need the GIL */
+  if (block->native) block->threadstate = PyEval_SaveThread();
 
   /* recursively find most of the points */
-  if (!_curve_subsample(samplelow, samplehigh, 0, &block)) {
-    /* free nodes in case of error */
-    struct sample *p = samplelow;
-    while (p != NULL) {
-      struct sample *next = p->right;
-      free(p);
-      p = next;
-    }
-    return NULL;
-  }
-  
+  int success = _curve_subsample(samplelow, samplehigh, block->depth, block);
+
   /* prune excess points that are within the linearity bounds */
   struct sample *left = samplelow;
   int length = 1; /* get the post-pruning length */
-  while (left->right != NULL) {
+  while (success  &&  left->right != NULL) {
     struct sample *mid = left->right;
     struct sample *right = mid->right;
 
-    if (right != NULL  &&  !left->discontinuity  &&  !mid->discontinuity  &&  !right->discontinuity) {
+    if (block->prune  &&  right != NULL  &&  !left->discontinuity  &&  !mid->discontinuity  &&  !right->discontinuity) {
       double numer = (left->x)*(right->y - mid->y) + (mid->x)*(left->y - right->y) + (right->x)*(mid->y - left->y);
       double denom = sqrt((left->x - right->x)*(left->x - right->x) + (left->y - right->y)*(left->y - right->y));
 
-      if (denom != 0.  &&  fabs(numer/denom) < linearity_limit) {
-	free(mid); /* drop this point; it doesn't contribute to the smoothness of the curve */
+      if (denom != 0.  &&  fabs(numer/denom) < block->linearity_limit) {
+	/* drop this point; it doesn't contribute to the smoothness of the curve */
 	left->right = right;
 	right->left = left;
       }
@@ -326,9 +698,22 @@ static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
     }
   }
 
-  /* return a Python tuple of numbers and free all nodes */
+  if (block->threadstate != NULL) {
+    PyEval_RestoreThread(block->threadstate);
+    block->threadstate = NULL;
+  }
+
+  block->created += block->counter;
+  if (!success) return NULL;
+  block->kept += length;
+
+  if (output_type == OUTPUT_ARRAYS) return _curve_arrays(samplelow, length);
+  if (output_type == OUTPUT_BBOX) return _curve_bbox(samplelow);
+
+  /* return a Python tuple of numbers */
   PyObject *output = PyTuple_New(length);
   int failure = 0;
+  int i;
 
   struct sample *p = samplelow;
   for (i = 0;  i < length;  i++) {
@@ -339,13 +724,9 @@ static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
     else {
       if (PyTuple_SetItem(output, i, Py_BuildValue("dd", p->x, p->y)) != 0) failure = 1;
     }
-
-    struct sample *next = p->right;
-    free(p);
-    p = next;
+    p = p->right;
   }
 
-  /* it's important to finish freeing nodes first */
   if (failure) {
     Py_DECREF(output);
     return NULL;
@@ -354,11 +735,357 @@ static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
   return output;
 }
 
+
+/* publish the counts of a finished call for node_counts(); the GIL must be held */
+static void _curve_counted(struct common_block *block) {
+  _curve_created = block->created;
+  _curve_kept = block->kept;
+  _curve_slabs = block->pool.allocated;
+}
+
+/* check the list of transformations and keep a native copy of the Affine ones */
+static int _curve_settrans(struct common_block *block, PyObject *listoftrans, const char *errstring) {
+  if (!PySequence_Check(listoftrans)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return 0;
+  }
+
+  int i;
+  int lenlistoftrans = PySequence_Size(listoftrans);
+  for (i = 0;  i < lenlistoftrans;  i++) {
+    PyObject *trans = PySequence_GetItem(listoftrans, i);
+    if (!PyCallable_Check(trans)) {
+      PyErr_SetString(PyExc_TypeError, errstring);
+      Py_DECREF(trans);
+      return 0;
+    }
+    Py_DECREF(trans);
+  }
+
+  block->listoftrans = listoftrans;
+  block->ntrans = lenlistoftrans;
+  block->affines = (struct affine*)malloc(sizeof(struct affine) * (lenlistoftrans > 0 ? lenlistoftrans : 1));
+  if (block->affines == NULL) {
+    PyErr_NoMemory();
+    return 0;
+  }
+  block->allaffine = 1;
+  for (i = 0;  block->allaffine  &&  i < lenlistoftrans;  i++) {
+    PyObject *trans = PySequence_GetItem(listoftrans, i);
+    block->allaffine = _curve_getaffine(trans, &(block->affines[i]));
+    Py_DECREF(trans);
+  }
+  return 1;
+}
+
+/* the interface to Python: sample one curve */
+static PyObject *_curve_curve(PyObject *self, PyObject *args, PyObject *kwds) {
+  const char *errstring = "arguments are: parametric function to plot, list of transformations to apply to each point, low endpoint, high endpoint.  \nkeyword arguments are: random_sampling (True), random_seed (12345), recursion_limit (15), linearity_limit (0.05), discontinuity_limit (5.), program (None), arrays (False), depth (0), prune (True), bbox (False)";
+
+  PyObject *parametric;
+  PyObject *listoftrans;
+  double low, high;
+  PyObject *random_sampling = Py_True;
+  int random_seed = 12345;
+  int recursion_limit = 15;
+  double linearity_limit = 0.05;
+  double discontinuity_limit = 5.;
+  PyObject *program = Py_None;
+  PyObject *arrays = Py_False;
+  int depth = 0;
+  PyObject *prune = Py_True;
+  PyObject *bbox = Py_False;
+
+  static char *kwlist[] = {"parametric", "listoftrans", "low", "high", "random_sampling", "random_seed", "recursion_limit", "linearity_limit", "discontinuity_limit", "program", "arrays", "depth", "prune", "bbox", NULL};
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOdd|OiiddOOiOO", kwlist, &parametric, &listoftrans, &low, &high, &random_sampling, &random_seed, &recursion_limit, &linearity_limit, &discontinuity_limit, &program, &arrays, &depth, &prune, &bbox)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return NULL;
+  }
+
+  if (!PyCallable_Check(parametric)  ||
+      (random_sampling != Py_True  &&  random_sampling != Py_False)  ||
+      (arrays != Py_True  &&  arrays != Py_False)  ||
+      (prune != Py_True  &&  prune != Py_False)  ||
+      (bbox != Py_True  &&  bbox != Py_False)  ||
+      (arrays == Py_True  &&  bbox == Py_True)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return NULL;
+  }
+
+  struct common_block block;
+  block.parametric = parametric;
+  block.random_sampling = (random_sampling == Py_True);
+  block.recursion_limit = recursion_limit;
+  block.depth = depth;
+  block.prune = (prune == Py_True);
+  block.random_seed = random_seed;
+  block.linearity_limit = linearity_limit;
+  block.discontinuity_limit = discontinuity_limit;
+  block.threadstate = NULL;
+  _curve_setseed(random_seed, &block);
+  _curve_initpool(&block.pool);
+  block.created = block.kept = 0;
+
+  if (!_curve_settrans(&block, listoftrans, errstring)) return NULL;
+  if (!_curve_program(program, &block.program, &block.programlength)) {
+    free(block.affines);
+    return NULL;
+  }
+
+  PyObject *output = _curve_sample(&block, low, high, (bbox == Py_True ? OUTPUT_BBOX : (arrays == Py_True ? OUTPUT_ARRAYS : OUTPUT_TUPLE)));
+  free(block.program);
+  free(block.affines);
+  _curve_counted(&block);
+  _curve_freepool(&block.pool);
+  return output;
+}
+
+/* the interface to Python: sample many curves that share transformations and parameters */
+/* each one gets the same result as it would from curve() with the same random_seed */
+static PyObject *_curve_curve_many(PyObject *self, PyObject *args, PyObject *kwds) {
+  const char *errstring = "arguments are: sequence of (parametric function, low endpoint, high endpoint[, program]), list of transformations to apply to each point.  \nkeyword arguments are: random_sampling (True), random_seed (12345), recursion_limit (15), linearity_limit (0.05), discontinuity_limit (5.), arrays (False)";
+
+  PyObject *curves;
+  PyObject *listoftrans;
+  PyObject *random_sampling = Py_True;
+  int random_seed = 12345;
+  int recursion_limit = 15;
+  double linearity_limit = 0.05;
+  double discontinuity_limit = 5.;
+  PyObject *arrays = Py_False;
+
+  static char *kwlist[] = {"curves", "listoftrans", "random_sampling", "random_seed", "recursion_limit", "linearity_limit", "discontinuity_limit", "arrays", NULL};
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|OiiddO", kwlist, &curves, &listoftrans, &random_sampling, &random_seed, &recursion_limit, &linearity_limit, &discontinuity_limit, &arrays)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return NULL;
+  }
+
+  if (!PySequence_Check(curves)  ||
+      (random_sampling != Py_True  &&  random_sampling != Py_False)  ||
+      (arrays != Py_True  &&  arrays != Py_False)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return NULL;
+  }
+
+  struct common_block block;
+  block.random_sampling = (random_sampling == Py_True);
+  block.recursion_limit = recursion_limit;
+  block.depth = 0;
+  block.prune = 1;
+  block.random_seed = random_seed;
+  block.linearity_limit = linearity_limit;
+  block.discontinuity_limit = discontinuity_limit;
+  block.threadstate = NULL;
+
+  /* seed once and restart every curve from the same state */
+  _curve_setseed(random_seed, &block);
+  unsigned int MT[624];
+  memcpy(MT, block.MT, sizeof(MT));
+
+  /* and reuse the same slabs of nodes for every curve */
+  _curve_initpool(&block.pool);
+  block.created = block.kept = 0;
+
+  if (!_curve_settrans(&block, listoftrans, errstring)) return NULL;
+
+  int i;
+  int lencurves = PySequence_Size(curves);
+  PyObject *output = PyList_New(lencurves);
+  if (output == NULL) {
+    free(block.affines);
+    return NULL;
+  }
+
+  for (i = 0;  i < lencurves;  i++) {
+    PyObject *item = PySequence_GetItem(curves, i);
+    PyObject *parametric;
+    double low, high;
+    PyObject *program = Py_None;
+    PyObject *result = NULL;
+
+    if (item == NULL) break;
+    if (!PyTuple_Check(item)  ||  !PyArg_ParseTuple(item, "Odd|O", &parametric, &low, &high, &program)  ||  !PyCallable_Check(parametric)) {
+      PyErr_SetString(PyExc_TypeError, errstring);
+      Py_DECREF(item);
+      break;
+    }
+
+    block.parametric = parametric;
+    memcpy(block.MT, MT, sizeof(MT));
+    block.count624 = 624;
+    if (_curve_program(program, &block.program, &block.programlength)) {
+      result = _curve_sample(&block, low, high, (arrays == Py_True ? OUTPUT_ARRAYS : OUTPUT_TUPLE));
+      free(block.program);
+    }
+    Py_DECREF(item);
+    if (result == NULL) break;
+
+    PyList_SET_ITEM(output, i, result);
+  }
+
+  free(block.affines);
+  _curve_counted(&block);
+  _curve_freepool(&block.pool);
+  if (i < lencurves) {
+    Py_DECREF(output);
+    return NULL;
+  }
+  return output;
+}
+
+/* the interface to Python: join unpruned pieces of one curve, sampled with arrays=True and prune=False, */
+/* and prune them as curve() would have; each piece starts where the last one ended */
+static PyObject *_curve_stitch(PyObject *self, PyObject *args) {
+  const char *errstring = "arguments are: list of (coordinates, offsets) arrays from curve(..., arrays=True, prune=False), linearity_limit";
+
+  PyObject *pieces;
+  double linearity_limit;
+  if (!PyArg_ParseTuple(args, "Od", &pieces, &linearity_limit)  ||  !PySequence_Check(pieces)) {
+    PyErr_SetString(PyExc_TypeError, errstring);
+    return NULL;
+  }
+
+  int npieces = PySequence_Size(pieces);
+  const double **coordinates = (const double**)malloc(sizeof(double*) * (npieces > 0 ? npieces : 1));
+  const long **offsets = (const long**)malloc(sizeof(long*) * (npieces > 0 ? npieces : 1));
+  Py_ssize_t *noffsets = (Py_ssize_t*)malloc(sizeof(Py_ssize_t) * (npieces > 0 ? npieces : 1));
+  PyObject *items = PySequence_Fast(pieces, errstring);
+  if (coordinates == NULL  ||  offsets == NULL  ||  noffsets == NULL  ||  items == NULL) {
+    free(coordinates);
+    free(offsets);
+    free(noffsets);
+    Py_XDECREF(items);
+    if (!PyErr_Occurred()) PyErr_NoMemory();
+    return NULL;
+  }
+
+  /* the arrays' buffers stay valid while items holds the pieces */
+  int i;
+  long total = 0;
+  for (i = 0;  i < npieces;  i++) {
+    PyObject *xy, *off;
+    Py_ssize_t xylen, offlen;
+    if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(items, i), "OO", &xy, &off)  ||
+        PyObject_AsReadBuffer(xy, (const void**)&coordinates[i], &xylen) != 0  ||
+        PyObject_AsReadBuffer(off, (const void**)&offsets[i], &offlen) != 0  ||
+        offlen < 2 * (Py_ssize_t)sizeof(long)) {
+      PyErr_SetString(PyExc_TypeError, errstring);
+      break;
+    }
+    noffsets[i] = offlen / sizeof(long);
+    if (offsets[i][noffsets[i] - 1] * 2 * (Py_ssize_t)sizeof(double) != xylen) {
+      PyErr_SetString(PyExc_TypeError, errstring);
+      break;
+    }
+    total += offsets[i][noffsets[i] - 1];
+  }
+
+  double *outxy = NULL;
+  long *outoff = NULL;
+  long points = 0;
+  int segments = 0;
+  if (i == npieces) {
+    outxy = (double*)malloc(sizeof(double) * 2 * (total > 0 ? total : 1));
+    outoff = (long*)malloc(sizeof(long) * (total + 1));
+    if (outxy == NULL  ||  outoff == NULL) PyErr_NoMemory();
+  }
+
+  if (outxy != NULL  &&  outoff != NULL) {
+    /* the same pruning as in _curve_sample, one segment at a time */
+    /* a segment that reaches the end of a piece continues into the next one, whose first point is the same */
+    int open = 0;
+    long left = -1;
+    for (i = 0;  i < npieces;  i++) {
+      const double *xy = coordinates[i];
+      Py_ssize_t j;
+      for (j = 0;  j + 1 < noffsets[i];  j++) {
+        long k = offsets[i][j];
+        long end = offsets[i][j+1];
+        if (open  &&  j == 0) {
+          k++;  /* the shared endpoint */
+        }
+        else {
+          outoff[segments++] = points;
+          outxy[2*points] = xy[2*k];
+          outxy[2*points + 1] = xy[2*k + 1];
+          left = points++;
+          k++;
+        }
+
+        for (;  k < end;  k++) {
+          /* the last point of a segment is always kept, unless the segment goes on in the next piece */
+          int last = (k + 1 == end  &&  (j + 2 < noffsets[i]  ||  i + 1 == npieces  ||  offsets[i+1][1] - offsets[i+1][0] < 2));
+          if (!last) {
+            double lx = outxy[2*left], ly = outxy[2*left + 1];
+            double mx = xy[2*k], my = xy[2*k + 1];
+            double rx, ry;
+            if (k + 1 < end) {
+              rx = xy[2*k + 2];
+              ry = xy[2*k + 3];
+            }
+            else {
+              rx = coordinates[i+1][2];  /* the point after the shared endpoint */
+              ry = coordinates[i+1][3];
+            }
+            double numer = lx*(ry - my) + mx*(ly - ry) + rx*(my - ly);
+            double denom = sqrt((lx - rx)*(lx - rx) + (ly - ry)*(ly - ry));
+            if (denom != 0.  &&  fabs(numer/denom) < linearity_limit) continue;
+          }
+          outxy[2*points] = xy[2*k];
+          outxy[2*points + 1] = xy[2*k + 1];
+          left = points++;
+        }
+        open = (j + 2 == noffsets[i]);
+      }
+    }
+    outoff[segments] = points;
+  }
+
+  Py_DECREF(items);
+  free(coordinates);
+  free(offsets);
+  free(noffsets);
+  if (outxy == NULL  ||  outoff == NULL) {
+    free(outxy);
+    free(outoff);
+    return NULL;
+  }
+
+  PyObject *xy = _curve_array('d', outxy, sizeof(double) * 2 * points);
+  PyObject *off = _curve_array('l', outoff, sizeof(long) * (segments + 1));
+  free(outxy);
+  free(outoff);
+  if (xy == NULL  ||  off == NULL) {
+    Py_XDECREF(xy);
+    Py_XDECREF(off);
+    return NULL;
+  }
+  PyObject *output = Py_BuildValue("(OO)", xy, off);
+  Py_DECREF(xy);
+  Py_DECREF(off);
+  return output;
+}
+
+/* the interface to Python: how many nodes the last call created, how many it returned, and how many slabs it took */
+static PyObject *_curve_node_counts(PyObject *self, PyObject *args) {
+  return Py_BuildValue("{s:l,s:l,s:l}", "created", _curve_created, "kept", _curve_kept, "slabs", _curve_slabs);
+}
+
 static PyMethodDef _curve_methods[] = {
   {"curve", ((PyCFunction)(_curve_curve)), METH_VARARGS | METH_KEYWORDS, ""},
+  {"curve_many", ((PyCFunction)(_curve_curve_many)), METH_VARARGS | METH_KEYWORDS, ""},
+  {"stitch", ((PyCFunction)(_curve_stitch)), METH_VARARGS, ""},
+  {"splits", ((PyCFunction)(_curve_splits)), METH_VARARGS, ""},
+  {"node_counts", ((PyCFunction)(_curve_node_counts)), METH_NOARGS, ""},
   {NULL}
 };
 
-PyMODINIT_FUNC init_curve() {
+PyMODINIT_FUNC init_curve(void) {
+  PyObject *array = PyImport_ImportModule("array");
+  if (array == NULL) return;
+  _curve_arraytype = PyObject_GetAttrString(array, "array");
+  Py_DECREF(array);
+  if (_curve_arraytype == NULL) return;
+
   Py_InitModule3("_curve", _curve_methods, "");
 }
@@ -1,22 +1,91 @@
-import math, cmath, copy, re, sys, new
+import math, cmath, copy, re, sys, os, new, collections, thread, cPickle, weakref, atexit
 import defaults, svg, trans, pathdata, glyphs, _curve
 
 ############################### generic curve with marks (tick marks, arrows, etc)
 
+# sampled (coordinates, offsets), keyed by everything that determines them (see Curve._sampling_key);
+# set maxsize to 0 to turn it off
+sampling_cache = svg.LRUCache(128)
+
+# worker pools for Curve._sample_parallel, kept for reuse: ("threads" or "processes", workers) -> pool
+_pools = {}
+_pools_lock = thread.allocate_lock()
+
+def _pool(kind, workers):
+    with _pools_lock:
+        try:
+            return _pools[kind, workers]
+        except KeyError:
+            import multiprocessing, multiprocessing.pool
+            if kind == "threads":
+                output = multiprocessing.pool.ThreadPool(workers)
+            else:
+                output = multiprocessing.Pool(workers)
+            if len(_pools) == 0:
+                atexit.register(close_pools)
+            _pools[kind, workers] = output
+            return output
+
+def close_pools():
+    """Stops the worker threads and processes that Curve.parallel started; they are started again
+    when needed.  Called at exit."""
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.terminate()
+        pool.join()
+
+def _sample_piece((self, ts, i)):
+    return _curve.curve(self.f, self.trans, ts[i], ts[i+1],
+                        self.random_sampling, self.random_seed + 1 + i,
+                        self.recursion_limit, self.linearity_limit, self.discontinuity_limit,
+                        getattr(self.f, "program", None), arrays=True, depth=3, prune=False)
+
+# results of _portable: function -> (transformations, portable)
+_portables = weakref.WeakKeyDictionary()
+
+def _portable(curve):
+    """True if the curve still works after pickling (which rebuilds its function in this module, with
+    only math or cmath to refer to), so that it can be sent to worker processes.
+
+    Checked once per function and list of transformations."""
+    trans = tuple(curve.trans)
+    try:
+        entry = _portables.get(curve.f)
+    except TypeError:
+        entry = None
+    if entry is not None and entry[0] == trans:
+        return entry[1]
+
+    try:
+        output = cPickle.loads(cPickle.dumps(curve, 2)).f(curve.low) == curve.f(curve.low)
+    except Exception:
+        output = False
+
+    try:
+        _portables[curve.f] = (trans, output)
+    except TypeError:
+        pass
+    return output
+
 class Curve(svg.SVG):
     attrib = {"stroke": "black", "fill": "none"}
     smooth = False
+    packed = False
     marks = []
     random_sampling = True
     random_seed = 12345
     recursion_limit = 15
     linearity_limit = 0.05
     discontinuity_limit = 5.
+    parallel = 0
     text_offsetx = 0.
     text_offsety = -2.5
     text_attrib = {}
 
-    _varlist = ["attrib", "smooth", "marks", "random_sampling", "random_seed", "recursion_limit", "linearity_limit", "discontinuity_limit", "text_offsetx", "text_offsety", "text_attrib"]
+    _shallow_transform = True  # transform only changes self.trans
+    _varlist = ["attrib", "smooth", "packed", "marks", "random_sampling", "random_seed", "recursion_limit", "linearity_limit", "discontinuity_limit", "parallel", "text_offsetx", "text_offsety", "text_attrib"]
 
     def __init__(self, expr, low, high, **kwds):
         self.__dict__["tag"] = None
@@ -79,32 +148,41 @@ class Curve(svg.SVG):
 
     ### pickleability and access issues
     def __getattr__(self, name):
-        return self.__dict__[name]
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError, name
 
     def __setattr__(self, name, value):
         self.__dict__[name] = value
+        if name not in ("_svg", "repr"):
+            self.touch()
 
     def __getstate__(self):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         del mostdict["f"]
         del mostdict["trans"]
-        transcode = map(lambda f: (f.func_code, f.func_name), self.trans)
+        transcode = map(trans._transcode, self.trans)
         fcode = self.f.func_code, self.f.func_name
-        return (sys.version_info, defaults.version_info, mostdict, transcode, fcode)
+        return (tuple(sys.version_info), defaults.version_info, mostdict, transcode, fcode)
 
     def __setstate__(self, state):
         self.__dict__ = state[2]
         self.__dict__["trans"] = []
 
-        for code, name in state[3]:
-            context = globals()
-            if "z" in code.co_names:
-                context.update(cmath.__dict__)
+        for item in state[3]:
+            if isinstance(item, svg.Affine):
+                self.__dict__["trans"].append(item)
             else:
-                context.update(math.__dict__)
-            f = new.function(code, context)
-            f.func_name = name
-            self.__dict__["trans"].append(f)
+                code, name = item
+                context = globals()
+                if "z" in code.co_names:
+                    context.update(cmath.__dict__)
+                else:
+                    context.update(math.__dict__)
+                f = new.function(code, context)
+                f.func_name = name
+                self.__dict__["trans"].append(f)
 
         context = globals()
         if "z" in state[4][0].co_names:
@@ -115,7 +193,7 @@ class Curve(svg.SVG):
         self.__dict__["f"].func_name = state[4][1]
 
     def __deepcopy__(self, memo={}):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         del mostdict["trans"]
         del mostdict["f"]
         if "repr" in mostdict:
@@ -150,10 +228,29 @@ class Curve(svg.SVG):
 
     ### transformation is like Delay
     def transform(self, t):
-        self.trans.append(svg.canonical_transformation(t))
+        t = svg.canonical_transformation(t)
+        if isinstance(t, svg.Affine) and len(self.trans) > 0 and isinstance(self.trans[-1], svg.Affine):
+            self.trans[-1] = t * self.trans[-1]
+        else:
+            self.trans.append(t)
+        self.touch()
 
     def bbox(self):
-        return pathdata.bbox(self.d())
+        key = self._sampling_key()
+        sampled = sampling_cache.get(key)
+        if sampled is None:
+            if (key is None or sampling_cache.maxsize == 0) and not self._parallel():
+                # nothing to keep for d() or svg(), so only the bounds are needed: don't make any path data
+                return defaults.BBox(*_curve.curve(self.f, self.trans, self.low, self.high,
+                                                   self.random_sampling, self.random_seed,
+                                                   self.recursion_limit, self.linearity_limit, self.discontinuity_limit,
+                                                   getattr(self.f, "program", None), bbox=True))
+            sampled = self._sample()
+            if key is not None:
+                sampling_cache[key] = sampled
+
+        coordinates = sampled[0]
+        return defaults.BBox.from_points(coordinates[0::2], coordinates[1::2])
 
     ### construct the SVG path
     def svg(self):
@@ -196,26 +293,106 @@ class Curve(svg.SVG):
         self._svg = output
 
     def d(self):
-        data = _curve.curve(self.f, self.trans, self.low, self.high,
+        key = self._sampling_key()
+        sampled = sampling_cache.get(key)
+        if sampled is None:
+            sampled = self._sample()
+            if key is not None:
+                sampling_cache[key] = sampled
+        return self._d(*sampled)
+
+    def _sample(self):
+        if self._parallel():
+            return self._sample_parallel()
+        return _curve.curve(self.f, self.trans, self.low, self.high,
                             self.random_sampling, self.random_seed,
-                            self.recursion_limit, self.linearity_limit, self.discontinuity_limit)
+                            self.recursion_limit, self.linearity_limit, self.discontinuity_limit,
+                            getattr(self.f, "program", None), arrays=True)
 
-        segments = []
-        last_d = None
-        for d in data:
-            if d is not None:
-                if last_d is None:
-                    segments.append([])
-                segments[-1].append(d)
-            last_d = d
+    def _parallel(self):
+        return self.parallel > 0 and self.recursion_limit >= 3
+
+    def _sampling_key(self):
+        """Everything that the sampled points depend on, or None if the transformations can't be hashed."""
+        key = (self.f, self.low, self.high, tuple([getattr(t, "matrix", t) for t in self.trans]),
+               self.random_sampling, self.random_seed, self.recursion_limit, self.linearity_limit, self.discontinuity_limit)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _sample_parallel(self):
+        """Samples the eight intervals that the sampler always starts with on self.parallel workers.
+
+        The serial sampler draws each interval's random numbers from its own random_seed + 1 + i,
+        so the result is the same as the serial one, whatever the number of workers.
+        """
+        ts = _curve.splits(float(self.low), float(self.high), self.random_sampling, self.random_seed)
+        tasks = [(self, ts, i) for i in xrange(len(ts) - 1)]
+
+        if self.parallel == 1:
+            pieces = map(_sample_piece, tasks)
 
-        output = []
-        if self.smooth:
-            for seg in segments:
-                output.extend(pathdata.smooth(*seg))
         else:
-            for seg in segments:
-                output.extend(pathdata.poly(*seg))
+            # a natively evaluated curve doesn't hold the GIL; anything else needs processes,
+            # which only get a copy of the curve if it can be pickled
+            native = getattr(self.f, "program", None) is not None and all([hasattr(t, "matrix") for t in self.trans])
+            if native or not hasattr(os, "fork") or not _portable(self):
+                pieces = _pool("threads", self.parallel).map(_sample_piece, tasks)
+            else:
+                pieces = _pool("processes", self.parallel).map(_sample_piece, tasks)
+
+        return _curve.stitch(pieces, self.linearity_limit)
+
+    def sample_many(curves):
+        """Returns [curve.d() for curve in curves], sampling all curves that have the same
+        transformations and sampling parameters in one call."""
+        groups = collections.OrderedDict()
+        output = [None] * len(curves)
+        for i, c in enumerate(curves):
+            if c.parallel > 0 or c._sampling_key() in sampling_cache:
+                output[i] = c.d()
+                continue
+            key = (tuple([getattr(t, "matrix", id(t)) for t in c.trans]),
+                   c.random_sampling, c.random_seed, c.recursion_limit, c.linearity_limit, c.discontinuity_limit)
+            groups.setdefault(key, []).append(i)
+
+        for key, indexes in groups.items():
+            first = curves[indexes[0]]
+            data = _curve.curve_many([(curves[i].f, curves[i].low, curves[i].high, getattr(curves[i].f, "program", None)) for i in indexes],
+                                     first.trans, first.random_sampling, first.random_seed,
+                                     first.recursion_limit, first.linearity_limit, first.discontinuity_limit, arrays=True)
+            for i, sampled in zip(indexes, data):
+                key = curves[i]._sampling_key()
+                if key is not None:
+                    sampling_cache[key] = sampled
+                output[i] = curves[i]._d(*sampled)
+        return output
+    sample_many = staticmethod(sample_many)
+
+    def _d(self, coordinates, offsets):
+        if self.packed and not self.smooth:
+            # the sampled coordinates are already laid out the way Packed stores them
+            output = pathdata.Packed("".join(["M" + "L"*(offsets[i+1] - offsets[i] - 1) for i in xrange(len(offsets) - 1)]))
+            output.coordinates = coordinates[:]  # not the cached array itself
+            return output
+
+        output = []
+        if self.packed:
+            output = pathdata.Packed()
+        for i in xrange(len(offsets) - 1):
+            xs = coordinates[2*offsets[i]:2*offsets[i+1]:2]
+            ys = coordinates[2*offsets[i]+1:2*offsets[i+1]:2]
+            if self.smooth:
+                seg = pathdata.smooth(*zip(xs, ys), packed=self.packed)
+            else:
+                seg = pathdata.poly(zip(xs, ys))
+            if self.packed:
+                output.commands.extend(seg.commands)
+                output.coordinates.extend(seg.coordinates)
+            else:
+                output.extend(seg)
 
         return output
 
@@ -306,6 +483,7 @@ class Curve(svg.SVG):
             mark = trans.transform(lambda x, y: (dx + math.cos(angle)*x - math.sin(angle)*y,
                                                  dy + math.sin(angle)*x + math.cos(angle)*y), mark)
         self.marks.append((t, mark))
+        self.touch()
 
     def tick(self, t, mark=None):
         if mark is None:
@@ -342,6 +520,7 @@ class Curve(svg.SVG):
         if order is None:
             order = lambda a, b: self._markorder(a, b)
         self.marks.sort(order)
+        self.touch()
 
     def closest(self, t, tolerance=None, matching=None):
         if tolerance is None:
@@ -404,15 +583,19 @@ class Curve(svg.SVG):
     ### act like a list
     def append(self, other):
         self.marks.append(other)
+        self.touch()
 
     def prepend(self, other):
         self.marks[0:0] = [other]
+        self.touch()
 
     def insert(self, i, other):
         self.marks.insert(i, other)
+        self.touch()
 
     def remove(self, other):
         self.marks.remove(other)
+        self.touch()
 
     def __len__(self):
         return len(self.marks)
@@ -424,6 +607,7 @@ class Curve(svg.SVG):
             self.marks.append(other)
         else:
             self.marks.extend(other)
+        self.touch()
 
     def __add__(self, other):
         output = copy.deepcopy(self)
@@ -432,6 +616,7 @@ class Curve(svg.SVG):
 
     def __iadd__(self, other):
         self.marks.append(other)
+        self.touch()
         return self
 
     def __mul__(self, other):
@@ -444,6 +629,7 @@ class Curve(svg.SVG):
 
     def __imul__(self, other):
         self.marks *= other
+        self.touch()
         return self
 
     def count(self, *args, **kwds):
@@ -453,9 +639,11 @@ class Curve(svg.SVG):
         return self.marks.index(*args, **kwds)
 
     def pop(self, *args, **kwds):
+        self.touch()
         return self.marks.pop(*args, **kwds)
 
     def reverse(self, *args, **kwds):
+        self.touch()
         return self.marks.reverse(*args, **kwds)
 
 ############################### plot axes
@@ -497,6 +685,7 @@ class XAxis(Curve):
 
     def __setattr__(self, name, value):
         self.__dict__[name] = value
+        self.touch()
         if name == "xlogbase":
             self.marks = self._reassign_marks()
         if name in ("xlogbase", "low", "high"):
@@ -541,6 +730,7 @@ class YAxis(Curve):
 
     def __setattr__(self, name, value):
         self.__dict__[name] = value
+        self.touch()
         if name == "ylogbase":
             self.marks = self._reassign_marks()
         if name in ("ylogbase", "low", "high"):
@@ -1,4 +1,4 @@
-import math, re, os, platform, warnings
+import math, re, os, platform, warnings, array
 import pathdata
 
 version = "SVGFig 2.0.0alpha3"
@@ -170,8 +170,13 @@ require_rect = ["x", "y", "width", "height"]
 defaults_rect = {"stroke": "black", "fill": "none"}
 
 def transform_rect(trans, svg):
+    matrix = getattr(trans, "matrix", None)
     if isnumber(svg.x) and isnumber(svg.y):
-        if isnumber(svg.width) and isnumber(svg.height):
+        if isnumber(svg.width) and isnumber(svg.height) and matrix is not None and matrix[1] == matrix[2] == 0:
+            # a scale and translation: the corner moves and the sides scale, without a difference of corners
+            svg.x, svg.y = trans(svg.x, svg.y)
+            svg.width, svg.height = matrix[0]*svg.width, matrix[3]*svg.height
+        elif isnumber(svg.width) and isnumber(svg.height):
             x1, y1 = trans(svg.x, svg.y)
             x2, y2 = trans(svg.x + svg.width, svg.y + svg.height)
             svg.x, svg.y = x1, y1
@@ -293,10 +298,35 @@ def isnumber(x):
 
 ############################### BBox class
 
-class BBox:
+class BBox(object):
+    __slots__ = ("xmin", "xmax", "ymin", "ymax")  # no per-instance __dict__: there are a lot of these
+
     def __init__(self, xmin, xmax, ymin, ymax):
         self.xmin, self.xmax, self.ymin, self.ymax = xmin, xmax, ymin, ymax
 
+    def from_points(cls, xs, ys):
+        """The BBox of points (xs[i], ys[i]), where xs and ys are lists, tuples, or arrays.
+
+        None values are ignored; if there are no points, all four bounds are None.
+        """
+        if not isinstance(xs, array.array) and None in xs:
+            xs = [x for x in xs if x is not None]
+        if not isinstance(ys, array.array) and None in ys:
+            ys = [y for y in ys if y is not None]
+        xmin = xmax = ymin = ymax = None
+        if len(xs) > 0:
+            xmin, xmax = min(xs), max(xs)
+        if len(ys) > 0:
+            ymin, ymax = min(ys), max(ys)
+        return cls(xmin, xmax, ymin, ymax)
+    from_points = classmethod(from_points)
+
+    def __getstate__(self):
+        return self.xmin, self.xmax, self.ymin, self.ymax
+
+    def __setstate__(self, state):
+        self.xmin, self.xmax, self.ymin, self.ymax = state
+
     def __repr__(self):
         return "<BBox xmin=%g xmax=%g ymin=%g ymax=%g>" % (self.xmin, self.xmax, self.ymin, self.ymax)
 
@@ -316,34 +346,16 @@ class BBox:
         return output
 
     def __iadd__(self, other):
-        if self.xmin is None:
-            self.xmin = other.xmin
-        elif other.xmin is None:
-            pass
-        else:
-            self.xmin = min(self.xmin, other.xmin)
-
-        if self.xmax is None:
-            self.xmax = other.xmax
-        elif other.xmax is None:
-            pass
-        else:
-            self.xmax = max(self.xmax, other.xmax)
-
-        if self.ymin is None:
-            self.ymin = other.ymin
-        elif other.ymin is None:
-            pass
-        else:
-            self.ymin = min(self.ymin, other.ymin)
-
-        if self.ymax is None:
-            self.ymax = other.ymax
-        elif other.ymax is None:
-            pass
-        else:
-            self.ymax = max(self.ymax, other.ymax)
-
+        # None means unbounded on that side, so it never replaces a number
+        xmin, xmax, ymin, ymax = other.xmin, other.xmax, other.ymin, other.ymax
+        if xmin is not None and (self.xmin is None or xmin < self.xmin):
+            self.xmin = xmin
+        if xmax is not None and (self.xmax is None or xmax > self.xmax):
+            self.xmax = xmax
+        if ymin is not None and (self.ymin is None or ymin < self.ymin):
+            self.ymin = ymin
+        if ymax is not None and (self.ymax is None or ymax > self.ymax):
+            self.ymax = ymax
         return self
 
     def __eq__(self, other):
@@ -353,3 +365,39 @@ class BBox:
     def __ne__(self, other):
         return not (self == other)
 
+
+############################### table of per-tag rules (so that lookups don't format strings)
+
+class TagRules:
+    def __init__(self, tag):
+        namespace = globals()
+        self.tag = tag
+        self.signature, self.require, defaults, self.tonumber, self.transform, self.bbox = [namespace.get(prefix + str(tag)) for prefix in _tagrules_prefixes]
+        self.defaults = {} if defaults is None else defaults
+
+    def __repr__(self):
+        return "<TagRules %s>" % self.tag
+
+_tagrules = {}
+_tagrules_namespace = globals()
+_tagrules_prefixes = ("signature_", "require_", "defaults_", "tonumber_", "transform_", "bbox_")
+
+# fills the table for every tag that has rules (tagrules also adds tags as they are asked for);
+# call it after adding, replacing, or deleting rules at runtime (e.g. defaults.signature_mytag = [...])
+def rebuild_tagrules():
+    _tagrules.clear()
+    for name in _tagrules_namespace.keys():
+        for prefix in _tagrules_prefixes:
+            if name.startswith(prefix):
+                tag = name[len(prefix):]
+                if tag not in _tagrules:
+                    _tagrules[tag] = TagRules(tag)
+
+def tagrules(tag):
+    try:
+        return _tagrules[tag]
+    except KeyError:
+        output = _tagrules[tag] = TagRules(tag)
+        return output
+
+rebuild_tagrules()
@@ -6,7 +6,7 @@ import curve, defaults, glyphs, pathdata, plot, svg, trans
 # Internal class members are preceeded by an underscore
 
 from defaults import BBox
-from svg import SVG, template, load, load_stream, rgb, randomid, shortcut
+from svg import SVG, Affine, template, load, load_stream, rgb, randomid, shortcut
 from glyphs import latex
 from trans import clone, tonumber, transform, evaluate, Delay, Freeze, Pin, window, rotation, transformation_angle, transformation_jacobian
 from pathdata import poly, bezier, velocity, foreback, smooth
@@ -1,13 +1,159 @@
+import math, re, array, itertools, operator
 import defaults
 
+############################### packed pathdata: one byte per command and a flat array of doubles
+
+# how many numbers follow each command
+_arity = {"Z": 0, "H": 1, "V": 1, "M": 2, "L": 2, "T": 2, "S": 4, "Q": 4, "C": 6, "A": 7}
+for _command in _arity.keys():
+    _arity[_command.lower()] = _arity[_command]
+del _command
+
+class Packed:
+    """Pathdata stored as a command string and a flat array of coordinates (arc flags are stored as 0. or 1.).
+
+    Iterating over it yields the same tuples as the list form, so anything that accepts pathdata accepts this.
+    """
+
+    def __init__(self, commands="", coordinates=()):
+        self.commands = array.array("c")
+        if isinstance(commands, basestring):
+            self.commands.fromstring(commands)
+        else:
+            self.commands.extend(commands)
+        self.coordinates = array.array("d", coordinates)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __iter__(self):
+        coordinates = self.coordinates
+        j = 0
+        for command in self.commands:
+            arity = _arity[command]
+            if arity == 7:
+                yield (command, coordinates[j], coordinates[j+1], coordinates[j+2], int(coordinates[j+3]), int(coordinates[j+4]), coordinates[j+5], coordinates[j+6])
+            else:
+                yield (command,) + tuple(coordinates[j:j+arity])
+            j += arity
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self.commands)))]
+
+        index = operator.index(index)
+        if index < 0:
+            index += len(self.commands)
+        if not 0 <= index < len(self.commands):
+            raise IndexError, "Packed index out of range"
+
+        command, coordinates = self.commands[index], self.coordinates
+        j = self._start(index)
+        arity = _arity[command]
+        if arity == 7:
+            return (command, coordinates[j], coordinates[j+1], coordinates[j+2], int(coordinates[j+3]), int(coordinates[j+4]), coordinates[j+5], coordinates[j+6])
+        else:
+            return (command,) + tuple(coordinates[j:j+arity])
+
+    def _start(self, index):
+        # where the numbers of command index begin in coordinates; the starts of all commands are
+        # kept and extended when commands are added (commands are only ever added, never changed)
+        starts = self.__dict__.get("_starts")
+        if starts is None or starts[0] is not self.commands or len(starts[1]) > len(self.commands) + 1:
+            starts = self._starts = (self.commands, array.array("L", [0]))
+        starts = starts[1]
+        if index >= len(starts) - 1:
+            j = starts[-1]
+            for command in self.commands[len(starts) - 1:]:
+                j += _arity[command]
+                starts.append(j)
+        return starts[index]
+
+    def __getstate__(self):
+        return {"commands": self.commands, "coordinates": self.coordinates}  # not _starts
+
+    def __eq__(self, other):
+        if isinstance(other, Packed):
+            return self.commands == other.commands and self.coordinates == other.coordinates
+        elif isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Packed (%d commands, %d coordinates)>" % (len(self.commands), len(self.coordinates))
+
+    def append(self, datum):
+        if not isinstance(datum, (tuple, list)):
+            raise TypeError, "Pathdata elements must be lists/tuples"
+        if len(datum) != 1 + _arity.get(datum[0], -1):
+            raise ValueError, "Pathdata command \"%s\" has the wrong number of arguments" % datum[0]
+        self.commands.fromstring(datum[0])
+        self.coordinates.extend(map(float, datum[1:]))
+
+    def extend(self, pathdata):
+        if isinstance(pathdata, Packed):
+            self.commands.extend(pathdata.commands)
+            self.coordinates.extend(pathdata.coordinates)
+        else:
+            for datum in pathdata:
+                self.append(datum)
+
+    def tolist(self):
+        return list(self)
+
+    def xml(self):
+        numbers = map(repr, self.coordinates)
+        line = []
+        lastcommand = None
+        j = 0
+        for command in self.commands:
+            arity = _arity[command]
+            args = numbers[j:j+arity]
+            if arity == 7:
+                args[3] = str(int(self.coordinates[j+3]))
+                args[4] = str(int(self.coordinates[j+4]))
+
+            if lastcommand == command and arity > 0:  # "ZZ" is two commands, "Z Z" would be one
+                line.append(u" ")
+            else:
+                line.append(command)
+            line.append(u" ".join(args))
+
+            lastcommand = command
+            j += arity
+
+        return u"".join(line)
+
+    def _pointsonly(self, commands):
+        # true if every number is an absolute x or y of a point that transforms like one
+        return self.commands.tostring().translate(None, commands) == ""
+
+def pack(pathdata):
+    if isinstance(pathdata, Packed):
+        return pathdata
+    elif isinstance(pathdata, basestring):
+        return parse(pathdata, packed=True)
+    else:
+        output = Packed()
+        output.extend(pathdata)
+        return output
+
 ############################### convenient functions for making paths
 
 def poly(*data, **kwds):
-    errstring = "Arguments are: poly((x1,y1), (x2,y2), ..., loop=False)"
+    errstring = "Arguments are: poly((x1,y1), (x2,y2), ..., loop=False, packed=False)"
     loop = False
     if "loop" in kwds:
         loop = kwds["loop"]
         del kwds["loop"]
+    packed = False
+    if "packed" in kwds:
+        packed = kwds["packed"]
+        del kwds["packed"]
     if len(kwds) > 0:
         raise TypeError, errstring
 
@@ -15,6 +161,15 @@ def poly(*data, **kwds):
         data = data[0]
 
     try:
+        if packed:
+            output = Packed("M" + "L"*(len(data) - 1) if len(data) > 0 else "")
+            for x, y in data:
+                output.coordinates.append(x)
+                output.coordinates.append(y)
+            if loop and len(data) > 0:
+                output.commands.append("Z")
+            return output
+
         output = []
         for x, y in data:
             if output == []:
@@ -118,12 +273,16 @@ def foreback(*data, **kwds):
         raise TypeError, errstring
 
 def smooth(*data, **kwds):
-    errstring = "Arguments are: smooth((x1,y1), (x2,y2), ..., loop=False)"
+    errstring = "Arguments are: smooth((x1,y1), (x2,y2), ..., loop=False, packed=False)"
 
     loop = False
     if "loop" in kwds:
         loop = kwds["loop"]
         del kwds["loop"]
+    packed = False
+    if "packed" in kwds:
+        packed = kwds["packed"]
+        del kwds["packed"]
     if len(kwds) > 0:
         raise TypeError, errstring
 
@@ -139,187 +298,165 @@ def smooth(*data, **kwds):
             if not loop and (i == 0 or i == len(data)-1):
                 vx[i], vy[i] = 0., 0.
 
-        return velocity(zip(x, y, vx, vy), loop)
+        output = velocity(*zip(x, y, vx, vy), loop=loop)
     except (TypeError, ValueError):
         raise TypeError, errstring
 
-############################### pathdata parsers
-
-def parse_whitespace(index, pathdata):
-    while index < len(pathdata) and pathdata[index] in (" ", "\t", "\r", "\n", ","):
-        index += 1
-    return index, pathdata
-
-def parse_command(index, pathdata):
-    index, pathdata = parse_whitespace(index, pathdata)
-
-    if index >= len(pathdata):
-        return None, index, pathdata
-    command = pathdata[index]
-    if "A" <= command <= "Z" or "a" <= command <= "z":
-        index += 1
-        return command, index, pathdata
-    else:
-        return None, index, pathdata
-
-def parse_number(index, pathdata):
-    index, pathdata = parse_whitespace(index, pathdata)
-
-    if index >= len(pathdata):
-        return None, index, pathdata
-    first_digit = pathdata[index]
-
-    if "0" <= first_digit <= "9" or first_digit in ("-", "+", "."):
-        start = index
-        while index < len(pathdata) and ("0" <= pathdata[index] <= "9" or pathdata[index] in ("-", "+", ".", "e", "E")):
-            index += 1
-        end = index
-
-        index = end
-        return float(pathdata[start:end]), index, pathdata
-    else:
-        return None, index, pathdata
-
-def parse_boolean(index, pathdata):
-    index, pathdata = parse_whitespace(index, pathdata)
+    if packed:
+        return pack(output)
+    return output
 
-    if index >= len(pathdata):
-        return None, index, pathdata
-    first_digit = pathdata[index]
+############################### pathdata parsers
 
-    if first_digit in ("0", "1"):
-        index += 1
-        return int(first_digit), index, pathdata
+# the SVG number grammar: "1.5.5" is 1.5 followed by .5 and "1e-3-2" is 1e-3 followed by -2
+_number = r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?"
+_whitespace = r"[ \t\r\n,]*"
+
+_parse_split = re.compile(r"([A-DF-Za-df-z])")  # command letters ("e" and "E" belong to numbers)
+_parse_whitespace = re.compile(_whitespace)
+_parse_number = re.compile(_number)
+_parse_numbers = re.compile(r"%s((?:%s%s)*)" % (_whitespace, _number, _whitespace))  # the run of numbers after a command
+# (?=(?P<x>...))(?P=x) matches a whole number without backtracking into it, so "-98" can't become -9, 8
+_parse_arc = re.compile("".join([r"%s(?=(?P<%s>%s))(?P=%s)" % (_whitespace, name, pattern, name) for name, pattern in
+                                 (("rx", _number), ("ry", _number), ("angle", _number), ("large_arc_flag", "[01]"), ("sweep_flag", "[01]"), ("x", _number), ("y", _number))]))
+_parse_arc_start = re.compile(r"%s[+\-.0-9]" % _whitespace)
+
+_parse_errstrings = {"H": "a number", "V": "a number",
+                     "M": "an x,y pair", "L": "an x,y pair", "T": "an x,y pair",
+                     "S": "a cx,cy,x,y quadruplet", "Q": "a cx,cy,x,y quadruplet",
+                     "C": "a c1x,c1y,c2x,c2y,x,y sextuplet",
+                     "A": "a rx,ry,angle,large-arc-flag,sweep-flag,x,y septuplet"}
+for _command in _arity.keys():
+    _parse_errstrings[_command.lower()] = _parse_errstrings.get(_command)
+del _command
+
+def _parse_requires(command, index):
+    raise ValueError, "Pathdata command \"%s\" requires %s at index %d" % (command, _parse_errstrings[command], index)
+
+def _parse_unexpected(pathdata, index):
+    if pathdata[index] in ("e", "E"):
+        raise ValueError, "Pathdata command \"%s\" is not recognized at index %d" % (pathdata[index], index)
     else:
-        return None, index, pathdata
+        raise ValueError, "Pathdata has a \"%s\" where a command was expected at index %d" % (pathdata[index], index)
 
 ############################### main parsing function (keeps defaults from getting messy)
 
-def parse(pathdata):
-    if isinstance(pathdata, (list, tuple)):
+def parse(pathdata, packed=False):
+    if isinstance(pathdata, (list, tuple, Packed)):
+        if packed:
+            return pack(pathdata)
         return pathdata
 
-    output = []
-    index = 0
-    while True:
-        command, index, pathdata = parse_command(index, pathdata)
-        index, pathdata = parse_whitespace(index, pathdata)
+    # one regular expression split into [before, command, arguments, command, arguments, ...]
+    parts = _parse_split.split(pathdata)
+    index = _parse_whitespace.match(parts[0]).end()
+    if index != len(parts[0]):
+        _parse_unexpected(pathdata, index)
 
-        if command is None and index == len(pathdata):
-            break  # this is the normal way out of the loop
-        if command in ("Z", "z"):
-            output.append((command,))
-
-        ######################
-        elif command in ("H", "h", "V", "v"):
-            errstring = "Pathdata command \"%s\" requires a number at index %d" % (command, index)
-            num1, index, pathdata = parse_number(index, pathdata)
-            if num1 is None:
-                raise ValueError, errstring
-
-            while num1 is not None:
-                output.append((command, num1))
-                num1, index, pathdata = parse_number(index, pathdata)
-
-        ######################
-        elif command in ("M", "m", "L", "l", "T", "t"):
-            errstring = "Pathdata command \"%s\" requires an x,y pair at index %d" % (command, index)
-            num1, index, pathdata = parse_number(index, pathdata)
-            num2, index, pathdata = parse_number(index, pathdata)
-
-            if num1 is None:
-                raise ValueError, errstring
-
-            while num1 is not None:
-                if num2 is None:
-                    raise ValueError, errstring
-                output.append((command, num1, num2))
-
-                num1, index, pathdata = parse_number(index, pathdata)
-                num2, index, pathdata = parse_number(index, pathdata)
+    if packed:
+        output = Packed()
+        commands, coordinates = output.commands, output.coordinates
+        append = output.append
+    else:
+        output = []
+        append = output.append
+    arities, match_numbers, findall_numbers = _arity, _parse_numbers.match, _parse_number.findall  # local names are faster
+    for i in xrange(1, len(parts), 2):
+        command = parts[i]
+        args = parts[i+1]
+        arity = arities.get(command)
+        if arity is None:
+            raise ValueError, "Pathdata command \"%s\" is not recognized at index %d" % (command, index)
+
+        match = match_numbers(args)
+        end = match.end()
 
         ######################
-        elif command in ("S", "s", "Q", "q"):
-            errstring = "Pathdata command \"%s\" requires a cx,cy,x,y quadruplet at index %d" % (command, index)
-            num1, index, pathdata = parse_number(index, pathdata)
-            num2, index, pathdata = parse_number(index, pathdata)
-            num3, index, pathdata = parse_number(index, pathdata)
-            num4, index, pathdata = parse_number(index, pathdata)
-
-            if num1 is None:
-                raise ValueError, errstring
-
-            while num1 is not None:
-                if num2 is None or num3 is None or num4 is None:
-                    raise ValueError, errstring
-                output.append((command, num1, num2, num3, num4))
-
-                num1, index, pathdata = parse_number(index, pathdata)
-                num2, index, pathdata = parse_number(index, pathdata)
-                num3, index, pathdata = parse_number(index, pathdata)
-                num4, index, pathdata = parse_number(index, pathdata)
+        if arity == 0:
+            end = match.start(1)
+            append((command,))
 
         ######################
-        elif command in ("C", "c"):
-            errstring = "Pathdata command \"%s\" requires a c1x,c1y,c2x,c2y,x,y sextuplet at index %d" % (command, index)
-            num1, index, pathdata = parse_number(index, pathdata)
-            num2, index, pathdata = parse_number(index, pathdata)
-            num3, index, pathdata = parse_number(index, pathdata)
-            num4, index, pathdata = parse_number(index, pathdata)
-            num5, index, pathdata = parse_number(index, pathdata)
-            num6, index, pathdata = parse_number(index, pathdata)
-
-            if num1 is None:
-                raise ValueError, errstring
-
-            while num1 is not None:
-                if num2 is None or num3 is None or num4 is None or num5 is None or num6 is None:
-                    raise ValueError, errstring
-
-                output.append((command, num1, num2, num3, num4, num5, num6))
-
-                num1, index, pathdata = parse_number(index, pathdata)
-                num2, index, pathdata = parse_number(index, pathdata)
-                num3, index, pathdata = parse_number(index, pathdata)
-                num4, index, pathdata = parse_number(index, pathdata)
-                num5, index, pathdata = parse_number(index, pathdata)
-                num6, index, pathdata = parse_number(index, pathdata)
+        elif arity == 7:
+            start = match.start(1)
+            match = _parse_arc.match(args)
+            if match is None:
+                _parse_requires(command, index + 1 + start)
+
+            while match is not None:
+                rx, ry, angle, large_arc_flag, sweep_flag, x, y = match.group(1, 2, 3, 4, 5, 6, 7)  # the named groups, in order
+                append((command, float(rx), float(ry), float(angle), int(large_arc_flag), int(sweep_flag), float(x), float(y)))
+                end = match.end()
+                match = _parse_arc.match(args, end)
+
+            # something that looks like the start of another septuplet, but isn't one
+            if _parse_arc_start.match(args, end) is not None:
+                _parse_requires(command, index + 1 + start)
+            end = _parse_whitespace.match(args, end).end()
 
         ######################
-        elif command in ("A", "a"):
-            errstring = "Pathdata command \"%s\" requires a rx,ry,angle,large-arc-flag,sweep-flag,x,y septuplet at index %d" % (command, index)
-            num1, index, pathdata = parse_number(index, pathdata)
-            num2, index, pathdata = parse_number(index, pathdata)
-            num3, index, pathdata = parse_number(index, pathdata)
-            num4, index, pathdata = parse_boolean(index, pathdata)
-            num5, index, pathdata = parse_boolean(index, pathdata)
-            num6, index, pathdata = parse_number(index, pathdata)
-            num7, index, pathdata = parse_number(index, pathdata)
-
-            if num1 is None:
-                raise ValueError, errstring
-
-            while num1 is not None:
-                if num2 is None or num3 is None or num4 is None or num5 is None or num6 is None or num7 is None:
-                    raise ValueError, errstring
-
-                output.append((command, num1, num2, num3, num4, num5, num6, num7))
-
-                num1, index, pathdata = parse_number(index, pathdata)
-                num2, index, pathdata = parse_number(index, pathdata)
-                num3, index, pathdata = parse_number(index, pathdata)
-                num4, index, pathdata = parse_boolean(index, pathdata)
-                num5, index, pathdata = parse_boolean(index, pathdata)
-                num6, index, pathdata = parse_number(index, pathdata)
-                num7, index, pathdata = parse_number(index, pathdata)
+        else:
+            numbers = findall_numbers(match.group(1))
+            if len(numbers) == 0 or len(numbers) % arity != 0:
+                _parse_requires(command, index + 1 + match.start(1))
+
+            if packed:
+                commands.fromstring(command * (len(numbers) // arity))
+                coordinates.extend(map(float, numbers))
+            elif len(numbers) == arity == 2:
+                append((command, float(numbers[0]), float(numbers[1])))
+            else:
+                numbers = map(float, numbers)
+                if arity == 1:
+                    output.extend([(command, x) for x in numbers])
+                elif arity == 2:
+                    output.extend(zip([command] * (len(numbers) // 2), numbers[0::2], numbers[1::2]))
+                else:
+                    for j in xrange(0, len(numbers), arity):
+                        append((command,) + tuple(numbers[j:j+arity]))
+
+        if end != len(args):
+            _parse_unexpected(pathdata, index + 1 + end)
+        index += 1 + len(args)
 
     return output
 
 ############################### transformation function (keeps defaults from getting messy)
 
+_polyline = re.compile(r"[MLT]*\Z")
+
 def transform(func, pathdata):
+    if isinstance(pathdata, Packed):
+        if pathdata._pointsonly("MLTSQCZ"):
+            # every pair of numbers is an absolute x, y point: transform the coordinate array in one pass
+            coordinates = pathdata.coordinates
+            output = Packed(pathdata.commands)
+            apply = getattr(func, "apply", None)  # batch version of the transformation (see svg.apply_transformation)
+            if apply is None:
+                output.coordinates.extend(itertools.chain.from_iterable(itertools.imap(func, coordinates[0::2], coordinates[1::2])))
+            else:
+                xs, ys = apply(coordinates[0::2], coordinates[1::2])
+                output.coordinates.extend(coordinates)
+                output.coordinates[0::2] = array.array("d", xs)
+                output.coordinates[1::2] = array.array("d", ys)
+            return output
+        else:
+            return _transform(func, pathdata, Packed())
+
+    elif getattr(func, "apply", None) is not None:
+        try:
+            commands = "".join([datum[0] for datum in pathdata])
+            if _polyline.match(commands) is not None:
+                # a polyline: every element is an absolute (command, x, y)
+                xs, ys = func.apply([x for command, x, y in pathdata], [y for command, x, y in pathdata])
+                return zip(commands, xs, ys)
+        except (TypeError, ValueError, IndexError):
+            pass  # let _transform report what's wrong
+
+    return _transform(func, pathdata, [])
+
+def _transform(func, pathdata, output):
     x, y, X, Y = None, None, None, None
-    output = []
     for datum in pathdata:
         if not isinstance(datum, (tuple, list)):
             raise TypeError, "Pathdata elements must be lists/tuples"
@@ -422,23 +559,59 @@ def transform(func, pathdata):
                 y += num4
             X, Y = func(x, y)
 
-            if x is not None and y is not None:
-                centerx, centery = (x + oldx)/2., (y + oldy)/2.
-            CENTERX, CENTERY = (X + OLDX)/2., (Y + OLDY)/2.
+            matrix = getattr(func, "matrix", None)  # affine transformations map the ellipse exactly
+            if matrix is not None:
+                RX, RY, ANGLE, SWEEP_FLAG = _transform_ellipse(matrix, num1, num2, angle, sweep_flag)
+                output.append(("A", RX, RY, ANGLE, large_arc_flag, SWEEP_FLAG, X, Y))
+
+            else:
+                if x is not None and y is not None:
+                    centerx, centery = (x + oldx)/2., (y + oldy)/2.
+                CENTERX, CENTERY = (X + OLDX)/2., (Y + OLDY)/2.
 
-            rx = centerx + num1
-            ry = centery + num2
-            RX, RY = func(rx, ry)
+                rx = centerx + num1
+                ry = centery + num2
+                RX, RY = func(rx, ry)
 
-            output.append((command.capitalize(), RX - CENTERX, RY - CENTERY, angle, large_arc_flag, sweep_flag, X, Y))
+                output.append((command.capitalize(), RX - CENTERX, RY - CENTERY, angle, large_arc_flag, sweep_flag, X, Y))
 
     return output
 
+def _transform_ellipse(matrix, rx, ry, angle, sweep_flag):
+    # the ellipse's axes are the columns of E = L R(angle) diag(rx, ry), where L is the linear part of the matrix;
+    # the new radii and angle come from the eigensystem of E E^T
+    a, b, c, d, e, f = matrix
+    cosa, sina = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    e11, e21 = (a*cosa + c*sina)*rx, (b*cosa + d*sina)*rx
+    e12, e22 = (c*cosa - a*sina)*ry, (d*cosa - b*sina)*ry
+
+    p, q, r = e11**2 + e12**2, e11*e21 + e12*e22, e21**2 + e22**2
+    mean, radius = (p + r)/2., math.sqrt(((p - r)/2.)**2 + q**2)
+
+    RX = math.sqrt(mean + radius)
+    RY = math.sqrt(max(mean - radius, 0.))
+    ANGLE = math.atan2(2.*q, p - r)/2.
+
+    # keep rx on the axis that the old rx axis went to, so that a scale or rotation doesn't swap them
+    if abs(e11*math.cos(ANGLE) + e21*math.sin(ANGLE)) < abs(-e11*math.sin(ANGLE) + e21*math.cos(ANGLE)):
+        RX, RY = RY, RX
+        ANGLE += math.pi/2.
+    ANGLE = math.degrees(ANGLE)
+
+    if a*d - b*c < 0.:
+        sweep_flag = 1 - sweep_flag  # a reflection reverses the direction of the arc
+    return RX, RY, ANGLE, sweep_flag
+
 ############################### bbox function (keeps defaults from getting messy)
 
 def bbox(pathdata):
+    if isinstance(pathdata, Packed) and pathdata._pointsonly("MLTZ"):
+        # every pair of numbers is an absolute x, y endpoint
+        return defaults.BBox.from_points(pathdata.coordinates[0::2], pathdata.coordinates[1::2])
+
+    # collect the endpoints and find their bounds all at once
     x, y = None, None
-    output = defaults.BBox(None, None, None, None)
+    xs, ys = [], []
 
     for datum in pathdata:
         if not isinstance(datum, (tuple, list)):
@@ -464,7 +637,8 @@ def bbox(pathdata):
             elif command == "v":
                 y += num1
 
-            output.insert(x, y)
+            xs.append(x)
+            ys.append(y)
 
         ######################
         elif command in ("M", "m", "L", "l", "T", "t"):
@@ -476,7 +650,8 @@ def bbox(pathdata):
                 x += num1
                 y += num2
 
-            output.insert(x, y)
+            xs.append(x)
+            ys.append(y)
 
         ######################
         elif command in ("S", "s", "Q", "q"):
@@ -494,7 +669,8 @@ def bbox(pathdata):
                 x += num3
                 y += num4
 
-            output.insert(x, y)
+            xs.append(x)
+            ys.append(y)
 
         ######################
         elif command in ("C", "c"):
@@ -518,7 +694,8 @@ def bbox(pathdata):
                 x += num5
                 y += num6
 
-            output.insert(x, y)
+            xs.append(x)
+            ys.append(y)
 
         ######################
         elif command in ("A", "a"):
@@ -535,7 +712,8 @@ def bbox(pathdata):
             if x is not None and y is not None:
                 centerx, centery = (x + oldx)/2., (y + oldy)/2.
 
-            output.insert(x, y)
+            xs.append(x)
+            ys.append(y)
 
-    return output
+    return defaults.BBox.from_points(xs, ys)
 
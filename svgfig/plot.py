@@ -56,7 +56,7 @@ class Fig(trans.Delay):
     def svg(self):
         if (self.xmin is not None and self.xmax is not None and
             self.ymin is not None and self.ymax is not None):
-            self.trans = trans.window(self.xmin, self.xmax, self.ymin, self.ymax,
+            self.__dict__["trans"] = trans.window(self.xmin, self.xmax, self.ymin, self.ymax,
                                       x=self.x, y=self.y, width=self.width, height=self.height,
                                       xlogbase=self.xlogbase, ylogbase=self.ylogbase,
                                       minusInfinityX=(self.x - 10.*self.width), minusInfinityY=(self.y - 10.*self.height),
@@ -69,9 +69,25 @@ class Fig(trans.Delay):
         self._svg.__dict__["attrib"] = self.attrib
         self._svg.__dict__["_svg"] = self._svg
 
+        # a child that hasn't changed since the last render (see svg.SVG.touch) and gets the same
+        # transformation is not transformed again, and its XML is kept with it (see svg.iter_svg_to_xml)
+        stamp = svg._cache_stamp()
+        key = getattr(self.trans, "matrix", self.trans)
+        previous = self.__dict__.get("_rendered", {})
+        rendered = {}
         self._svg.__dict__["children"] = []
         for child in self.children:
-            self._svg.__dict__["children"].append(trans.transform(self.trans, child))
+            entry = previous.get(id(child))
+            if entry is None or entry[0] is not child or entry[1] != key or svg._latest(child) > entry[2]:
+                if isinstance(child, svg.SVG):
+                    svg._link(child)
+                transformed = trans.transform(self.trans, child)
+                if isinstance(transformed, svg.SVG):
+                    transformed.__dict__["_xml"] = {}
+                entry = (child, key, stamp, transformed)
+            rendered[id(child)] = entry
+            self._svg.__dict__["children"].append(entry[3])
+        self.__dict__["_rendered"] = rendered
 
         if self.clip:
             clipPath = svg.SVG("clipPath", id=svg.randomid("clip-"))(svg.SVG("rect", self.x, self.y, self.width, self.height))
@@ -79,18 +95,20 @@ class Fig(trans.Delay):
             self._svg = svg.SVG("g", clipPath, self._svg)
 
     def __getstate__(self):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         if self.trans is not None:
             del mostdict["trans"]
-            transcode = self.trans.func_code, self.trans.func_name
+            transcode = trans._transcode(self.trans)
         else:
             transcode = None
-        return (sys.version_info, defaults.version_info, mostdict, transcode)
+        return (tuple(sys.version_info), defaults.version_info, mostdict, transcode)
 
     def __setstate__(self, state):
         self.__dict__ = state[2]
         self.__dict__["trans"] = []
-        if state[3] is not None:
+        if isinstance(state[3], svg.Affine):
+            self.__dict__["trans"] = state[3]
+        elif state[3] is not None:
             code, name = state[3]
             context = globals()
             if "z" in code.co_names:
@@ -103,7 +121,7 @@ class Fig(trans.Delay):
             self.__dict__["trans"] = None
 
     def __deepcopy__(self, memo={}):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         del mostdict["trans"]
         if "repr" in mostdict:
             del mostdict["repr"]
@@ -117,7 +135,7 @@ class Fig(trans.Delay):
     def fit(self):
         bbox = defaults.BBox(None, None, None, None)
         for child in self.children:
-            bbox += child.bbox()
+            bbox += svg._cached_bbox(child)  # recomputed only for children that changed
 
         if self.xmin is not None:
             bbox.xmin = self.xmin
@@ -128,7 +146,7 @@ class Fig(trans.Delay):
         if self.ymax is not None:
             bbox.ymax = self.ymax
 
-        self.trans = trans.window(bbox.xmin, bbox.xmax, bbox.ymin, bbox.ymax,
+        self.__dict__["trans"] = trans.window(bbox.xmin, bbox.xmax, bbox.ymin, bbox.ymax,
                                   x=self.x, y=self.y, width=self.width, height=self.height,
                                   xlogbase=self.xlogbase, ylogbase=self.ylogbase,
                                   minusInfinityX=(self.x - 10.*self.width), minusInfinityY=(self.y - 10.*self.height),
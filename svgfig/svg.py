@@ -1,6 +1,5 @@
-import math, cmath, random, re, os, sys, copy, itertools, codecs, tempfile, new, types, copy_reg, warnings
-import defaults
-import _viewer
+import math, cmath, random, re, os, sys, copy, tempfile, new, types, copy_reg, warnings, itertools, operator, collections, ast, gc, time, array, struct, bisect, weakref
+import defaults, pathdata
 
 saved = [] # keep track of all fileNames saved for the user's convenience
 
@@ -32,14 +31,15 @@ class SVG:
 
         return name
 
-    Viewer = _viewer.View()
+    Viewer = None # created by the first call to view(), so that importing svgfig never needs a display
 
     def __init__(self, tag, *signature_attrib, **more_attrib):
+        rules = defaults.tagrules(tag)
         self.__dict__["tag"] = tag
-        self.__dict__["attrib"] = dict(getattr(defaults, "defaults_%s" % tag, {}))
+        self.__dict__["attrib"] = dict(rules.defaults)
         self.__dict__["children"] = []
         self.__dict__["_svg"] = self
-        signature = getattr(defaults, "signature_%s" % tag, None)
+        signature = rules.signature
 
         # if there is no signature, inline arguments are interpreted as children
         if signature is None:
@@ -61,7 +61,7 @@ class SVG:
 
         self.attrib.update(more_attrib)
 
-        require = getattr(defaults, "require_%s" % tag, None)
+        require = rules.require
         if require is not None:
             for name in require:
                 if name not in self.attrib:
@@ -70,61 +70,84 @@ class SVG:
     ### construct trees inline
     def __call__(self, *children):
         self.children.extend(children)
+        self.touch()
         return self
 
-    ### recursively tonumber, transform, bbox, and svg
+    ### changes are stamped so that renderings of unchanged subtrees can be reused (see Fig)
+    def touch(self):
+        """Marks this node as changed; only needed after changing attrib or children directly."""
+        _touch(self)
+
+    ### tonumber, transform, bbox, and svg for the whole tree (non-recursive: see _traverse)
     def tonumber(self):
-        if self.tag is not None:
-            tonumber_tag = getattr(defaults, "tonumber_%s" % self.tag, None)
-            if tonumber_tag is not None:
-                tonumber_tag(self)
+        for node, generic in _traverse(self, "tonumber"):
+            if not generic:
+                node.tonumber()
 
-        for child in self.children:
-            if isinstance(child, SVG):
-                child.tonumber()
+            elif node.tag is not None:
+                node.touch()
+                tonumber_tag = defaults.tagrules(node.tag).tonumber
+                if tonumber_tag is not None:
+                    tonumber_tag(node)
 
     def transform(self, t):
         t = canonical_transformation(t)
 
-        if self.tag is not None:
-            tonumber_tag = getattr(defaults, "tonumber_%s" % self.tag, None)
-            if tonumber_tag is not None:
-                tonumber_tag(self)
+        for node, generic in _traverse(self, "transform"):
+            if not generic:
+                node.transform(t)
 
-            transform_tag = getattr(defaults, "transform_%s" % self.tag, None)
-            if transform_tag is not None:
-                transform_tag(t, self)
+            elif node.tag is not None:
+                node.touch()
+                rules = defaults.tagrules(node.tag)
+                if rules.tonumber is not None:
+                    rules.tonumber(node)
 
-        for child in self.children:
-            if isinstance(child, SVG):
-                child.transform(t)
+                transform_tag = rules.transform
+                if transform_tag is not None:
+                    transform_tag(t, node)
 
     def bbox(self):
-        if self.tag is not None:
-            tonumber_tag = getattr(defaults, "tonumber_%s" % self.tag, None)
-            if tonumber_tag is not None:
-                tonumber_tag(self)
-
-            bbox_tag = getattr(defaults, "bbox_%s" % self.tag, None)
-            if bbox_tag is not None:
-                output = bbox_tag(self)
-            else:
-                output = defaults.BBox(None, None, None, None)
+        boxes = []
+        for node, generic in _traverse(self, "bbox"):
+            if not generic:
+                boxes.append(_cached_bbox(node))
 
-        for child in self.children:
-            if isinstance(child, SVG):
-                output += child.bbox()
-        return output
+            elif node.tag is not None:
+                rules = defaults.tagrules(node.tag)
+                if rules.tonumber is not None:
+                    rules.tonumber(node)
+
+                bbox_tag = rules.bbox
+                if bbox_tag is not None:
+                    boxes.append(bbox_tag(node))
+
+        # the union of all the boxes is the box around all of their corners
+        return defaults.BBox.from_points([b.xmin for b in boxes] + [b.xmax for b in boxes],
+                                         [b.ymin for b in boxes] + [b.ymax for b in boxes])
 
     def svg(self):
         self._svg = self
 
+    def dedupe(self, prefix="dedupe"):
+        """Moves repeated subtrees into a <defs> at the top of this tree and puts <use> elements in
+        their places, wherever that makes the XML shorter.  Returns the number of subtrees moved.
+
+        Repeats are equal subtrees (not counting their ids, which they must not have) in <svg>, <g>,
+        and other containers.  The moved subtrees get ids prefix1, prefix2, etc.  Since transform
+        and bbox only see the <use> elements' x and y, this should be the last step before output.
+        """
+        return _dedupe(self, prefix)
+
     ### signature attributes are accessible as member data
     def __getattr__(self, name):
         if self.__dict__["tag"] is None:
-            return self.__dict__[name]
+            try:
+                return self.__dict__[name]
+            except KeyError:
+                raise AttributeError, name  # so that cPickle and getattr(obj, name, default) work
 
-        signature = getattr(defaults, "signature_%s" % self.__dict__["tag"], None)
+        signature = defaults.tagrules(self.__dict__["tag"]).signature
         if signature is not None and name in signature:
             return self.attrib[name]
         else:
@@ -135,12 +158,18 @@ class SVG:
             self.__dict__[name] = value
 
         else:
-            signature = getattr(defaults, "signature_%s" % self.__dict__["tag"], None)
+            signature = defaults.tagrules(self.__dict__["tag"]).signature
             if signature is not None and name in signature:
                 self.attrib[name] = value
             else:
                 raise AttributeError, "Tag '%s' has no signature attrib '%s'" % (self.tag, name)
 
+        if name not in ("_svg", "repr"):
+            if "_parents" in self.__dict__:
+                _touch(self)
+            else:
+                self.__dict__["_stamp"] = _stamps.next()  # self.touch(), inlined because this is frequent
+
     def __nonzero__(self):
         return True
 
@@ -171,6 +200,7 @@ class SVG:
             obj.attrib[treeindex] = value
         else:
             raise IndexError, "treeindex must be [#, #, ... #] or [#, #, ... \"str\"]"
+        obj.touch()
 
     def __delitem__(self, treeindex):
         treeindex, obj = self._treeindex_descend(self, treeindex)
@@ -181,58 +211,39 @@ class SVG:
             del obj.attrib[treeindex]
         else:
             raise IndexError, "treeindex must be [#, #, ... #] or [#, #, ... \"str\"]"
+        obj.touch()
 
-    ################ nested class for walking the tree
-    class _SVGDepthIterator:
-        def __init__(self, svg, treeindex, depth_limit, attrib, attrib_first):
-            self.current = svg
-            self.treeindex = treeindex
-            self.shown = False
-            self.depth_limit = depth_limit
-            self.attrib = attrib
-            self.attrib_first = attrib_first
-
-        def __iter__(self):
-            return self
-
-        def make_children_iterators(self):
-            if getattr(self.current, "children", None) is not None:
-                for i, s in enumerate(self.current.children):
-                    self.iterators.append(self.__class__(s, self.treeindex + (i,), self.depth_limit, self.attrib, self.attrib_first))
-
-        def make_attrib_iterators(self):
-            if getattr(self.current, "attrib", None) is not None:
-                items = self.current.attrib.items()
-                items.sort()
-                for k, s in items:
-                    self.iterators.append(self.__class__(s, self.treeindex + (k,), self.depth_limit, self.attrib, self.attrib_first))
-
-        def next(self):
-            if not self.shown:
-                self.shown = True
-                if self.treeindex != ():
-                    return self.treeindex, self.current
-
-            if self.depth_limit is not None and len(self.treeindex) >= self.depth_limit:
-                raise StopIteration
-
-            if "iterators" not in self.__dict__:
-                self.iterators = []
-
-                if self.attrib and self.attrib_first:
-                    self.make_attrib_iterators()
-                self.make_children_iterators()
-                if self.attrib and not self.attrib_first:
-                    self.make_attrib_iterators()
-
-                self.iterators = itertools.chain(*self.iterators)
-
-            return self.iterators.next()
-    ################ end nested class
-
-    ### walk the tree or show it (uses the nested class)
+    ### walk the tree or show it
     def walk(self, depth_limit=None, attrib=False, attrib_first=False):
-        return self._SVGDepthIterator(self, (), depth_limit, attrib, attrib_first)
+        # explicit stack of (treeindex, object); children are pushed in reverse so that they come out in order
+        stack = [((), self)]
+        while len(stack) > 0:
+            treeindex, current = stack.pop()
+            if treeindex != ():
+                yield treeindex, current
+
+            if depth_limit is not None and len(treeindex) >= depth_limit:
+                continue
+
+            substack = []
+            if attrib and attrib_first:
+                self._walk_attrib(current, treeindex, substack)
+            children = getattr(current, "children", None)
+            if children is not None:
+                for i, s in enumerate(children):
+                    substack.append((treeindex + (i,), s))
+            if attrib and not attrib_first:
+                self._walk_attrib(current, treeindex, substack)
+
+            substack.reverse()
+            stack.extend(substack)
+
+    def _walk_attrib(self, current, treeindex, substack):
+        if getattr(current, "attrib", None) is not None:
+            items = current.attrib.items()
+            items.sort()
+            for k, s in items:
+                substack.append((treeindex + (k,), s))
 
     def tree(self, depth_limit=None, attrib=False, attrib_first=False, index_width=20, showtop=True, asstring=False):
         if showtop:
@@ -278,7 +289,7 @@ class SVG:
                 repr_value = "'%s'" % value
             output.append(repr_value)
 
-        signature = getattr(defaults, "signature_%s" % self.tag, None)
+        signature = defaults.tagrules(self.tag).signature
         if signature is not None:
             for name in signature:
                 try:
@@ -337,19 +348,47 @@ class SVG:
         return "<%s>" % " ".join(output)
 
     ### convert to XML, view, and save
-    def xml(self, indent=u"    ", newl=u"\n"):
+    def iter_xml(self, indent=u"    ", newl=u"\n"):
         # need a parent node
         if self.tag == "svg" or "_tag" in self.__dict__ and self._tag == "svg":
             svg = self
         else:
             svg = SVG("svg")(self)
 
-        output = [defaults.xml_header] + svg_to_xml(svg, indent) + [u""]
-        return unicode(newl.join(output))
+        yield defaults.xml_header + newl
+        for line in iter_svg_to_xml(svg, indent):
+            yield line + newl
+
+    def xml(self, indent=u"    ", newl=u"\n"):
+        return unicode(u"".join(self.iter_xml(indent, newl)))
+
+    def write(self, fileobj, encoding="utf-8", indent=u"    ", newl=u"\n", buffersize=65536):
+        # chunks are collected until there are about buffersize characters, so that memory use does not grow with the document
+        chunks = []
+        size = 0
+        for chunk in self.iter_xml(indent, newl):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= buffersize:
+                chunk = u"".join(chunks)
+                if encoding is not None:
+                    chunk = chunk.encode(encoding)
+                fileobj.write(chunk)
+                chunks = []
+                size = 0
+
+        if len(chunks) > 0:
+            chunk = u"".join(chunks)
+            if encoding is not None:
+                chunk = chunk.encode(encoding)
+            fileobj.write(chunk)
 
 
     def view(self): # no writing-to-disk needed!
-		self.Viewer.renderSVG(self.xml())
+        if SVG.Viewer is None:
+            import _viewer # loads cairo, rsvg, and gtk: only do it if the user asks
+            SVG.Viewer = _viewer.View()
+        SVG.Viewer.renderSVG(self.xml())
 
     def save(self, fileName, encoding="utf-8", compresslevel=None):
         fileName = defaults._expand_fileName(fileName)
@@ -357,17 +396,16 @@ class SVG:
         if compresslevel is not None or re.search(r"\.svgz$", fileName, re.I) or re.search(r"\.gz$", fileName, re.I):
             import gzip
             if compresslevel is None:
-                f = gzip.GzipFile(fileName, "w")
+                f = gzip.GzipFile(fileName, "wb")
             else:
-                f = gzip.GzipFile(fileName, "w", compresslevel)
-
-            f = codecs.EncodedFile(f, "utf-16", encoding)
-            f.write(self.xml())
-            f.close()
+                f = gzip.GzipFile(fileName, "wb", compresslevel)
 
         else:
-            f = codecs.open(fileName, "w", encoding=encoding)
-            f.write(self.xml())
+            f = open(fileName, "wb")
+
+        try:
+            self.write(f, encoding)
+        finally:
             f.close()
 
         saved.append(fileName)
@@ -396,7 +434,7 @@ class SVG:
 
     ### pickleability and value-based equality
     def __getstate__(self):
-        return (sys.version_info, defaults.version_info, self.__dict__)
+        return (tuple(sys.version_info), defaults.version_info, _uncached(self.__dict__))
 
     def __setstate__(self, state):
         python_version = state[0]
@@ -410,35 +448,46 @@ class SVG:
             return True
         if self.__class__ != other.__class__:
             return False
-        selfdict = copy.copy(self.__dict__)
-        otherdict = copy.copy(other.__dict__)
-        del selfdict["_svg"]
-        del otherdict["_svg"]
-        return selfdict == otherdict
+
+        # not by digest first: checking that a digest is current takes a walk over the whole
+        # tree, which is as long as comparing (see _digest)
+        return _equal(self, other)
+
+    def digest(self):
+        """Hash of this tree's content: equal trees have equal digests.
+
+        Each node keeps its digest, which is recomputed only if the node or something below it
+        changed (whether or not it was touched).  Digests are not stable between processes, like
+        hash()."""
+        return _digest(self)
 
     def __ne__(self, other):
         return not (self == other)
 
     def __deepcopy__(self, memo={}):
         output = new.instance(self.__class__)
-        output.__dict__ = copy.deepcopy(self.__dict__, memo)
+        memo[id(self)] = output  # before copying _svg, which is usually self
+        output.__dict__ = copy.deepcopy(_uncached(self.__dict__), memo)
         if "repr" in output.__dict__:
             del output.__dict__["repr"]
-        memo[id(self)] = output
         return output
 
     ### act like a list
     def append(self, other):
         self.children.append(other)
+        self.touch()
 
     def prepend(self, other):
         self.children[0:0] = [other]
+        self.touch()
 
     def insert(self, i, other):
         self.children.insert(i, other)
+        self.touch()
 
     def remove(self, other):
         self.children.remove(other)
+        self.touch()
 
     def __len__(self):
         return len(self.children)
@@ -450,6 +499,7 @@ class SVG:
             self.children.append(other)
         else:
             self.children.extend(other)
+        self.touch()
 
     def __add__(self, other):
         output = copy.deepcopy(self)
@@ -458,6 +508,7 @@ class SVG:
 
     def __iadd__(self, other):
         self.children.append(other)
+        self.touch()
         return self
 
     def __mul__(self, other):
@@ -470,6 +521,7 @@ class SVG:
 
     def __imul__(self, other):
         self.children *= other
+        self.touch()
         return self
 
     def count(self, *args, **kwds):
@@ -479,9 +531,11 @@ class SVG:
         return self.children.index(*args, **kwds)
 
     def pop(self, *args, **kwds):
+        self.touch()
         return self.children.pop(*args, **kwds)
 
     def reverse(self, *args, **kwds):
+        self.touch()
         return self.children.reverse(*args, **kwds)
 
     ### act like a dict
@@ -494,6 +548,7 @@ class SVG:
             self.attrib.update(other.attrib)
         else:
             self.attrib.update(other)
+        self.touch()
 
     def __contains__(self, other):
         return other in self.attrib or other in self.children
@@ -517,6 +572,7 @@ class SVG:
         return self.attrib.get(*args, **kwds)
 
     def setdefault(self, *args, **kwds):
+        self.touch()
         return self.attrib.setdefault(*args, **kwds)
 
     def iteritems(self, *args, **kwds):
@@ -529,9 +585,11 @@ class SVG:
         return self.attrib.itervalues(*args, **kwds)
 
     def pop(self, *args, **kwds): # XXX (different) redefinition of pop method!
+        self.touch()
         return self.attrib.pop(*args, **kwds)
 
     def popitem(self, *args, **kwds):
+        self.touch()
         return self.attrib.popitem(*args, **kwds)
 
     def copy(self):
@@ -540,66 +598,470 @@ class SVG:
     def deepcopy(self):
         return copy.deepcopy(self)
 
-############################### rules for converting into XML
+############################### non-recursive traversal (deeply nested documents don't hit the recursion limit)
 
-# how to convert SVG objects into XML (as a list of lines to be joined later)
-def svg_to_xml(svg, indent, depth=0):
-    # if the tag is None, it's a dynamic object that needs to be turned into _svg
-    if isinstance(svg, SVG) and svg.tag is None:
-        svg.svg()
-        svg = svg._svg  # follow that? good.
+# Yields (node, generic) for top and every SVG below it, parents before children.  If generic is
+# True, the caller applies the SVG version of method to that node alone, and the node's children
+# are visited next; if False, the node's class overrides method, so the caller should call it
+# and its children are not visited.
+def _traverse(top, method):
+    generic = getattr(SVG, method).im_func
+    classes = {SVG: True}  # whether each class uses the SVG version of method
 
-    if isinstance(svg, basestring):
-        return [svg]
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        cls = node.__class__
+        try:
+            isgeneric = classes[cls]
+        except KeyError:
+            isgeneric = classes[cls] = (getattr(cls, method).im_func is generic)
+
+        if isgeneric or node is top:
+            yield node, True
+            children = node.children
+            i = len(children) - 1
+            while i >= 0:
+                child = children[i]
+                if isinstance(child, SVG):
+                    stack.append(child)
+                i -= 1
 
-    elif isinstance(svg, SVG):
-        line = [indent * depth, u"<", svg.tag, u" "]
-        remaining = copy.copy(svg.attrib)  # shallow copy that we can pop
+        else:
+            yield node, False
+
+############################### change tracking
+
+_stamps = itertools.count(1)  # touch() stamps: a change made later always has a larger stamp
+
+# bookkeeping for cached renderings, which copies, pickles, and comparisons leave out
+_caches = ("_stamp", "_parents", "_rendered", "_xml", "_bbox", "_digest")
+
+def _uncached(d):
+    if "_stamp" in d or "_parents" in d or "_rendered" in d or "_xml" in d or "_bbox" in d or "_digest" in d:
+        d = dict([(name, value) for name, value in d.iteritems() if name not in _caches])
+    return d
+
+# A node whose renderings or bbox are kept (see _cached_bbox and plot.Fig) first links its subtree:
+# each node below it gets _parents, weak references to the nodes directly above it.  touch() stamps
+# the node and everything above it along these links, so a node's stamp is the latest change in its
+# subtree, and checking a cache only takes the stamps of the node and of the nodes directly below it.
+# The climb stops at nodes stamped after the latest cache was made: they (and so everything above
+# them) already look changed to every cache, so a burst of changes climbs once.
+_cached = 0  # the stamp of the latest cache, from _cache_stamp
+
+def _cache_stamp():
+    # a stamp for a cache that is about to be made, before computing it, so that changes made meanwhile invalidate it
+    global _cached
+    _cached = _stamps.next()
+    return _cached
+
+def _touch(node):
+    d = node.__dict__
+    stamp = d["_stamp"] = _stamps.next()
+    if "_parents" in d:
+        stack = [d["_parents"]]
+        while stack:
+            for ref in stack.pop():
+                parent = ref()
+                if parent is not None:
+                    d = parent.__dict__
+                    if d.get("_stamp", 0) <= _cached:
+                        d["_stamp"] = stamp
+                        if "_parents" in d:
+                            stack.append(d["_parents"])
+
+def _below(d):
+    # the nodes directly below a node with this __dict__: its children and a Curve's marks
+    output = [child for child in d.get("children", ()) if isinstance(child, SVG)]
+    if "marks" in d:
+        for item in d["marks"]:
+            if isinstance(item, tuple) and isinstance(item[-1], SVG):
+                output.append(item[-1])
+    return output
 
+def _link(top):
+    # sets _parents throughout top's subtree; a link that is no longer true only costs a needless stamp
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        for child in _below(node.__dict__):
+            d = child.__dict__
+            parents = tuple([ref for ref in d.get("_parents", ()) if ref() is not None])
+            if not [ref for ref in parents if ref() is node]:
+                parents += (weakref.ref(node),)
+            d["_parents"] = parents  # replaced, never changed in place: copy.copy shares it
+            stack.append(child)
+
+def _latest(top):
+    # the largest stamp in top's subtree, or 0 if none of it was ever changed, once top is linked
+    if not isinstance(top, SVG):
+        return 0
+    latest = top.__dict__.get("_stamp", 0)
+    for child in _below(top.__dict__):
+        stamp = child.__dict__.get("_stamp", 0)
+        if stamp > latest:
+            latest = stamp
+    return latest
+
+def _cached_bbox(node):
+    # node.bbox(), kept in the node until something in its subtree changes
+    entry = node.__dict__.get("_bbox")
+    if entry is None or _latest(node) > entry[0]:
+        stamp = _cache_stamp()
+        _link(node)
+        entry = node.__dict__["_bbox"] = (stamp, node.bbox())
+    bbox = entry[1]
+    return defaults.BBox(bbox.xmin, bbox.xmax, bbox.ymin, bbox.ymax)
+
+############################### content hashes
+
+# _digest(top) hashes everything that == compares (class and member data other than _svg and the
+# caches), using the digests of the children in place of the children: equal trees have equal
+# digests.  Each node keeps _digest = (digest, snapshot, children, keys): a copy of its own content
+# (see _summary), of its list of children, and the names in its __dict__.  The digest is recomputed
+# only if these no longer match or a child's digest changed, so changes made directly to attrib or
+# children count too, touched or not.  Like hash(), digests are for this process.
+def _digest(top):
+    # parents come before their children in order, so reversed(order) has the children first
+    order = []
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        for child in node.__dict__.get("children", ()):
+            if isinstance(child, SVG):
+                stack.append(child)
+
+    changed = set()  # ids of the nodes whose digests changed
+    for node in reversed(order):
+        d = node.__dict__
+        children = d.get("children", ())
+        entry = d.get("_digest")
+        if entry is not None and entry[1] is not None and children == entry[2]:
+            own = entry[1]
+            if d.viewkeys() == entry[3] or d.viewkeys() - _digest_skip == own.viewkeys():
+                for name, value in own.iteritems():
+                    if d[name] != value:
+                        break
+                else:
+                    if not changed:
+                        continue
+                    for child in children:
+                        if id(child) in changed:
+                            break
+                    else:
+                        continue
+
+        contents = []
+        own = {}
+        for name, value in d.iteritems():
+            if name not in _digest_skip:
+                content, snapshot = _summary(value)
+                contents.append((name, content))
+                if snapshot is _unknown:
+                    own = None
+                elif own is not None:
+                    own[name] = snapshot
+        digest = hash((node.__class__.__name__, frozenset(contents),
+                       tuple([child.__dict__["_digest"][0] if isinstance(child, SVG) else _summary(child)[0] for child in children])))
+        if entry is None or digest != entry[0]:
+            changed.add(id(node))
+
+        keys = frozenset(d.viewkeys() | _digest_name)
+        keys = _digest_keys.setdefault(keys, keys)  # most nodes have the same names: keep one copy
+        d["_digest"] = (digest, own, children[:] if children else _digest_empty.get(type(children), children), keys)
+
+    return top.__dict__["_digest"][0]
+
+_digest_skip = set(("_svg", "children") + _caches)
+_digest_name = set(["_digest"])
+_digest_keys = {}
+_digest_empty = {list: [], tuple: ()}  # shared copies of no children (never changed)
+
+_unknown = object()
+_immutable = set([str, unicode, int, long, float, bool, complex, type(None)])
+
+def _summary(value):
+    # (something hashable in value's place that is equal whenever value is, a copy of value that stays
+    # equal to it until value is changed in place); the copy is _unknown if value holds SVGs, whose
+    # changes only their own digests can tell
+    t = type(value)
+    if t in _immutable:
+        return value, value
+
+    elif t is dict:
         try:
-            line.append(u"id=\"%s\" " % remaining.pop("id"))
-        except KeyError:
+            return frozenset(value.iteritems()), dict(value)
+        except TypeError:
+            pass
+        contents = []
+        snapshot = {}
+        for key, item in value.iteritems():
+            content, copy = _summary(item)
+            contents.append((key, content))
+            if copy is _unknown:
+                snapshot = _unknown
+            elif snapshot is not _unknown:
+                snapshot[key] = copy
+        return frozenset(contents), snapshot
+
+    elif t is list or t is tuple:
+        content = tuple(value)
+        try:
+            hash(content)
+            return content, (list(value) if t is list else value)
+        except TypeError:
             pass
+        summaries = map(_summary, value)
+        snapshot = [copy for content, copy in summaries]
+        if [copy for copy in snapshot if copy is _unknown]:
+            snapshot = _unknown
+        elif t is tuple:
+            snapshot = tuple(snapshot)
+        return tuple([content for content, copy in summaries]), snapshot
+
+    elif isinstance(value, SVG):
+        return _digest(value), _unknown
+
+    elif isinstance(value, pathdata.Packed):
+        return tuple(value), pathdata.Packed(value.commands, value.coordinates)  # equal to the same pathdata as a list
+
+    try:
+        hash(value)
+        return value, value
+    except TypeError:
+        return None, value  # equality unknown, so no contribution, and only identity matters
+
+def _equal(one, two):
+    # one == two for SVGs, without recursion
+    stack = [(one, two)]
+    while stack:
+        one, two = stack.pop()
+        if one is two:
+            continue
+        if one.__class__ != two.__class__:
+            return False
 
-        # signature attributes first, for readability
-        signature = getattr(defaults, "signature_%s" % svg.tag, None)
-        if signature is not None:
-            for name in signature:
-                try:
-                    line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining.pop(name))))
-                except KeyError: pass
+        d1, d2 = one.__dict__, two.__dict__
+        if d1.get("tag") != d2.get("tag") or d1.get("attrib") != d2.get("attrib"):
+            return False
+        keys1, keys2 = d1.viewkeys(), d2.viewkeys()
+        if (keys1 != _equal_usual and keys1 != _equal_digested) or (keys2 != _equal_usual and keys2 != _equal_digested):
+            extra = d1.viewkeys() - _equal_skip
+            if extra != d2.viewkeys() - _equal_skip:
+                return False
+            for name in extra:
+                if d1[name] != d2[name]:
+                    return False
+
+        children1, children2 = d1.get("children", ()), d2.get("children", ())
+        if len(children1) != len(children2):
+            return False
+        for child1, child2 in zip(children1, children2):
+            cls = child1.__class__
+            try:
+                plain = _equal_plain[cls]
+            except KeyError:
+                plain = _equal_plain[cls] = (type(child1) is types.InstanceType and isinstance(child1, SVG) and
+                                             cls.__eq__.im_func in (SVG.__eq__.im_func, Comment.__eq__.im_func, CDATA.__eq__.im_func))
+            if plain:
+                if child2.__class__ is not cls:
+                    return False
+                stack.append((child1, child2))
+            elif child1 != child2:
+                return False
+
+    return True
+
+_equal_skip = _digest_skip | set(["tag", "attrib"])
+_equal_usual = set(["tag", "attrib", "children", "_svg"])  # the keys of most nodes
+_equal_digested = _equal_usual | set(["_digest"])  # and once they have digests
+_equal_plain = {}  # whether each class compares like SVG, so that its children can be compared here
+
+# containers whose children may be replaced by <use> (and whose contents are searched for repeats)
+_dedupe_containers = set(["svg", "g", "a", "switch", "symbol", "marker", "mask", "pattern", "clipPath"])
+
+def _dedupe(top, prefix):
+    if top.tag not in _dedupe_containers:
+        return 0
+
+    # find the candidates in pre-order, with each one's place, depth, and pre-order extent
+    _digest(top)
+    ids = set()
+    places = []
+    stack = [(top, None, None, 0)]
+    while stack:
+        node, parent, index, depth = stack.pop()
+        if "id" in node.attrib:
+            ids.add(node.attrib["id"])
+        place = [node, parent, index, len(places), None, depth]
+        places.append(place)
+
+        stack.append((None, place, None, None))  # marks the end of node's subtree
+        if node.tag in _dedupe_containers:
+            for i in xrange(len(node.children) - 1, -1, -1):
+                child = node.children[i]
+                if isinstance(child, SVG) and child.tag is not None:
+                    stack.append((child, node, i, depth + 1))
+        while stack and stack[-1][0] is None:
+            stack.pop()[1][4] = len(places)
+
+    groups = collections.OrderedDict()  # in the order of first appearance, so outer subtrees come first
+    for place in places[1:]:
+        node = place[0]
+        if node.__class__ is SVG and "id" not in node.attrib:
+            groups.setdefault(node.__dict__["_digest"][0], []).append(place)
+
+    # replace the repeats that save space (all but the first with <use>, and the first is moved to <defs>)
+    indent = len(u"    ")  # the default, for estimating sizes
+    defs = []
+    replaced = []  # sorted pre-order extents of the subtrees that are gone
+    starts = []    # sorted pre-order starts of the nodes that were replaced, with or without their subtrees
+    number = 1
+    for group in groups.values():
+        group = [place for place in group if not _within(place, replaced)]
+        while len(group) > 1:
+            # replacements so far may have changed some of these subtrees (the same way, if they were equal)
+            first = group[0]
+            digest = _digest(first[0]) if _around(first, starts) else first[0].__dict__["_digest"][0]
+            same, group = [first], group[1:]
+            rest = []
+            for place in group:
+                if (_digest(place[0]) if _around(place, starts) else place[0].__dict__["_digest"][0]) == digest and _equal(first[0], place[0]):
+                    same.append(place)
+                else:
+                    rest.append(place)
+            group = rest
+            if len(same) < 2:
+                continue
+
+            while "%s%d" % (prefix, number) in ids:
+                number += 1
+            name = "%s%d" % (prefix, number)
+
+            # XML saved by the replacement, in characters (with newlines and the default indent)
+            lines = list(iter_svg_to_xml(first[0], u"", 0))
+            size = sum(map(len, lines)) + len(lines)
+            use = sum(map(len, iter_svg_to_xml(SVG("use", 0, 0, "#" + name), u"", 0))) + 1
+            saved = sum([size - use + indent * place[5] * (len(lines) - 1) for place in same])
+            saved -= size + indent * 2 * len(lines) + len(u"id=\"\" ") + len(name)
+            if len(defs) == 0:
+                saved -= 2 * indent + len(u"<defs >\n</defs>\n")
+            if saved <= 0:
+                continue
+
+            for node, parent, index, start, end, depth in same:
+                parent.children[index] = SVG("use", 0, 0, "#" + name)
+                parent.touch()
+                bisect.insort(starts, start)
+                if node is not first[0]:
+                    bisect.insort(replaced, (start, end))
+            first[0].attrib["id"] = name
+            first[0].touch()
+            defs.append(first[0])
+            number += 1
+
+    if len(defs) > 0:
+        top.children.insert(0, SVG("defs", *defs))
+        top.touch()
+    return len(defs)
+
+def _within(place, replaced):
+    # True if place is inside one of the replaced (start, end) extents
+    i = bisect.bisect_right(replaced, (place[3], place[4])) - 1
+    return i >= 0 and replaced[i][0] <= place[3] < replaced[i][1]
+
+def _around(place, starts):
+    # True if one of the starts is in place's subtree, below place itself
+    i = bisect.bisect_right(starts, place[3])
+    return i < len(starts) and starts[i] < place[4]
 
-        remainingkeys = remaining.keys()
-        remainingkeys.sort() # for reproducible XML (maybe also helps readability)
-        for name in remainingkeys:
-            line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining[name])))
+############################### rules for converting into XML
 
-        if len(svg.children) == 0:
-            line.append(u"/>")
-            return [u"".join(line)]
+# how to convert SVG objects into XML (as a list of lines to be joined later)
+def svg_to_xml(svg, indent, depth=0):
+    return list(iter_svg_to_xml(svg, indent, depth))
+
+# the same, but yielding one line at a time so that the whole document is never in memory
+def iter_svg_to_xml(svg, indent, depth=0, _fragment=None):
+    # explicit stack of (object, depth); closing tags are pushed as (string, None)
+    stack = [(svg, depth)]
+    while len(stack) > 0:
+        svg, depth = stack.pop()
+        if depth is None:
+            yield svg
+            continue
+
+        # nodes that Fig keeps between renders also keep their XML (_fragment is the one being made)
+        if isinstance(svg, SVG) and svg is not _fragment:
+            fragments = svg.__dict__.get("_xml")
+            if fragments is not None:
+                if (indent, depth) not in fragments:
+                    fragments[indent, depth] = list(iter_svg_to_xml(svg, indent, depth, svg))
+                for line in fragments[indent, depth]:
+                    yield line
+                continue
+
+        # if the tag is None, it's a dynamic object that needs to be turned into _svg
+        if isinstance(svg, SVG) and svg.tag is None:
+            svg.svg()
+            svg = svg._svg  # follow that? good.
+
+        if isinstance(svg, basestring):
+            yield svg
+
+        elif isinstance(svg, SVG):
+            line = _xml_start(svg, indent, depth)
+            if len(svg.children) == 0:
+                line.append(u"/>")
+                yield u"".join(line)
 
-        else:
-            line.append(u">")
+            else:
+                line.append(u">")
 
-            # no indenting for text
-            if svg.tag in ("text", "tspan"):
-                for i in svg.children:
-                    line.extend(svg_to_xml(i, indent, 0))
-                line.append(u"</%s>" % (svg.tag))
-                return [u"".join(line)]
+                # no indenting for text
+                if svg.tag in ("text", "tspan"):
+                    for i in svg.children:
+                        line.extend(iter_svg_to_xml(i, indent, 0))
+                    line.append(u"</%s>" % (svg.tag))
+                    yield u"".join(line)
 
-            else:
-                lines = [u"".join(line)]
-                for i in svg.children:
-                    lines.extend(svg_to_xml(i, indent, depth+1))
-                lines.append(u"%s</%s>" % (indent * depth, svg.tag))
-                return lines
+                else:
+                    yield u"".join(line)
+                    stack.append((u"%s</%s>" % (indent * depth, svg.tag), None))
+                    for i in reversed(svg.children):
+                        stack.append((i, depth+1))
 
-    else:
-        if type(svg) == types.InstanceType:
-            raise TypeError, "SVG contains an unrecognized object: instance of class %s" % svg.__class__.__name__
         else:
-            raise TypeError, "SVG contains an unrecognized object: %s" % type(svg)
+            if type(svg) == types.InstanceType:
+                raise TypeError, "SVG contains an unrecognized object: instance of class %s" % svg.__class__.__name__
+            else:
+                raise TypeError, "SVG contains an unrecognized object: %s" % type(svg)
+
+# the start tag of svg, as a list of strings without the closing ">" or "/>"
+def _xml_start(svg, indent, depth):
+    line = [indent * depth, u"<", svg.tag, u" "]
+    remaining = copy.copy(svg.attrib)  # shallow copy that we can pop
+
+    try:
+        line.append(u"id=\"%s\" " % remaining.pop("id"))
+    except KeyError:
+        pass
+
+    # signature attributes first, for readability
+    signature = defaults.tagrules(svg.tag).signature
+    if signature is not None:
+        for name in signature:
+            try:
+                line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining.pop(name))))
+            except KeyError: pass
+
+    remainingkeys = remaining.keys()
+    remainingkeys.sort() # for reproducible XML (maybe also helps readability)
+    for name in remainingkeys:
+        line.append(u"%s=\"%s\" " % (name, attrib_to_xml(svg.tag, name, remaining[name])))
+    return line
 
 # how to convert different attribute types into XML
 def attrib_to_xml(tag, name, value):
@@ -609,6 +1071,9 @@ def attrib_to_xml(tag, name, value):
     elif isinstance(value, (int, long, float)):
         return repr(value)  # more precise
 
+    elif isinstance(value, pathdata.Packed) and tag == "path" and name == "d":
+        return value.xml()
+
     elif isinstance(value, (list, tuple)) and tag == "path" and name == "d":
         def numbertostr(x):
             if isinstance(x, (int, long, float)):
@@ -625,7 +1090,7 @@ def attrib_to_xml(tag, name, value):
             command = datum[0]
             args = map(numbertostr, datum[1:])
 
-            if lastcommand == command:
+            if lastcommand == command and len(datum) > 1:
                 line.append(u" ")
                 line.append(u" ".join(args))
                 lastcommand = command
@@ -720,119 +1185,865 @@ class CDATA(SVG):
 
 ############################### reading SVG from a file
 
-def load(fileName):
+def _open(fileName, mapped=False):
     if re.search(r"\.svgz$", fileName, re.I) or re.search(r"\.gz$", fileName, re.I):
         import gzip
-        f = gzip.GzipFile(fileName)
+        return gzip.GzipFile(fileName)
+    elif mapped:
+        import mmap
+        f = file(fileName, "rb")
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # has read(), like a file
+        except (ValueError, EnvironmentError):
+            return f  # empty files can't be mapped
     else:
-        f = file(fileName)
-    return load_stream(f)
+        return file(fileName)
+
+def load(fileName):
+    return load_stream(_open(fileName))
 
 def template(fileName, svg, replaceme="REPLACEME"):
-    output = load(fileName)
-    for treeindex, i in output.walk():
-        if isinstance(i, SVG) and i.tag == replaceme:
-            output[treeindex] = svg
-    return output
+    loader = _TemplateLoader(replaceme)
+    _parse(loader, _open(fileName))
+    for parent, i in loader.found:
+        parent[i] = svg
+    return loader.output
 
 def load_stream(stream):
-    from xml.sax import handler, make_parser
-    from xml.sax.handler import feature_namespaces, feature_external_ges, feature_external_pes
-
-    # With a little thought, this could be streamlined.  In its current
-    # state, it works (with processing instructions, comments, and CDATA).
-    class ContentHandler(handler.ContentHandler):
-        def __init__(self):
-            self.stack = []
-            self.output = None
-            self.all_whitespace = re.compile(r"^\s*$")
-            self.CDATA = False
-
-        def startElement(self, tag, attrib):
-            s = SVG(tag)
-            s.attrib = dict(attrib.items())
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-                last.children.append(s)
-            self.stack.append(s)
-
-        def characters(self, ch):
-            if self.CDATA:
-                last = self.stack[-1]
-                last.text += ch
+    """Reads SVG from a file-like object (anything with a read method) and returns the top element."""
+    loader = _Loader()
+    _parse(loader, stream)
+    return loader.output
+
+def iter_load(fileName, match=None):
+    return iter_load_stream(_open(fileName), match)
+
+def iter_load_stream(stream, match=None):
+    """Yields (treeindex, element) for each element that matches, as soon as it ends.
+
+    match is a tag, a function that gets each element as it starts (with its attrib, but no children
+    yet) and returns True to keep it, or None for all elements.  Only matching elements and their
+    contents are built, so the rest of a large file is never in memory.  Each treeindex is where the
+    element would be in the tree that load_stream returns.
+    """
+    return _iter_parse(_PartialLoader(match), stream)
+
+def iter_template(fileName, svg, replaceme="REPLACEME", indent=u"    ", newl=u"\n"):
+    """Yields the same XML as template(fileName, svg, replaceme).iter_xml(indent, newl), writing
+    each part of the template as it is read instead of loading all of it first."""
+    yield defaults.xml_header + newl
+    for line in _iter_parse(_TemplateWriter(svg, replaceme, indent), _open(fileName)):
+        yield line + newl
+
+def load_many(fileNames, workers=None, serialized=False):
+    """Loads each of fileNames as load does, in a pool of worker processes.
+
+    Returns a list of (svg, seconds, maxrss) in the order of fileNames: seconds is the time taken to
+    read and parse the file and maxrss is the peak memory use, in bytes, of the process that loaded
+    it (so far; None where the resource module is unavailable).  Uncompressed files are read through
+    mmap.  workers is the number of processes, one per CPU by default; with workers=1, the files are
+    loaded in this process.  Workers send their results back as dumps strings; with serialized=True,
+    each svg is left as such a string (to be stored somewhere, for instance), for loads to decode later.
+    """
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1 or len(fileNames) <= 1:
+        # not _keeping: each file is already parsed with garbage collection paused
+        return map(_load_one, [(fileName, serialized) for fileName in fileNames])
+
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        output = pool.map(_load_one, [(fileName, True) for fileName in fileNames])
+    finally:
+        pool.terminate()
+
+    if not serialized:
+        output = _keeping(lambda: [(loads(data), seconds, maxrss) for data, seconds, maxrss in output])
+    return output
 
+def _load_one(job):
+    # loads one file for load_many, in whichever process is running it
+    fileName, serialized = job
+    start = time.time()
+    output = load_stream(_open(fileName, mapped=True))
+    seconds = time.time() - start
+    if serialized:
+        tree, output = output, dumps(output)
+        _unlink(tree)
+    return output, seconds, _maxrss()
+
+def _unlink(top):
+    # drops each node's reference to itself, so that a tree that is no longer wanted is freed as soon
+    # as it is released, rather than waiting for a full garbage collection to find the cycles
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, SVG):
+            node.__dict__.pop("_svg", None)
+            stack.extend(node.__dict__.get("children", ()))
+
+def _maxrss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        maxrss *= 1024  # Linux reports kilobytes, Mac OS X bytes
+    return maxrss
+
+def _parse(loader, stream):
+    def parse():
+        parser = loader.parser()
+        data = stream.read(_load_buffersize)
+        while data:
+            parser.Parse(data, False)
+            data = stream.read(_load_buffersize)
+        parser.Parse("", True)
+    _keeping(parse)
+
+def _keeping(func, *args):
+    # calls func with garbage collection paused: everything made while loading is kept, so searching
+    # it for garbage (repeatedly, as it grows) is wasted time
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if collecting:
+            gc.enable()
+
+def _iter_parse(loader, stream):
+    # yields the contents of loader.ready after each piece of the stream is parsed
+    parser = loader.parser()
+    data = stream.read(_load_buffersize)
+    while True:
+        parser.Parse(data, len(data) == 0)
+        ready, loader.ready = loader.ready, []
+        for item in ready:
+            yield item
+        if len(data) == 0:
+            break
+        data = stream.read(_load_buffersize)
+
+# same-sized pieces as xml.sax's expat reader, so that text is split (and rejoined) the same way
+_load_buffersize = 2**16 - 20
+
+_whitespace = " \t\n\r\f\v"  # what the regular expression \s matches
+
+class _Loader:
+    """Builds SVG objects directly from expat callbacks.
+
+    Elements skip the SVG constructor, since their attributes all come from the file.  Non-whitespace
+    text is collected in a list for each open element and joined with newlines when it gets another
+    child or ends.  If a processing instruction or comment is outside the main <svg> tag, it will be lost.
+    """
+
+    def __init__(self):
+        self.stack = []    # open elements
+        self.text = []     # text not yet added to each open element
+        self.cdata = None  # text of the current CDATA section, if in one
+        self.output = None
+
+    def parser(self):
+        import xml.parsers.expat
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        parser.ProcessingInstructionHandler = self.processingInstruction
+        parser.CommentHandler = self.comment
+        parser.StartCdataSectionHandler = self.startCDATA
+        parser.EndCdataSectionHandler = self.endCDATA
+        parser.ExternalEntityRefHandler = lambda context, base, system_id, public_id: 1  # don't fetch anything
+        parser.SetParamEntityParsing(xml.parsers.expat.XML_PARAM_ENTITY_PARSING_UNLESS_STANDALONE)
+        return parser
+
+    def _child(self, s):
+        if len(self.stack) > 0:
+            text = self.text[-1]
+            if len(text) > 0:
+                self.stack[-1].children.append(u"\n".join(text))
+                del text[:]
+            self.stack[-1].children.append(s)
+
+    def startElement(self, tag, attrib):
+        s = new.instance(SVG, {"tag": tag, "attrib": attrib, "children": []})
+        s.__dict__["_svg"] = s
+        stack = self.stack
+        if len(stack) > 0:  # self._child(s), inlined because this is the most frequent callback
+            text = self.text[-1]
+            if len(text) > 0:
+                stack[-1].children.append(u"\n".join(text))
+                del text[:]
+            stack[-1].children.append(s)
+        stack.append(s)
+        self.text.append([])
+
+    def characters(self, ch):
+        if self.cdata is not None:
+            self.cdata.append(ch)
+        elif ch.strip(_whitespace) and len(self.stack) > 0:
+            self.text[-1].append(ch)
+
+    def endElement(self, tag):
+        text = self.text.pop()
+        self.output = self.stack.pop()
+        if len(text) > 0:
+            self.output.children.append(u"\n".join(text))
+
+    def processingInstruction(self, target, data):
+        self.output = Instruction(target, data)
+        self._child(self.output)
+
+    def comment(self, comment):
+        self.output = Comment(re.sub("(^ | $)", "", comment))
+        self._child(self.output)
+
+    def startCDATA(self):
+        self.output = CDATA("")
+        self._child(self.output)
+        self.cdata = []
+
+    def endCDATA(self):
+        self.output.__dict__["text"] = "".join(self.cdata)
+        self.cdata = None
+
+class _TemplateLoader(_Loader):
+    # also remembers where the replaceme elements are (parent, index), so that template doesn't search for them
+    def __init__(self, replaceme):
+        _Loader.__init__(self)
+        self.replaceme = replaceme
+        self.found = []
+
+    def startElement(self, tag, attrib):
+        _Loader.startElement(self, tag, attrib)
+        if tag == self.replaceme and len(self.stack) > 1:
+            parent = self.stack[-2]
+            self.found.append((parent, len(parent.children) - 1))
+
+class _PartialLoader(_Loader):
+    """Expat callbacks for iter_load_stream.
+
+    Elements that don't match (and aren't in one that does) are None in self.stack: their children
+    are only counted, to know the treeindexes of later elements.
+    """
+
+    def __init__(self, match):
+        _Loader.__init__(self)
+        if isinstance(match, basestring):
+            tag = match
+            match = lambda s: s.tag == tag
+        self.match = match
+        self.counts = []     # number of children so far, for each open element
+        self.positions = []  # index of each open element in its parent (None for the top)
+        self.wanted = []     # whether each open element matched
+        self.ready = []      # (treeindex, element) pairs that haven't been yielded yet
+
+    def _flush(self):
+        text = self.text[-1]
+        if len(text) > 0:
+            if self.stack[-1] is not None:
+                self.stack[-1].children.append(u"\n".join(text))
+            self.counts[-1] += 1
+            del text[:]
+
+    def _child(self, s):
+        if len(self.stack) > 0:
+            self._flush()
+            if self.stack[-1] is not None:
+                self.stack[-1].children.append(s)
+            self.counts[-1] += 1
+
+    def startElement(self, tag, attrib):
+        s = new.instance(SVG, {"tag": tag, "attrib": attrib, "children": []})
+        s.__dict__["_svg"] = s
+        parent = None
+        if len(self.stack) > 0:
+            self._flush()
+            self.positions.append(self.counts[-1])
+            self.counts[-1] += 1
+            parent = self.stack[-1]
+        else:
+            self.positions.append(None)
+
+        wanted = self.match is None or self.match(s)
+        if parent is not None:
+            parent.children.append(s)
+        elif not wanted:
+            s = None
+        self.stack.append(s)
+        self.text.append([])
+        self.counts.append(0)
+        self.wanted.append(wanted)
+
+    def endElement(self, tag):
+        self._flush()
+        s = self.stack.pop()
+        self.text.pop()
+        self.counts.pop()
+        if self.wanted.pop():
+            self.ready.append((tuple(self.positions[1:]), s))
+        self.positions.pop()
+
+class _TemplateWriter(_Loader):
+    """Expat callbacks for iter_template: lines of XML are collected in self.ready as soon as they're known.
+
+    Most elements are written without being kept, but text and tspan (which are written on one line)
+    and replaceme elements are built, in self.stack, until they end.
+    """
+
+    def __init__(self, svg, replaceme, indent):
+        _Loader.__init__(self)
+        self.svg = svg
+        self.replaceme = replaceme
+        self.indent = indent
+        self.open = []       # [element, start tag written?, text not yet written] for open elements that aren't built
+        self.found = []      # replaceme elements in the one being built, as (parent, index)
+        self.wrapped = None  # iter_xml's <svg> around a top element that isn't <svg>
+        self.ready = []
+
+    def _write_parent(self):
+        # the innermost open element is about to get a child, so its start tag and text can be written
+        if len(self.open) > 0:
+            top = self.open[-1]
+            if not top[1]:
+                self.ready.append(u"".join(_xml_start(top[0], self.indent, len(self.open) - 1) + [u">"]))
+                top[1] = True
+            if len(top[2]) > 0:
+                self.ready.append(u"\n".join(top[2]))
+                del top[2][:]
+
+    def _write(self, s):
+        self.ready.extend(iter_svg_to_xml(s, self.indent, len(self.open)))
+
+    def _end(self):
+        s, written, text = self.open[-1]
+        if not written and len(text) == 0:
+            self.open.pop()
+            self.ready.append(u"".join(_xml_start(s, self.indent, len(self.open)) + [u"/>"]))
+        else:
+            self._write_parent()
+            self.open.pop()
+            self.ready.append(u"%s</%s>" % (self.indent * len(self.open), s.tag))
+        self._unwrap()
+
+    def _unwrap(self):
+        if len(self.open) == 1 and self.open[0][0] is self.wrapped:
+            self._end()
+
+    def startElement(self, tag, attrib):
+        if len(self.stack) > 0:
+            _Loader.startElement(self, tag, attrib)
+            if tag == self.replaceme:
+                parent = self.stack[-2]
+                self.found.append((parent, len(parent.children) - 1))
+            return
+
+        if len(self.open) == 0 and self.wrapped is None and tag != "svg":
+            self.wrapped = SVG("svg")
+            self.open.append([self.wrapped, False, []])
+        self._write_parent()
+
+        if tag in ("text", "tspan") or tag == self.replaceme:
+            _Loader.startElement(self, tag, attrib)
+        else:
+            s = new.instance(SVG, {"tag": tag, "attrib": attrib, "children": []})
+            s.__dict__["_svg"] = s
+            self.open.append([s, False, []])
+
+    def endElement(self, tag):
+        if len(self.stack) == 0:
+            self._end()
+            return
+
+        _Loader.endElement(self, tag)
+        if len(self.stack) == 0:
+            if self.output.tag == self.replaceme:
+                self._write(self.svg)
             else:
-                if not isinstance(ch, basestring) or self.all_whitespace.match(ch) is None:
-                    if len(self.stack) > 0:
-                        last = self.stack[-1]
-                        if len(last.children) > 0 and isinstance(last.children[-1], basestring):
-                            last.children[-1] = last.children[-1] + "\n" + ch
-                        else:
-                            last.children.append(ch)
-
-        def endElement(self, tag):
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-            self.output = self.stack.pop()
-
-        # If a processing instruction is outside the main <svg> tag, it will be lost.
-        def processingInstruction(self, target, data):
-            s = Instruction(target, data)
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-                last.children.append(s)
-            self.output = s
-
-        def comment(self, comment):
-            s = Comment(re.sub("(^ | $)", "", comment))
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-                last.children.append(s)
-            self.output = s
-
-        def startCDATA(self):
-            s = CDATA("")
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-                last.children.append(s)
-            self.stack.append(s)
-            self.CDATA = True
-
-        def endCDATA(self):
-            if len(self.stack) > 0:
-                last = self.stack[-1]
-            self.output = self.stack.pop()
-            self.CDATA = False
-
-        def startDTD(self, name, public_id, system_id):
+                for parent, i in self.found:
+                    parent.children[i] = self.svg
+                self._write(self.output)
+            self.found = []
+            self._unwrap()
+
+    def characters(self, ch):
+        if len(self.stack) > 0 or self.cdata is not None:
+            _Loader.characters(self, ch)
+        elif len(self.open) > 0 and ch.strip(_whitespace):
+            self.open[-1][2].append(ch)
+
+    def processingInstruction(self, target, data):
+        if len(self.stack) > 0:
+            _Loader.processingInstruction(self, target, data)
+        elif len(self.open) > 0:
+            self._write_parent()
+            self._write(Instruction(target, data))
+
+    def comment(self, comment):
+        if len(self.stack) > 0:
+            _Loader.comment(self, comment)
+        elif len(self.open) > 0:
+            self._write_parent()
+            self._write(Comment(re.sub("(^ | $)", "", comment)))
+
+    def startCDATA(self):
+        if len(self.stack) > 0:
+            _Loader.startCDATA(self)
+        else:
+            self._write_parent()
+            self.output = CDATA("")
+            self.cdata = []
+
+    def endCDATA(self):
+        _Loader.endCDATA(self)
+        if len(self.stack) == 0:
+            self._write(self.output)
+
+############################### compact binary form of SVG trees (dumps and loads)
+
+# The format is a header, a table of every distinct string (tag and attribute names and values,
+# pathdata commands), and two packed arrays: unsigned integers (codes, counts, and string indexes)
+# that describe the tree in document order, and doubles for all of its numbers.  Everything is
+# little-endian; the integers take 1, 2, or 4 bytes each, whichever is enough for the largest.
+
+_binary_magic = "SVGFig\x00"
+_binary_version = 1  # increase when the format changes; loads refuses versions it doesn't know
+_binary_header = "<7sBBBIIII"  # magic, version, widths of string lengths and integers, and the four sizes
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STRING, _LIST, _TUPLE, _DICT, _PATH, _PACKED, _PICKLE, _SVG = range(13)
+_binary_classes = (SVG, Instruction, Comment, CDATA)  # code _SVG + i is a node of class i
+_binary_codes = dict([(cls, _SVG + i) for i, cls in enumerate(_binary_classes)])
+_binary_keys = set(("tag", "attrib", "children", "_svg", "repr") + _caches)  # repr is a cache, too
+_binary_strings = set([str, unicode])
+
+# the type of each item in pathdata as parse makes it, by command
+_binary_pathdata = {}
+for _command, _arity in pathdata._arity.items():
+    if _arity == 7:
+        _binary_pathdata[_command] = [str, float, float, float, int, int, float, float]
+    else:
+        _binary_pathdata[_command] = [str] + [float] * _arity
+del _command, _arity
+_binary_point = [str, float, float]
+_binary_first = operator.itemgetter(0)
+_binary_tuple = set([tuple])
+
+_binary_unsigned = dict([(array.array(typecode).itemsize, typecode) for typecode in "BHIL"])
+
+def dumps(svg):
+    """Encodes svg and everything in it as a compact binary string, for loads.
+
+    Numbers and pathdata are packed and each distinct string is stored once.  Objects that have no
+    binary form of their own (Curves, Figs, and other dynamic objects) are pickled in place, so to
+    store only a drawing, dump the SVG that it renders to.
+    """
+    encoder = _Encoder()
+    encoder.tree(svg)
+    return encoder.tostring()
+
+def loads(data):
+    """Decodes a string made by dumps."""
+    size = struct.calcsize(_binary_header)
+    if data[:len(_binary_magic)] != _binary_magic or len(data) < size:
+        raise ValueError, "Not an SVGFig binary string"
+    magic, version, lengthwidth, intwidth, numstrings, numbytes, numints, numdoubles = struct.unpack(_binary_header, data[:size])
+    if version != _binary_version:
+        raise ValueError, "SVGFig binary format version %d is not supported (this SVGFig reads version %d)" % (version, _binary_version)
+
+    lengths, start = _binary_array(_binary_unsigned[lengthwidth], data, size, numstrings)
+    strings = []
+    end = start
+    for length in lengths:
+        string = data[end:end + (length >> 1)]
+        end += length >> 1
+        if length & 1:
+            string = string.decode("utf-8")
+        strings.append(string)
+    start += numbytes
+    if end != start:
+        raise ValueError, "SVGFig binary string has a corrupted string table"
+    ints, start = _binary_array(_binary_unsigned[intwidth], data, start, numints)
+    doubles, start = _binary_array("d", data, start, numdoubles)
+    if start != len(data):
+        raise ValueError, "SVGFig binary string has %d bytes, expected %d" % (len(data), start)
+
+    return _keeping(_Decoder(strings, ints, doubles).tree)
+
+def _binary_array(typecode, data, start, length):
+    # the array of length items at data[start:], and where the next thing starts
+    output = array.array(typecode)
+    end = start + length * output.itemsize
+    if end > len(data):
+        raise ValueError, "SVGFig binary string is truncated"
+    output.fromstring(data[start:end])
+    if sys.byteorder == "big":
+        output.byteswap()
+    return output, end
+
+class _Encoder:
+    def __init__(self):
+        self.ints = []
+        self.doubles = array.array("d")
+        self.strings = []
+        self.indexes = {str: {}, unicode: {}}  # separate, since u"a" == "a"
+
+    def string(self, string):
+        indexes = self.indexes[type(string)]
+        try:
+            return indexes[string]
+        except KeyError:
+            index = indexes[string] = len(self.strings)
+            self.strings.append(string)
+            return index
+
+    def tree(self, top):
+        ints, doubles, indexes, string, value = self.ints, self.doubles, self.indexes, self.string, self.value
+        stack = [top]
+        while stack:
+            node = stack.pop()
+            if type(node) is not types.InstanceType:
+                value(node)
+                continue
+
+            code = _binary_codes.get(node.__class__)
+            d = node.__dict__
+            attrib, children = d.get("attrib"), d.get("children")
+            if (code is None or d.get("_svg") is not node or type(d.get("tag")) not in _binary_strings or
+                type(attrib) is not dict or type(children) is not list or not set(map(type, attrib)) <= _binary_strings):
+                self.pickle(node)
+                continue
+
+            ints.append(code)
+            ints.append(string(d["tag"]))
+            ints.append(len(attrib))
+            for name, v in attrib.iteritems():
+                ints.append(indexes[type(name)].get(name) or string(name))  # (index 0 is looked up again)
+                t = type(v)
+                if t is str or t is unicode:
+                    ints.append(_STRING)
+                    ints.append(indexes[t].get(v) or string(v))
+                elif t is float:
+                    ints.append(_FLOAT)
+                    doubles.append(v)
+                else:
+                    value(v)
+
+            extra = d.viewkeys() - _binary_keys
+            ints.append(len(extra))
+            for name in extra:
+                ints.append(string(name))
+                value(d[name])
+
+            ints.append(len(children))
+            stack.extend(reversed(children))
+
+    def value(self, value):
+        ints = self.ints
+        t = type(value)
+        if t is str or t is unicode:
+            ints.append(_STRING)
+            ints.append(self.string(value))
+        elif t is float:
+            ints.append(_FLOAT)
+            self.doubles.append(value)
+        elif t is int and -2**53 <= value <= 2**53:  # exactly representable as a double
+            ints.append(_INT)
+            self.doubles.append(value)
+        elif value is None:
+            ints.append(_NONE)
+        elif t is bool:
+            ints.append(_TRUE if value else _FALSE)
+        elif t is list and self.pathdata(value):
             pass
+        elif t is list or t is tuple:
+            ints.append(_LIST if t is list else _TUPLE)
+            ints.append(len(value))
+            for item in value:
+                self.value(item)
+        elif t is dict:
+            ints.append(_DICT)
+            ints.append(len(value))
+            for key, item in value.iteritems():
+                self.value(key)
+                self.value(item)
+        elif t is types.InstanceType and value.__class__ is pathdata.Packed:
+            ints.append(_PACKED)
+            ints.append(self.string(value.commands.tostring()))
+            ints.append(len(value.coordinates))
+            self.doubles.extend(value.coordinates)
+        else:
+            self.pickle(value)
 
-        def endDTD(self):
-            pass
+    def pathdata(self, value):
+        # pathdata as parse makes it is stored like a Packed, if it has exactly the types that parse makes
+        try:
+            commands = "".join(map(_binary_first, value))
+            if len(commands) != len(value) or set(map(type, value)) != _binary_tuple:
+                return False
+            points = commands.rstrip("Zz")
+            if points.translate(None, "MLTmlt") == "":  # the usual case: points, then maybe a closing Z
+                expected = _binary_point * len(points) + [str] * (len(commands) - len(points))
+            else:
+                expected = list(itertools.chain.from_iterable(map(_binary_pathdata.__getitem__, commands)))
+        except (TypeError, KeyError, IndexError):
+            return False
 
-        def startEntity(self, name):
-            pass
+        items = list(itertools.chain.from_iterable(value))
+        kinds = map(type, items)
+        if kinds != expected:  # with commands exactly where expected, each datum has the right length
+            return False
+        self.ints.extend((_PATH, self.string(commands), len(items) - len(commands)))
+        if points.translate(None, "MLTmlt") == "":
+            del items[3 * len(points):]
+            del items[::3]
+            self.doubles.extend(items)
+        else:
+            self.doubles.extend(itertools.compress(items, itertools.imap(operator.is_not, kinds, itertools.repeat(str))))
+        return True
 
-        def endEntity(self, name):
-            pass
+    def pickle(self, value):
+        import cPickle
+        self.ints.append(_PICKLE)
+        self.ints.append(self.string(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)))
+
+    def tostring(self):
+        lengths = []
+        for i, string in enumerate(self.strings):
+            if type(string) is unicode:
+                string = self.strings[i] = string.encode("utf-8")
+                lengths.append(len(string) << 1 | 1)
+            else:
+                lengths.append(len(string) << 1)
+        strings = "".join(self.strings)
+        lengths, ints, doubles = _binary_packed(lengths), _binary_packed(self.ints), self.doubles
+        if sys.byteorder == "big":
+            doubles = array.array("d", doubles)
+            doubles.byteswap()
+
+        return "".join([struct.pack(_binary_header, _binary_magic, _binary_version, lengths.itemsize, ints.itemsize,
+                                    len(lengths), len(strings), len(ints), len(doubles)),
+                        lengths.tostring(), strings, ints.tostring(), doubles.tostring()])
+
+def _binary_packed(numbers):
+    # numbers as an array of the narrowest unsigned type that holds them, in little-endian order
+    largest = max(numbers or [0])
+    for width in 1, 2, 4:
+        if largest < 256**width:
+            break
+    output = array.array(_binary_unsigned[width], numbers)
+    if sys.byteorder == "big":
+        output.byteswap()
+    return output
 
-    ch = ContentHandler()
-    parser = make_parser()
-    parser.setContentHandler(ch)
-    parser.setProperty(handler.property_lexical_handler, ch)
-    parser.setFeature(feature_namespaces, 0)
-    parser.setFeature(feature_external_ges, 0)
-    parser.parse(stream)
-    return ch.output
+class _Decoder:
+    def __init__(self, strings, ints, doubles):
+        self.strings = strings
+        self.nexti = iter(ints).next
+        self.doubles = iter(doubles)
+        self.nextd = self.doubles.next
+
+    def tree(self):
+        nexti, nextd, strings, value = self.nexti, self.nextd, self.strings, self.value
+        classes = _binary_classes
+
+        output = []
+        stack = [[output, 1]]  # the children being filled in, and how many are left to read
+        while stack:
+            top = stack[-1]
+            if top[1] == 0:
+                stack.pop()
+                continue
+            top[1] -= 1
+
+            code = nexti()
+            if code < _SVG:
+                top[0].append(value(code))
+                continue
+
+            node = new.instance(classes[code - _SVG])
+            d = node.__dict__
+            d["tag"] = strings[nexti()]
+            attrib = d["attrib"] = {}
+            for i in xrange(nexti()):
+                name = strings[nexti()]
+                code = nexti()
+                if code == _STRING:
+                    attrib[name] = strings[nexti()]
+                elif code == _FLOAT:
+                    attrib[name] = nextd()
+                else:
+                    attrib[name] = value(code)
+
+            for i in xrange(nexti()):
+                name = strings[nexti()]
+                d[name] = value(nexti())
+
+            children = d["children"] = []
+            d["_svg"] = node
+            top[0].append(node)
+
+            length = nexti()
+            if length > 0:
+                stack.append([children, length])
+
+        return output[0]
+
+    def value(self, code):
+        nexti = self.nexti
+        if code == _STRING:
+            return self.strings[nexti()]
+        elif code == _FLOAT:
+            return self.nextd()
+        elif code == _INT:
+            return int(self.nextd())
+        elif code == _NONE:
+            return None
+        elif code == _FALSE:
+            return False
+        elif code == _TRUE:
+            return True
+        elif code == _LIST:
+            return [self.value(nexti()) for i in xrange(nexti())]
+        elif code == _TUPLE:
+            return tuple([self.value(nexti()) for i in xrange(nexti())])
+        elif code == _DICT:
+            output = {}
+            for i in xrange(nexti()):
+                key = self.value(nexti())
+                output[key] = self.value(nexti())
+            return output
+        elif code == _PATH:
+            commands = self.strings[nexti()]
+            coordinates = array.array("d", itertools.islice(self.doubles, nexti()))
+            points = commands.rstrip("Zz")
+            if points.translate(None, "MLTmlt") == "":
+                output = zip(points, coordinates[0::2], coordinates[1::2])
+                output.extend(zip(commands[len(points):]))
+                return output
+            return pathdata.Packed(commands, coordinates).tolist()
+        elif code == _PACKED:
+            return pathdata.Packed(self.strings[nexti()], itertools.islice(self.doubles, nexti()))
+        elif code == _PICKLE:
+            import cPickle
+            return cPickle.loads(self.strings[nexti()])
+        else:
+            raise ValueError, "SVGFig binary string has an unknown code %d" % code
 
 ############################### standard representation for transformations and parametric functions
 
+class LRUCache:
+    """A mapping that keeps only the maxsize most recently used items, counting hits and misses."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def __repr__(self):
+        return "<LRUCache %d/%d items, %d hits, %d misses>" % (len(self._items), self.maxsize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items[key] = value  # now the most recent
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > max(self.maxsize, 0):
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "maxsize": self.maxsize}
+
+# compiled string expressions, keyed by ("transformation" or "parametric", string); set maxsize to 0 to turn it off
+expression_cache = LRUCache(256)
+
+class Affine:
+    """The transformation x, y -> a*x + c*y + e, b*x + d*y + f (the order of SVG's matrix(a, b, c, d, e, f)).
+
+    A * B is the transformation that applies B first and then A, so a chain of them is one matrix.
+    """
+
+    def __init__(self, a=1., b=0., c=0., d=1., e=0., f=0., name=None):
+        self.matrix = (a, b, c, d, e, f)
+        self.name = name
+
+    def __repr__(self):
+        if self.name is None:
+            return "<Affine matrix(%g, %g, %g, %g, %g, %g)>" % self.matrix
+        else:
+            return "<Affine %s>" % self.name
+
+    def __call__(self, x, y):
+        a, b, c, d, e, f = self.matrix
+        if b == 0 and c == 0:
+            return a*x + e, d*y + f
+        else:
+            return a*x + c*y + e, b*x + d*y + f
+
+    def apply(self, xs, ys):
+        a, b, c, d, e, f = self.matrix
+        if b == 0 and c == 0:
+            return [a*x + e for x in xs], [d*y + f for y in ys]
+        else:
+            return [a*x + c*y + e for x, y in itertools.izip(xs, ys)], [b*x + d*y + f for x, y in itertools.izip(xs, ys)]
+
+    def __mul__(self, other):
+        if not isinstance(other, Affine):
+            return NotImplemented
+        a1, b1, c1, d1, e1, f1 = self.matrix
+        a2, b2, c2, d2, e2, f2 = other.matrix
+        return Affine(a1*a2 + c1*b2, b1*a2 + d1*b2,
+                      a1*c2 + c1*d2, b1*c2 + d1*d2,
+                      a1*e2 + c1*f2 + e1, b1*e2 + d1*f2 + f1)
+
+    def determinant(self):
+        a, b, c, d, e, f = self.matrix
+        return a*d - b*c
+
+def compose(translist):
+    """Collapses neighboring Affine transformations in a list that is applied first to last."""
+    output = []
+    for trans in translist:
+        if isinstance(trans, Affine) and len(output) > 0 and isinstance(output[-1], Affine):
+            output[-1] = trans * output[-1]
+        else:
+            output.append(trans)
+    return output
+
 def canonical_transformation(expr):
     if expr is None:
         output = lambda x, y: (x, y)
         output.func_name = "identity"
+        output.apply = lambda xs, ys: (xs, ys)
         return output
 
+    elif isinstance(expr, Affine):
+        return expr
+
     elif callable(expr):
 
         # 2 real -> 2 real
@@ -844,33 +2055,68 @@ def canonical_transformation(expr):
             split = lambda z: (z.real, z.imag)
             output = lambda x, y: split(expr(complex(x, y)))
             output.func_name = expr.func_name
+            output.apply = lambda xs, ys: _unzip([(w.real, w.imag) for w in itertools.imap(expr, itertools.imap(complex, xs, ys))])
             return output
 
         else:
             raise TypeError, "Must be a 2 -> 2 real function or a complex -> complex function"
 
     else:
-        compiled = compile(expr, expr, "eval")
+        key = ("transformation", expr)
+        output = expression_cache.get(key)
+        if output is None:
+            output = expression_cache[key] = _compile_transformation(expr)
+        return output
 
-        # 2 real -> 2 real
-        if "x" in compiled.co_names and "y" in compiled.co_names:
-            evalexpr = expr
-            evalexpr = re.sub("x", "float(x)", evalexpr)
-            evalexpr = re.sub("y", "float(y)", evalexpr)
-            output = eval("lambda x,y: (%s)" % evalexpr, math.__dict__)
-            output.func_name = "x, y -> %s" % expr
-            return output
+def _compile_transformation(expr):
+    compiled = compile(expr, expr, "eval")
+
+    # 2 real -> 2 real
+    if "x" in compiled.co_names and "y" in compiled.co_names:
+        evalexpr = expr
+        evalexpr = re.sub(r"\bx\b", "float(x)", evalexpr)
+        evalexpr = re.sub(r"\by\b", "float(y)", evalexpr)
+        output = eval("lambda x,y: (%s)" % evalexpr, math.__dict__)
+        output.func_name = "x, y -> %s" % expr
+        output.apply = eval("lambda xs, ys: _unzip([(%s) for x, y in _izip(xs, ys)])" % evalexpr, _batch_math)
+        return output
 
-        # complex -> complex
-        elif "z" in compiled.co_names:
-            evalexpr = re.sub("z", "complex(x,y)", expr)
-            output = eval("lambda x,y: ((%s).real, (%s).imag)" % (evalexpr, evalexpr), cmath.__dict__)
-            output.func_name = "z -> %s" % expr
-            return output
+    # complex -> complex
+    elif "z" in compiled.co_names:
+        evalexpr = re.sub(r"\bz\b", "complex(x,y)", expr)
+        output = eval("lambda x,y: ((%s).real, (%s).imag)" % (evalexpr, evalexpr), cmath.__dict__)
+        output.func_name = "z -> %s" % expr
+        output.apply = eval("lambda xs, ys: _unzip([(w.real, w.imag) for x, y in _izip(xs, ys) for w in (%s,)])" % evalexpr, _batch_cmath)
+        return output
 
-        else:
-            raise TypeError, "Transformation string '%s' must contain real 'x' and 'y' or complex 'z'" % expr
+    else:
+        raise TypeError, "Transformation string '%s' must contain real 'x' and 'y' or complex 'z'" % expr
+
+def apply_transformation(expr, xs, ys):
+    """Transforms sequences of x and y values, returning sequences of X and Y values.
+
+    Transformations built from strings (and by trans.window, trans.rotation) have an apply(xs, ys)
+    that does this without a Python function call per point; any other transformation is mapped.
+    """
+    func = canonical_transformation(expr)
+    apply = getattr(func, "apply", None)
+    if apply is not None:
+        return apply(xs, ys)
+    return _unzip(map(func, xs, ys))
+
+def _unzip(pairs):
+    # zip(*pairs) would build a tuple of a million arguments
+    return map(operator.itemgetter(0), pairs), map(operator.itemgetter(1), pairs)
+
+def _batch_namespace(module):
+    # the math or cmath functions, plus what the batch lambdas need
+    output = dict(module.__dict__)
+    output["_izip"] = itertools.izip
+    output["_unzip"] = _unzip
+    return output
 
+_batch_math = _batch_namespace(math)
+_batch_cmath = _batch_namespace(cmath)
 
 def canonical_parametric(expr):
     if callable(expr):
@@ -883,29 +2129,136 @@ def canonical_parametric(expr):
             raise TypeError, "Must be a 1 -> 2 real function"
 
     else:
-        compiled = compile(expr, expr, "eval")
+        key = ("parametric", expr)
+        output = expression_cache.get(key)
+        if output is None:
+            output = expression_cache[key] = _compile_parametric(expr)
+        return output
 
-        # 1 real -> 2 real
-        if "t" in compiled.co_names:
-            output = eval("lambda t: (%s)" % re.sub("t", "float(t)", expr), math.__dict__)
-            output.func_name = "t -> %s" % expr
-            return output
+def _compile_parametric(expr):
+    compiled = compile(expr, expr, "eval")
 
-        # 1 real -> 1 real
-        elif "x" in compiled.co_names:
-            output = eval("lambda t: (t, %s)" % re.sub("x", "float(t)", expr), math.__dict__)
-            output.func_name = "x -> %s" % expr
-            return output
+    # 1 real -> 2 real
+    if "t" in compiled.co_names:
+        output = eval("lambda t: (%s)" % re.sub(r"\bt\b", "float(t)", expr), math.__dict__)
+        output.func_name = "t -> %s" % expr
+        output.program = _compile_program(expr, "t")
+        return output
 
-        # real (a complex number restricted to the real axis) -> complex
-        elif "z" in compiled.co_names:
-            evalexpr = re.sub("z", "complex(t,0)", expr)
-            output = eval("lambda t: ((%s).real, (%s).imag)" % (evalexpr, evalexpr), cmath.__dict__)
-            output.func_name = "z -> %s" % expr
-            return output
+    # 1 real -> 1 real
+    elif "x" in compiled.co_names:
+        output = eval("lambda t: (t, %s)" % re.sub(r"\bx\b", "float(t)", expr), math.__dict__)
+        output.func_name = "x -> %s" % expr
+        output.program = _compile_program(expr, "x")
+        return output
 
+    # real (a complex number restricted to the real axis) -> complex
+    elif "z" in compiled.co_names:
+        evalexpr = re.sub(r"\bz\b", "complex(t,0)", expr)
+        output = eval("lambda t: ((%s).real, (%s).imag)" % (evalexpr, evalexpr), cmath.__dict__)
+        output.func_name = "z -> %s" % expr
+        return output
+
+    else:
+        raise TypeError, "Parametric string '%s' must contain real 't', 'x', or 'z'" % expr
+
+############################### compile simple expressions into programs that _curve.c runs without calling Python
+
+# functions that _curve.c knows, with their number of arguments (in the math module's namespace, "pow" is math.pow)
+_program_functions = {"sin": 1, "cos": 1, "tan": 1, "asin": 1, "acos": 1, "atan": 1, "sinh": 1, "cosh": 1, "tanh": 1,
+                      "exp": 1, "log10": 1, "sqrt": 1, "fabs": 1, "floor": 1, "ceil": 1, "atan2": 2, "hypot": 2}
+_program_operators = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.Pow: "**"}
+_program_stack = 32  # PROGRAM_STACK in _curve.c: programs that need a deeper stack are left to Python
+
+def _compile_program(expr, variable):
+    """Translates a parametric expression of t (a pair) or of x (one value) into a postfix program for _curve.curve.
+
+    Returns None if the expression uses anything else; the curve is then sampled by calling the Python function.
+    """
+    try:
+        tree = ast.parse(expr, mode="eval").body
+    except SyntaxError:
+        return None
+
+    if variable == "t":
+        if not isinstance(tree, ast.Tuple) or len(tree.elts) != 2:
+            return None
+        outputs = tree.elts
+        program = []
+    else:
+        outputs = [tree]
+        program = ["t"]  # the curve is (t, f(t))
+
+    try:
+        for node in outputs:
+            if not _program_uses(node, variable):
+                return None  # Python would return this constant as it is (maybe an int), not as a float
+            _program_emit(node, variable, program)
+    except ValueError:
+        return None
+
+    depth = deepest = 0
+    for item in program:
+        if isinstance(item, float) or item == "t":
+            depth += 1
+        elif item in _program_functions:
+            depth += 1 - _program_functions[item]
+        elif item in ("neg", "log"):
+            pass
         else:
-            raise TypeError, "Parametric string '%s' must contain real 't', 'x', or 'z'" % expr
+            depth -= 1  # the operators and logbase take two
+        deepest = max(deepest, depth)
+    if deepest > _program_stack:
+        return None
+
+    return tuple(program)
+
+def _program_uses(node, variable):
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name) and n.id == variable:
+            return True
+    return False
+
+def _program_emit(node, variable, program):
+    if not _program_uses(node, variable):
+        # let Python evaluate constant parts, so that 1/2 is still 0
+        try:
+            value = eval(compile(ast.Expression(node), "<expression>", "eval"), dict(math.__dict__))
+        except Exception:
+            raise ValueError
+        if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            raise ValueError
+        program.append(float(value))
+
+    elif isinstance(node, ast.Name):
+        program.append("t")
+
+    elif isinstance(node, ast.BinOp) and type(node.op) in _program_operators:
+        _program_emit(node.left, variable, program)
+        _program_emit(node.right, variable, program)
+        program.append(_program_operators[type(node.op)])
+
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        _program_emit(node.operand, variable, program)
+        if isinstance(node.op, ast.USub):
+            program.append("neg")
+
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords and node.starargs is None and node.kwargs is None:
+        name, args = node.func.id, node.args
+        if name == "log" and len(args) in (1, 2):
+            name = ("log", "logbase")[len(args) - 1]
+        elif name == "abs" and len(args) == 1:
+            name = "fabs"
+        elif name == "pow" and len(args) == 2:
+            name = "**"
+        elif _program_functions.get(name) != len(args):
+            raise ValueError
+        for arg in args:
+            _program_emit(arg, variable, program)
+        program.append(name)
+
+    else:
+        raise ValueError
 
 cannonical_transformation = canonical_transformation  # XXX DEPRECATED (wrong spelling), will be removed later
 cannonical_parametric = canonical_parametric  # XXX DEPRECATED (wrong spelling), will be removed later
@@ -926,7 +2279,7 @@ def _code_serializer(code):
                                 code.co_flags, code.co_code, code.co_consts, code.co_names,
                                 code.co_varnames, code.co_filename, code.co_name,
                                 code.co_firstlineno, code.co_lnotab),
-                               sys.version_info, defaults.version_info)
+                               tuple(sys.version_info), defaults.version_info)
 
 
 copy_reg.pickle(types.CodeType, _code_serializer)
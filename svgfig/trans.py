@@ -7,8 +7,72 @@ epsilon = 1e-5
 
 clone = copy.deepcopy
 
+def _copy_node(obj):
+    # a new node with its own attrib, children, and other lists, sharing their contents with obj
+    output = new.instance(obj.__class__)
+    output.__dict__ = dict(obj.__dict__)
+    for name, value in output.__dict__.iteritems():
+        if isinstance(value, list):
+            output.__dict__[name] = list(value)
+    if isinstance(obj.__dict__.get("attrib"), dict):
+        output.__dict__["attrib"] = copy.copy(obj.attrib)
+    if obj.__dict__.get("_svg") is obj:
+        output.__dict__["_svg"] = output
+    output.__dict__.pop("repr", None)
+    output.__dict__.pop("_xml", None)  # the copy is about to change
+    output.__dict__.pop("_bbox", None)
+    output.__dict__.pop("_parents", None)  # not below obj's parents
+    output.__dict__.pop("_digest", None)
+    return output
+
+def _copy_for(obj, method):
+    """Copies just the parts of obj that obj.method() would change, so that the copy can be changed in place.
+
+    Nodes that use SVG's method are copied by _copy_node, and so are their SVG children.  Classes with
+    _shallow_method = True only change their own attributes, so they're copied by _copy_node too, but their
+    children are shared.  Anything else is deep-copied.  Leaves (text) are always shared.
+    """
+    if not isinstance(obj, svg.SVG):
+        return copy.deepcopy(obj)
+
+    generic = getattr(svg.SVG, method).im_func
+    classes = {}
+    memo = {}  # a node that appears twice in obj appears twice in the copy, as with deepcopy
+
+    def copy_node(node):
+        if id(node) in memo:
+            return memo[id(node)], False
+        cls = node.__class__
+        try:
+            kind = classes[cls]
+        except KeyError:
+            if getattr(cls, method).im_func is generic:
+                kind = classes[cls] = "generic"
+            elif getattr(cls, "_shallow_" + method, False):
+                kind = classes[cls] = "shallow"
+            else:
+                kind = classes[cls] = "deep"
+
+        if kind == "deep":
+            output = copy.deepcopy(node)
+        else:
+            output = _copy_node(node)
+        memo[id(node)] = output
+        return output, (kind == "generic")
+
+    output, descend = copy_node(obj)
+    stack = descend and [output] or []
+    while len(stack) > 0:
+        children = stack.pop().children
+        for i in xrange(len(children)):
+            if isinstance(children[i], svg.SVG):
+                children[i], descend = copy_node(children[i])
+                if descend:
+                    stack.append(children[i])
+    return output
+
 def tonumber(obj):
-    obj = copy.deepcopy(obj)
+    obj = _copy_for(obj, "tonumber")
     obj.tonumber()
     return obj
 
@@ -16,31 +80,46 @@ def transform(trans, obj):
     if isinstance(trans, basestring):
         trans = svg.canonical_transformation(trans)
 
-    obj = copy.deepcopy(obj)
+    obj = _copy_for(obj, "transform")
     if callable(trans):
         obj.transform(trans)
     else:
-        for t in trans:
+        for t in svg.compose(trans):
             obj.transform(t)
     return obj
 
-def evaluate(obj):
-    obj = copy.copy(obj) # start with a shallow copy
-    if isinstance(obj, svg.SVG) and obj.tag is None:
+def _evaluate_node(obj):
+    if not isinstance(obj, svg.SVG):
+        return obj  # text and other leaves are kept as they are
+
+    obj = _copy_node(obj) # start with a shallow copy (copy.copy would share __dict__ with the original)
+    if obj.tag is None:
         obj.svg()
         obj = obj._svg
+        obj = _copy_node(obj) # _svg may share children with the original
 
     obj.__dict__["attrib"] = copy.deepcopy(obj.__dict__["attrib"])
+    return obj
 
-    replacements = {}
-    for i in xrange(len(obj.children)):
-        obj.children[i] = evaluate(obj.children[i])
+def evaluate(obj):
+    # explicit stack, so that deeply nested documents don't hit the recursion limit
+    output = _evaluate_node(obj)
+    stack = [output]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if isinstance(obj, svg.SVG):
+            children = obj.children
+            for i in xrange(len(children)):
+                children[i] = _evaluate_node(children[i])
+                stack.append(children[i])
 
-    return obj
+    return output
 
 ############################### groups with special transformation properties
 
 class Freeze(svg.SVG):
+    _shallow_transform = True
+
     def __init__(self, *args, **kwds):
         self.__dict__["tag"] = None
         self.__dict__["attrib"] = kwds
@@ -63,7 +142,15 @@ class Freeze(svg.SVG):
         self._svg.__dict__["children"] = self.children
         self._svg.__dict__["_svg"] = self._svg
 
+def _transcode(trans):
+    # Affine transformations pickle as themselves, functions as their code and name
+    if isinstance(trans, svg.Affine):
+        return trans
+    return trans.func_code, trans.func_name
+
 class Delay(svg.SVG):
+    _shallow_transform = True  # transform only changes self.trans
+
     def __init__(self, *args, **kwds):
         self.__dict__["tag"] = None
         self.__dict__["attrib"] = kwds
@@ -78,7 +165,12 @@ class Delay(svg.SVG):
             return "<Delay (%d children) (%d trans)>" % (len(self.children), len(self.trans))
 
     def transform(self, trans):
-        self.trans.append(svg.canonical_transformation(trans))
+        trans = svg.canonical_transformation(trans)
+        if isinstance(trans, svg.Affine) and len(self.trans) > 0 and isinstance(self.trans[-1], svg.Affine):
+            self.trans[-1] = trans * self.trans[-1]  # a chain of affine transformations is one matrix
+        else:
+            self.trans.append(trans)
+        self.touch()
 
     def bbox(self):
         self.svg()
@@ -95,26 +187,30 @@ class Delay(svg.SVG):
             self._svg.__dict__["children"].append(transform(self.trans, child))
 
     def __getstate__(self):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         del mostdict["trans"]
-        transcode = map(lambda f: (f.func_code, f.func_name), self.trans)
-        return (sys.version_info, defaults.version_info, mostdict, transcode)
+        transcode = map(_transcode, self.trans)
+        return (tuple(sys.version_info), defaults.version_info, mostdict, transcode)
 
     def __setstate__(self, state):
         self.__dict__ = state[2]
         self.__dict__["trans"] = []
-        for code, name in state[3]:
-            context = globals()
-            if "z" in code.co_names:
-                context.update(cmath.__dict__)
+        for item in state[3]:
+            if isinstance(item, svg.Affine):
+                self.__dict__["trans"].append(item)
             else:
-                context.update(math.__dict__)
-            f = new.function(code, context)
-            f.func_name = name
-            self.__dict__["trans"].append(f)
+                code, name = item
+                context = globals()
+                if "z" in code.co_names:
+                    context.update(cmath.__dict__)
+                else:
+                    context.update(math.__dict__)
+                f = new.function(code, context)
+                f.func_name = name
+                self.__dict__["trans"].append(f)
 
     def __deepcopy__(self, memo={}):
-        mostdict = copy.copy(self.__dict__)
+        mostdict = copy.copy(svg._uncached(self.__dict__))
         del mostdict["trans"]
         if "repr" in mostdict:
             del mostdict["repr"]
@@ -158,11 +254,11 @@ class Pin(svg.SVG):
         if self.rotate:
             shiftx, shifty = trans(oldx + epsilon, oldy)
             angle = math.atan2(shifty, shiftx)
-            trans = eval("lambda x, y: (%(newx)s + cos(%(angle)s)*(x - %(oldx)s) - sin(%(angle)s)*(y - %(oldy)s), %(newy)s + sin(%(angle)s)*(x - %(oldx)s) + cos(%(angle)s)*(y - %(oldy)s))" % {"newx": repr(self.x), "newy": repr(self.y), "oldx": repr(oldx), "oldy": repr(oldy), "angle": repr(angle)}, math.__dict__)
+            cos, sin = math.cos(angle), math.sin(angle)
+            trans = svg.Affine(cos, sin, -sin, cos, self.x - cos*oldx + sin*oldy, self.y - sin*oldx - cos*oldy)
 
         else:
-            trans = eval("lambda x, y: (x + %(newx)s - %(oldx)s, y + %(newy)s - %(oldy)s)" %
-                         {"newx": repr(self.x), "newy": repr(self.y), "oldx": repr(oldx), "oldy": repr(oldy)})
+            trans = svg.Affine(1., 0., 0., 1., self.x - oldx, self.y - oldy)
 
         for child in self.children:
             if isinstance(child, svg.SVG):
@@ -227,30 +323,38 @@ def window(xmin, xmax, ymin, ymax, x=0, y=0, width=100, height=100, xlogbase=Non
     if ylogbase is not None and (iy1 <= 0. or iy2 <= 0.):
         raise ValueError, "y range incompatible with log scaling: (%g, %g)" % (iy1, iy2)
 
+    if xlogbase is None and ylogbase is None and ix1 != ix2 and iy1 != iy2:
+        xscale = 1.*(ox2 - ox1)/(ix2 - ix1)
+        yscale = 1.*(oy2 - oy1)/(iy2 - iy1)
+        return svg.Affine(xscale, 0., 0., yscale, ox1 - xscale*ix1, oy1 - yscale*iy1,
+                          name="(%g, %g), (%g, %g) -> (%g, %g), (%g, %g)" % (ix1, ix2, iy1, iy2, ox1, ox2, oy1, oy2))
+
     xlogstr, ylogstr = "", ""
 
     if xlogbase is None:
         xfunc = "%(ox1)s + 1.*(x - %(ix1)s)/(%(ix2)s - %(ix1)s) * (%(ox2)s - %(ox1)s)" % {
                 "ox1": repr(ox1), "ox2": repr(ox2), "ix1": repr(ix1), "ix2": repr(ix2)}
     else:
-        xfunc = "x <= 0 and %(minusInfinityX)s or %(ox1)s + 1.*(log(x, %(logbase)s) - log(%(ix1)s, %(logbase)s))/(log(%(ix2)s, %(logbase)s) - log(%(ix1)s, %(logbase)s)) * (%(ox2)s - %(ox1)s)" % {
-                "ox1": repr(ox1), "ox2": repr(ox2), "ix1": repr(ix1), "ix2": repr(ix2), "minusInfinityX": repr(minusInfinityX), "logbase": xlogbase}
+        logbase = float("%s" % xlogbase)  # the base as it appears in the expression
+        xfunc = "x <= 0 and %(minusInfinityX)s or %(ox1)s + 1.*(log(x, %(logbase)s) - %(logix1)s)/%(logdiff)s * (%(ox2)s - %(ox1)s)" % {
+                "ox1": repr(ox1), "ox2": repr(ox2), "logix1": repr(math.log(ix1, logbase)), "logdiff": repr(math.log(ix2, logbase) - math.log(ix1, logbase)), "minusInfinityX": repr(minusInfinityX), "logbase": xlogbase}
         xlogstr = " xlog=%g" % xlogbase
 
     if ylogbase is None:
         yfunc = "%(oy1)s + 1.*(y - %(iy1)s)/(%(iy2)s - %(iy1)s) * (%(oy2)s - %(oy1)s)" % {
                 "oy1": repr(oy1), "oy2": repr(oy2), "iy1": repr(iy1), "iy2": repr(iy2)}
     else:
-        yfunc = "y <= 0 and %(minusInfinityY)s or %(oy1)s + 1.*(log(y, %(logbase)s) - log(%(iy1)s, %(logbase)s))/(log(%(iy2)s, %(logbase)s) - log(%(iy1)s, %(logbase)s)) * (%(oy2)s - %(oy1)s)" % {
-                "oy1": repr(oy1), "oy2": repr(oy2), "iy1": repr(iy1), "iy2": repr(iy2), "minusInfinityY": repr(minusInfinityY), "logbase": ylogbase}
+        logbase = float("%s" % ylogbase)  # the base as it appears in the expression
+        yfunc = "y <= 0 and %(minusInfinityY)s or %(oy1)s + 1.*(log(y, %(logbase)s) - %(logiy1)s)/%(logdiff)s * (%(oy2)s - %(oy1)s)" % {
+                "oy1": repr(oy1), "oy2": repr(oy2), "logiy1": repr(math.log(iy1, logbase)), "logdiff": repr(math.log(iy2, logbase) - math.log(iy1, logbase)), "minusInfinityY": repr(minusInfinityY), "logbase": ylogbase}
         ylogstr = " ylog=%g" % ylogbase
 
     output = eval("lambda x,y: (%s, %s)" % (xfunc, yfunc), math.__dict__)
     output.func_name = "(%g, %g), (%g, %g) -> (%g, %g), (%g, %g)%s%s" % (ix1, ix2, iy1, iy2, ox1, ox2, oy1, oy2, xlogstr, ylogstr)
+    output.apply = eval("lambda xs, ys: ([%s for x in xs], [%s for y in ys])" % (xfunc, yfunc), math.__dict__)  # x and y are independent
     return output
 
 def rotation(angle, cx=0, cy=0):
-    output = eval("lambda x,y: (%(cx)s + cos(%(angle)s)*(x - %(cx)s) - sin(%(angle)s)*(y - %(cy)s), %(cy)s + sin(%(angle)s)*(x - %(cx)s) + cos(%(angle)s)*(y - %(cy)s))" % {"cx": repr(cx), "cy": repr(cy), "angle": repr(angle)}, math.__dict__)
-    output.func_name = "rotation %g around %g %g" % (angle, cx, cy)
-    return output
-
+    cos, sin = math.cos(angle), math.sin(angle)
+    return svg.Affine(cos, sin, -sin, cos, cx - cos*cx + sin*cy, cy - sin*cx - cos*cy,
+                      name="rotation %g around %g %g" % (angle, cx, cy))